@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Binary files with a set of named numpy arrays, used by the curve and channel files.
+
+A file has a fixed preamble (magic bytes, format version and header length), a JSON header and the
+data arrays, each one aligned to 64 bytes. The header stores the dtype, shape and offset of each array
+(plus any other header values of the format), so arrays are opened lazily with numpy.memmap.
+
+In appendable files the header after the preamble is a fixed-size stub with the position and length of
+the real header, which is written after the arrays. New arrays are appended at the end of the file
+followed by a new header, and the stub is updated at the end, so the arrays already in the file are not
+rewritten (see append_array_file).
+"""
+
+import json
+import os
+import struct
+import numpy as np
+
+ALIGN = 64
+PREAMBLE = struct.Struct("<8sII")
+STUB_LENGTH = ALIGN - PREAMBLE.size
+
+
+def has_magic(path, magic):
+    """
+    Returns True if the file starts with the given magic bytes
+    """
+    with open(path, "rb") as f:
+        return f.read(len(magic)) == magic
+
+
+def _stub(position, length):
+    # Fixed-size header of appendable files with the position and length of the real header
+    stub = json.dumps({"header": position, "length": length}).encode("utf8")
+    return stub + b" " * (STUB_LENGTH - len(stub))
+
+
+def _append_arrays(f, arrays):
+    # Writes the arrays at the end of an appendable file and returns their info
+    info = {}
+    f.seek(0, os.SEEK_END)
+    f.write(b"\0" * (-f.tell() % ALIGN))
+    for key, arr in arrays.items():
+        info[key] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": f.tell() - ALIGN}
+        f.write(np.ascontiguousarray(arr).tobytes())
+        f.write(b"\0" * (-arr.nbytes % ALIGN))
+    return info
+
+
+def _append_header(f, header):
+    # Writes the header at the end of an appendable file and then points the stub to it, so the file
+    # keeps its previous header until the new one is complete
+    f.seek(0, os.SEEK_END)
+    position = f.tell()
+    data = json.dumps(header).encode("utf8")
+    f.write(data)
+    f.flush()
+    os.fsync(f.fileno())
+    f.seek(PREAMBLE.size)
+    f.write(_stub(position, len(data)))
+
+
+def write_array_file(path, magic, version, header, arrays, appendable=False):
+    """
+    Writes a set of arrays to a binary file. The file is written to a temporary file that replaces the
+    output file at the end, so the output file is not left half-written if writing fails. A file cannot
+    be replaced while it is memory-mapped (Windows locks the file), so the arrays opened from it with
+    open_array_file must be released first.
+
+    Parameters
+    ----------
+    path : str
+        Path of the output file
+    magic : bytes
+        Magic bytes of the format (8 bytes)
+    version : int
+        Format version
+    header : dict
+        Other header values (JSON serializable)
+    arrays : dict
+        Arrays to write (name: numpy.ndarray), written in this order
+    appendable : bool
+        If True, the file is written as an appendable file (see append_array_file)
+    """
+    tmp_path = path + ".tmp"
+    if appendable:
+        with open(tmp_path, "wb") as f:
+            f.write(PREAMBLE.pack(magic, version, STUB_LENGTH))
+            f.write(_stub(0, 0))
+            info = _append_arrays(f, arrays)
+            _append_header(f, {"version": version, **header, "arrays": info})
+        os.replace(tmp_path, path)
+        return
+
+    # Array offsets are relative to the start of the data block
+    info = {}
+    offset = 0
+    for key, arr in arrays.items():
+        info[key] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        offset += -(-arr.nbytes // ALIGN) * ALIGN
+    header = json.dumps({"version": version, **header, "arrays": info}).encode("utf8")
+    header += b" " * (-(PREAMBLE.size + len(header)) % ALIGN)
+
+    with open(tmp_path, "wb") as f:
+        f.write(PREAMBLE.pack(magic, version, len(header)))
+        f.write(header)
+        for key, arr in arrays.items():
+            f.write(np.ascontiguousarray(arr).tobytes())
+            f.write(b"\0" * (-arr.nbytes % ALIGN))
+    os.replace(tmp_path, path)
+
+
+def append_array_file(path, magic, header, arrays, keep=()):
+    """
+    Appends arrays to an appendable file and replaces its header. Arrays of the previous header that
+    are not kept remain in the file as unused space.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file (written by write_array_file with appendable=True)
+    magic : bytes
+        Magic bytes of the format
+    header : dict
+        New header values (JSON serializable, the format version is kept)
+    arrays : dict
+        Arrays to append (name: numpy.ndarray)
+    keep : iterable
+        Names of the arrays already in the file that are kept in the new header
+    """
+    old_header, start = _read_header(path, magic)
+    if "stub" not in old_header:
+        raise TypeError("{} is not an appendable file".format(path))
+    with open(path, "r+b") as f:
+        info = {key: old_header["arrays"][key] for key in keep}
+        info.update(_append_arrays(f, arrays))
+        _append_header(f, {"version": old_header["version"], **header, "arrays": info})
+
+
+def _read_header(path, magic, max_version=None, description="binary"):
+    # Reads the header of a file and returns it with the start of its data block
+    with open(path, "rb") as f:
+        file_magic, version, length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+        if file_magic != magic:
+            raise TypeError("{} is not a {} file".format(path, description))
+        if max_version is not None and version > max_version:
+            raise TypeError("{} file version {} is not supported".format(description.capitalize(), version))
+        header = json.loads(f.read(length).decode("utf8"))
+        if length == STUB_LENGTH and "header" in header:
+            # Appendable file, the header is after the arrays
+            stub = header
+            f.seek(stub["header"])
+            header = json.loads(f.read(stub["length"]).decode("utf8"))
+            header["stub"] = stub
+    header["version"] = version
+    return header, PREAMBLE.size + length
+
+
+def open_array_file(path, magic, max_version, description):
+    """
+    Opens a binary file written by write_array_file. Arrays are memory-mapped (empty arrays are
+    created in memory).
+
+    Parameters
+    ----------
+    path : str
+        Path of the file
+    magic : bytes
+        Magic bytes of the format
+    max_version : int
+        Newest format version supported
+    description : str
+        Name of the format, for the error messages (e.g. "channel")
+
+    Returns
+    -------
+    tuple (header, arrays)
+        Header values (dict, with the format version in "version") and arrays (dict)
+    """
+    header, start = _read_header(path, magic, max_version, description)
+    arrays = {}
+    for key, info in header.pop("arrays").items():
+        shape = tuple(info["shape"])
+        if int(np.prod(shape)) == 0:
+            arrays[key] = np.zeros(shape, info["dtype"])
+        else:
+            arrays[key] = np.memmap(path, info["dtype"], "r", start + info["offset"], shape)
+    return header, arrays
@@ -1 +1 @@
-# -*- coding: utf-8 -*-from qgis.PyQt.QtCore import QCoreApplicationfrom qgis.core import QgsProcessingAlgorithm, QgsProcessingParameterRasterLayer, QgsProcessingParameterRasterDestinationfrom qgis.core import QgsProcessing, QgsProcessingParameterField, QgsProcessingParameterFeatureSourcefrom qgis.core import QgsProcessingParameterBoolean, QgsProcessingParameterNumberfrom landspy import DEM, Flowfrom qgis import processingimport numpy as npclass DrainageBasins(QgsProcessingAlgorithm):    # Constants used to refer to parameters and outputs They will be    # used when calling the algorithm from another algorithm, or when    # calling from the QGIS console.    INPUT_FD = 'INPUT_FD'    POUR_POINTS = 'POUR_POINTS'    ID_FIELD = 'ID_FIELD'    BASINS = 'BASINS'    SNAP_POINTS = 'SNAP_POINTS'    THRESHOLD = 'THRESHOLD'     def __init__(self):        super().__init__()    def createInstance(self):        return type(self)()     def name(self):        """        Rerturns the algorithm name, used to identify the algorithm.        Must be unique within each provider and should contain lowercase alphanumeric characters only.        """        return "basin"         def displayName(self):        """        Returns the translated algorithm name, which should be used for any        user-visible display of the algorithm name.        """        return self.tr("Drainage Basins")         def groupId(self):        """        Returns the unique ID of the group this algorithm belongs to.        """        return "drainage_net_processing"    def group(self):        """        Returns the name of the group this algoritm belongs to.        """        return self.tr("Drainage Network Processing")    def shortHelpString(self):        """        Returns a localised short helper string for the algorithm.         """        texto = """                    This script extract drainage basins for the input pour points                    Flow Direction: Input Flow Direction Raster                    Pour points: Pour points of the drainage basins. Will be snapped to the closest channel cell (threshold = number of cells * 0.0025).                    Id field: Field with the basin ids                    Drainage Basins : Output drainage basins (raster)                    """        return texto     def tr(self, string):        return QCoreApplication.translate('Processing', string)    def helpUrl(self):        return "https://github.com/geolovic/qgs_landspy"    def initAlgorithm(self, config=None):        """        Here we define the inputs and output of the algorithm, along        with some other properties.        """        self.addParameter(QgsProcessingParameterRasterLayer(self.INPUT_FD, self.tr("Flow Direction")))        self.addParameter(QgsProcessingParameterFeatureSource(self.POUR_POINTS, self.tr("Pour Points"), [QgsProcessing.TypeVectorPoint]))        self.addParameter(QgsProcessingParameterField(self.ID_FIELD, self.tr("Id Field"), parentLayerParameterName=self.POUR_POINTS, type=QgsProcessingParameterField.Numeric, optional=True))        self.addParameter(QgsProcessingParameterRasterDestination(self.BASINS, self.tr("Output Drainage Basins")))        self.addParameter(QgsProcessingParameterBoolean(self.SNAP_POINTS, self.tr("Snap Points"), defaultValue=False, optional=True))        self.addParameter(QgsProcessingParameterNumber(self.THRESHOLD, self.tr("Threshold"), type=QgsProcessingParameterNumber.Integer, optional=True))    def processAlgorithm(self, parameters, context, feedback):        """        Here is where the processing itself takes place.        """        input_fd = self.parameterAsRasterLayer(parameters, self.INPUT_FD, context)        pour_points = self.parameterAsVectorLayer(parameters, self.POUR_POINTS, context)        id_field = self.parameterAsString(parameters, self.ID_FIELD, context)        output_basins = self.parameterAsOutputLayer(parameters, self.BASINS, context)        snap_points = self.parameterAsBool(parameters, self.SNAP_POINTS, context)        th = self.parameterAsInt(parameters, self.THRESHOLD, context)                fd = Flow(input_fd.source())        field_idx = pour_points.fields().indexFromName(id_field)        puntos = []        for n, feat in enumerate(pour_points.getFeatures()):            if field_idx >= 0:                idx = feat[field_idx]            else:                idx = n + 1            pto = feat.geometry().asPoint()            puntos.append([pto.x(), pto.y(), idx])                    puntos = np.array(puntos)        if snap_points:            if not th:                th = int(fd.getNCells() * 0.001)            puntos = fd.snapPoints(puntos, th, "channel")        basins = fd.drainageBasins(puntos)        basins.save(output_basins)                results = {self.BASINS: output_basins}        return results
\ No newline at end of file
+# -*- coding: utf-8 -*-from qgis.PyQt.QtCore import QCoreApplicationfrom qgis.core import QgsProcessingAlgorithm, QgsProcessingParameterRasterLayer, QgsProcessingParameterRasterDestinationfrom qgis.core import QgsProcessing, QgsProcessingParameterField, QgsProcessingParameterFeatureSourcefrom qgis.core import QgsProcessingParameterBoolean, QgsProcessingParameterNumber, QgsProcessingParameterFeatureSinkfrom qgis.core import QgsProcessingParameterEnum, QgsProcessingParameterFolderDestinationfrom qgis.core import QgsFeatureSink, QgsFields, QgsField, QgsFeature, QgsGeometry, QgsWkbTypes, QgsCoordinateReferenceSystemfrom qgis.PyQt.QtCore import QVariantfrom landspy import DEM, Flow, Gridfrom qgis import processingfrom osgeo import gdal, ogrimport numpy as npimport osimport timefrom .network_tools import label_basins, basin_parents, snap_points, strahler_order, area_outlets, NetworkGeometryfrom .raster_tools import zonal_sums, zonal_statistics, merge_sums, clip_by_labelsdef basin_polygons(labels, geot):    """    Converts a basin label array to polygons (GDAL Polygonize with 8-connectivity, since D8 basins can    be connected only by cell corners). Parts with the same label are collected in one geometry.    Parameters    ----------    labels : numpy.ndarray        Array with basin ids (0 = no basin)    geot : tuple        Geotransform of the label array    Returns    -------    dict        Dictionary {basin id: QgsGeometry}    """    raster = gdal.GetDriverByName("MEM").Create("", labels.shape[1], labels.shape[0], 1, gdal.GDT_Int32)    raster.SetGeoTransform(geot)    band = raster.GetRasterBand(1)    band.WriteArray(labels.astype(np.int32))    vector = ogr.GetDriverByName("Memory").CreateDataSource("")    layer = vector.CreateLayer("basins", None, ogr.wkbPolygon)    layer.CreateField(ogr.FieldDefn("bid", ogr.OFTInteger))    gdal.Polygonize(band, band, layer, 0, ["8CONNECTED=8"])    parts = {}    for feat in layer:        geom = QgsGeometry()        geom.fromWkb(bytes(feat.GetGeometryRef().ExportToWkb()))        parts.setdefault(feat.GetField(0), []).append(geom)    return {bid: QgsGeometry.collectGeometry(geoms) if len(geoms) > 1 else geoms[0]            for bid, geoms in parts.items()}def basin_tree(bids, parents):    """    Sorts the basins of a basin tree from the leaves to the roots    Parameters    ----------    bids : iterable        Basin ids    parents : dict        Dictionary {basin id: parent basin id} (0 for root basins)    Returns    -------    tuple (order, children)        order : List of basin ids, every basin appears after all its descendants        children : Dictionary {basin id: list of children ids}    """    bids = set(bids)    depth = {}    for bid in bids:        path = []        node = bid        while node in bids and node not in depth:            path.append(node)            node = parents.get(node, 0)        base = depth.get(node, -1)        for node in path[::-1]:            base += 1            depth[node] = base    children = {}    for bid in bids:        children.setdefault(parents.get(bid, 0), []).append(bid)    return sorted(bids, key=lambda b: -depth[b]), childrendef full_basins(polygons, parents):    """    Assembles full basin polygons from incremental (inter-basin) polygons by dissolving each basin    with all its descendants. Basins are processed from the leaves of the basin tree to the roots,    so every basin is dissolved only with the (already assembled) polygons of its children.    Parameters    ----------    polygons : dict        Dictionary {basin id: QgsGeometry} with the incremental basins    parents : dict        Dictionary {basin id: parent basin id} (0 for root basins)    Returns    -------    dict        Dictionary {basin id: QgsGeometry} with the full basins    """    order, children = basin_tree(polygons, parents)    full = {}    for bid in order:        parts = [polygons[bid]] + [full[child] for child in children.get(bid, []) if child in full]        full[bid] = QgsGeometry.unaryUnion(parts) if len(parts) > 1 else parts[0]    return fullclass DrainageBasins(QgsProcessingAlgorithm):    # Constants used to refer to parameters and outputs They will be    # used when calling the algorithm from another algorithm, or when    # calling from the QGIS console.    INPUT_FD = 'INPUT_FD'    POUR_POINTS = 'POUR_POINTS'    ID_FIELD = 'ID_FIELD'    BASINS = 'BASINS'    SNAP_POINTS = 'SNAP_POINTS'    THRESHOLD = 'THRESHOLD'    BASINS_SHP = 'BASINS_SHP'    FULL_BASINS = 'FULL_BASINS'    SNAP_RADIUS = 'SNAP_RADIUS'    OUTLETS = 'OUTLETS'    ORDER = 'ORDER'    MIN_AREA = 'MIN_AREA'    MAX_AREA = 'MAX_AREA'    INPUT_DEM = 'INPUT_DEM'    CLIP_FOLDER = 'CLIP_FOLDER'    MAX_THREADS = 'MAX_THREADS'     def __init__(self):        super().__init__()    def createInstance(self):        return type(self)()     def name(self):        """        Rerturns the algorithm name, used to identify the algorithm.        Must be unique within each provider and should contain lowercase alphanumeric characters only.        """        return "basin"         def displayName(self):        """        Returns the translated algorithm name, which should be used for any        user-visible display of the algorithm name.        """        return self.tr("Drainage Basins")         def groupId(self):        """        Returns the unique ID of the group this algorithm belongs to.        """        return "drainage_net_processing"    def group(self):        """        Returns the name of the group this algoritm belongs to.        """        return self.tr("Drainage Network Processing")    def shortHelpString(self):        """        Returns a localised short helper string for the algorithm.         """        texto = """                    This script extract drainage basins for the input pour points                    Flow Direction: Input Flow Direction Raster                    Outlets: Method to get the basin outlets                      - Pour points: Outlets are the input pour points                      - Stream order: Outlets of all the streams with the given Strahler order (channel cells defined by the threshold)                      - Area range: Outlets of the largest basins with drainage area between Min. area and Max. area                    Pour points [Optional]: Pour points of the drainage basins (see Snap Points).                    Id field: Field with the basin ids                    Snap Points: Snap pour points to channel cells (flow accumulation >= threshold)                    Threshold [Optional]: Threshold (number of cells) for the channel cells to snap the pour points and to calculate stream orders (default = number of cells * 0.001)                    Snap radius [Optional]: Pour points are snapped to the channel cell with the maximum flow accumulation within this radius (map units). If 0, they are snapped to the closest channel cell.                    Stream order: Strahler order of the basins (Stream order method)                    Min. area / Max. area: Range of drainage areas in km2 (Area range method)                    Drainage Basins : Output drainage basins (raster)                    DEM [Optional]: Digital Elevation Model (same extent and cell size as the flow) to calculate basin elevation statistics                    Basin polygons [Optional]: Output drainage basins (polygons) with the id of the parent basin (basin that receives its flow, 0 = none) and basin statistics: area, perimeter (length of the polygon boundary), and, if a DEM is given, mean elevation (z_mean), relief and mean slope (m/m)                    Clipped DEMs [Optional]: Output folder to write a clipped DEM for each basin (basin_[id].tif), cells outside the basin are set to NoData. A DEM is needed.                    Threads: Number of basin DEMs written concurrently                    Full basins: If checked, polygons are full basins (nested basins are dissolved into the basins that contain them), otherwise polygons are incremental basins as in the raster output                    All the basins are labelled at once in a single sweep over the flow cells, regardless the number of pour points.                    """        return texto     def tr(self, string):        return QCoreApplication.translate('Processing', string)    def helpUrl(self):        return "https://github.com/geolovic/qgs_landspy"    def initAlgorithm(self, config=None):        """        Here we define the inputs and output of the algorithm, along        with some other properties.        """        self.addParameter(QgsProcessingParameterRasterLayer(self.INPUT_FD, self.tr("Flow Direction")))        self.addParameter(QgsProcessingParameterEnum(self.OUTLETS, self.tr("Outlets"), options=[self.tr("Pour points"), self.tr("Stream order"), self.tr("Area range")], defaultValue=0))        self.addParameter(QgsProcessingParameterFeatureSource(self.POUR_POINTS, self.tr("Pour Points"), [QgsProcessing.TypeVectorPoint], optional=True))        self.addParameter(QgsProcessingParameterField(self.ID_FIELD, self.tr("Id Field"), parentLayerParameterName=self.POUR_POINTS, type=QgsProcessingParameterField.Numeric, optional=True))        self.addParameter(QgsProcessingParameterRasterDestination(self.BASINS, self.tr("Output Drainage Basins")))        self.addParameter(QgsProcessingParameterBoolean(self.SNAP_POINTS, self.tr("Snap Points"), defaultValue=False, optional=True))        self.addParameter(QgsProcessingParameterNumber(self.THRESHOLD, self.tr("Threshold"), type=QgsProcessingParameterNumber.Integer, optional=True))        self.addParameter(QgsProcessingParameterNumber(self.SNAP_RADIUS, self.tr("Snap radius"), type=QgsProcessingParameterNumber.Double, defaultValue=0.0, optional=True))        self.addParameter(QgsProcessingParameterNumber(self.ORDER, self.tr("Stream order"), type=QgsProcessingParameterNumber.Integer, defaultValue=3, minValue=1, optional=True))        self.addParameter(QgsProcessingParameterNumber(self.MIN_AREA, self.tr("Min. area (km2)"), type=QgsProcessingParameterNumber.Double, defaultValue=5.0, minValue=0.0, optional=True))        self.addParameter(QgsProcessingParameterNumber(self.MAX_AREA, self.tr("Max. area (km2)"), type=QgsProcessingParameterNumber.Double, defaultValue=50.0, minValue=0.0, optional=True))        self.addParameter(QgsProcessingParameterRasterLayer(self.INPUT_DEM, self.tr("DEM"), optional=True))        self.addParameter(QgsProcessingParameterFeatureSink(self.BASINS_SHP, self.tr("Basin polygons"), QgsProcessing.TypeVectorPolygon, None, True, False))        self.addParameter(QgsProcessingParameterBoolean(self.FULL_BASINS, self.tr("Full basins"), defaultValue=False, optional=True))        self.addParameter(QgsProcessingParameterFolderDestination(self.CLIP_FOLDER, self.tr("Clipped DEMs"), None, True, False))        self.addParameter(QgsProcessingParameterNumber(self.MAX_THREADS, self.tr("Threads"), type=QgsProcessingParameterNumber.Integer, defaultValue=4, minValue=1, maxValue=64, optional=True))    def processAlgorithm(self, parameters, context, feedback):        """        Here is where the processing itself takes place.        """        input_fd = self.parameterAsRasterLayer(parameters, self.INPUT_FD, context)        pour_points = self.parameterAsVectorLayer(parameters, self.POUR_POINTS, context)        id_field = self.parameterAsString(parameters, self.ID_FIELD, context)        output_basins = self.parameterAsOutputLayer(parameters, self.BASINS, context)        snap = self.parameterAsBool(parameters, self.SNAP_POINTS, context)        th = self.parameterAsInt(parameters, self.THRESHOLD, context)        full = self.parameterAsBool(parameters, self.FULL_BASINS, context)        radius = self.parameterAsDouble(parameters, self.SNAP_RADIUS, context)        method = self.parameterAsEnum(parameters, self.OUTLETS, context)        order = self.parameterAsInt(parameters, self.ORDER, context)        min_area = self.parameterAsDouble(parameters, self.MIN_AREA, context)        max_area = self.parameterAsDouble(parameters, self.MAX_AREA, context)        input_dem = self.parameterAsRasterLayer(parameters, self.INPUT_DEM, context)        clip_folder = self.parameterAsString(parameters, self.CLIP_FOLDER, context)        max_threads = self.parameterAsInt(parameters, self.MAX_THREADS, context)                fd = Flow(input_fd.source())        if not th:            th = int(fd.getNCells() * 0.001)        if method == 1:            # Outlets of the streams of the given order            net = NetworkGeometry(fd, th)            orders = strahler_order(net.rpos)            rcv_order = np.where(net.rpos >= 0, orders[np.where(net.rpos >= 0, net.rpos, 0)], order + 1)            outlets = net.ix[(orders == order) & (rcv_order > order)]        elif method == 2:            # Outlets of the largest basins within the area range (km2)            fac = fd.flowAccumulation(nodata=False, asgrid=False)            cellarea = abs(fd.getCellSize()[0] * fd.getCellSize()[1])            outlets = area_outlets(fd._ix, fd._ixc, fac * cellarea / 1e6, min_area, max_area)        else:            outlets = None        if outlets is not None:            if outlets.size == 0:                feedback.reportError("No basins found with the given criteria!!")                return {}            feedback.pushInfo("{} outlets found".format(outlets.size))            row, col = fd.indToCell(outlets)            x, y = fd.cellToXY(row, col)            puntos = np.array((x, y, np.arange(outlets.size) + 1)).T            snap = False        elif pour_points is None:            feedback.reportError("Pour points are needed with the Pour points method!!")            return {}        else:            field_idx = pour_points.fields().indexFromName(id_field)            puntos = []            for n, feat in enumerate(pour_points.getFeatures()):                if field_idx >= 0:                    idx = feat[field_idx]                else:                    idx = n + 1                pto = feat.geometry().asPoint()                puntos.append([pto.x(), pto.y(), idx])            puntos = np.array(puntos)            if puntos.size == 0:                feedback.reportError("No pour points in the input layer!!")                return {}        if snap:            fac = fd.flowAccumulation(nodata=False, asgrid=False)            row, col = np.where(fac >= th)            x, y = fd.cellToXY(row, col)            pos = snap_points(puntos, np.array((x, y)).T, fac[row, col], radius, fd.getCellSize()[0])            puntos[:, 0] = x[pos]            puntos[:, 1] = y[pos]        if not np.all(fd.isInside(puntos[:, 0], puntos[:, 1])):            feedback.reportError("Some pour points are outside the flow raster!!")            return {}        # Label all the basins in one sweep        row, col = fd.xyToCell(puntos[:, 0], puntos[:, 1])        outlets = fd.cellToInd(row, col)        bids = puntos[:, 2].astype(np.int64)        if bids.min() <= 0:            feedback.reportError("Basin ids must be positive integers!!")            return {}        labels = label_basins(fd._ix, fd._ixc, fd.getNCells(), outlets, bids).reshape(fd.getDims())        parents = dict(zip(bids.tolist(), basin_parents(fd._ix, fd._ixc, fd.getNCells(), outlets, labels).tolist()))        basins = Grid()        basins.copyLayout(fd)        basins.setArray(labels)        basins.setNodata(0)        basins.save(output_basins)        results = {self.BASINS: output_basins}        # Basin statistics from the label array (and the DEM)        dem = None        if input_dem is not None:            dem = DEM(input_dem.source())            if dem.getDims() != fd.getDims():                feedback.reportError("DEM and Flow Direction have different dimensions, basin elevations will not be calculated")                dem = None        if dem is None:            sums = zonal_sums(labels, cellsize=fd.getCellSize())        else:            sums = zonal_sums(labels, dem.readArray(), fd.getCellSize(), dem.getNodata())        stat_names = ["area", "perimeter", "z_mean", "relief", "slope"] if dem is not None else ["area", "perimeter"]        fields = QgsFields()        fields.append(QgsField("bid", QVariant.Int))        fields.append(QgsField("parent", QVariant.Int))        for name in stat_names:            fields.append(QgsField(name, QVariant.Double))        sink, dest_id = self.parameterAsSink(parameters, self.BASINS_SHP, context, fields, QgsWkbTypes.MultiPolygon,                                             QgsCoordinateReferenceSystem(fd.getCRS()))        if sink is not None:            polygons = basin_polygons(labels, fd.getGeot())            if full:                polygons = full_basins(polygons, parents)                # Full basins statistics, nested basins are added to the basins that contain them                order, children = basin_tree(polygons, parents)                for bid in order:                    for child in children.get(bid, []):                        merge_sums(sums, bid, child)            stats = zonal_statistics(sums, fd.getCellSize())            # Rows of the basins in the statistics, the perimeter is the length of the output polygons            bids = sorted(polygons)            rows = np.searchsorted(stats["ids"], bids)            stats["perimeter"] = np.zeros(stats["ids"].size)            stats["perimeter"][rows] = [polygons[bid].length() for bid in bids]            table = np.array([stats[name][rows] for name in stat_names]).T.tolist()            features = []            for n, bid in enumerate(bids):                geom = polygons[bid]                feat = QgsFeature(fields)                geom.convertToMultiType()                feat.setGeometry(geom)                feat.setAttributes([int(bid), int(parents.get(bid, 0))] + table[n])                features.append(feat)            sink.addFeatures(features, QgsFeatureSink.FastInsert)            results[self.BASINS_SHP] = dest_id        if clip_folder:            if dem is None:                feedback.reportError("A DEM is needed to write the clipped DEMs!!")                return results            # Zones are the incremental basins, or each basin with all its descendants for full basins            present = set(np.unique(labels).tolist()) - {0}            zones = {bid: [bid] for bid in present}            if full:                order, children = basin_tree(present, parents)                for bid in order:                    for child in children.get(bid, []):                        zones[bid] = zones[bid] + zones[child]            os.makedirs(clip_folder, exist_ok=True)            t0 = time.perf_counter()            written = clip_by_labels(input_dem.source(), labels, [(os.path.join(clip_folder, "basin_{}.tif".format(bid)), ids)                                                                  for bid, ids in sorted(zones.items())], max_threads)            feedback.pushInfo("{} clipped DEMs written in {:.2f} s".format(len(written), time.perf_counter() - t0))            results[self.CLIP_FOLDER] = clip_folder        return results
\ No newline at end of file
@@ -0,0 +1,779 @@
+# -*- coding: utf-8 -*-
+"""
+Collection of channels stored in flat buffers, and file format to store many channels.
+
+The vertex attributes of all the channels are concatenated in a few large arrays (cell indexes as int64
+and the other attributes as float32, one row per attribute) and each channel is a (start, size) entry
+of an offsets table. Adding a channel appends its vertices at the end of the buffers (which grow by
+doubling their capacity), and removing a channel only drops its entry, so the buffers are never copied
+on every edit as with numpy.insert / numpy.delete on an array of Channel objects. The space of removed
+channels is reclaimed when it exceeds half of the buffers.
+
+A channel file is an appendable array file (see array_file.py). Its header has the schema version, the
+number of channels, their coordinate system (stored once for all the channels) and the number of
+vertices of each vertex segment. The index has an entry per channel and the vertex attributes are
+stored as columns, one set of columns per segment:
+
+    ix.S               : int64 (V)          Cell indexes of the vertices of the segment S
+    ax.S, dx.S, zx.S,
+    zx0.S, chi.S,
+    slp.S, ksn.S,
+    r2slp.S, r2ksn.S,
+    dd.S               : float32 (V)        Vertex attributes of the segment S (see FIELDS)
+    start, count       : int64 (N)          Position (in all the segments) and number of vertices
+    oid, flow          : int64 (N)          Channel ids and ids of the channels where they flow
+    bbox               : float64 (N x 4)    Bounding box of each channel (xmin, ymin, xmax, ymax)
+    raster             : int64 (N x 2)      Raster size of each channel
+    geot               : float64 (N x 6)    Geotransformation matrix of each channel
+    params             : float64 (N x 4)    thetaref, chi0, slp_np and ksn_np of each channel
+    kp_offsets, kp     : int64              Knickpoints (position, type) of the channels
+    reg_offsets, reg   : int64, float64     Regressions (id, p1, p2, a, b, r2) of the channels
+    name_offsets,
+    name_data          : int64, uint8       Channel names (UTF-8)
+
+Arrays are memory-mapped, so a file with many channels is opened reading only its header and index.
+When the channels of a file are saved back to the same file, only the vertices of the new and edited
+channels are appended as a new segment, followed by a new index (the file is rewritten when its
+unused vertices exceed the used ones). Files of version 1 (a single set of vertex columns with an
+offsets array and no bounding boxes) can still be read.
+
+landspy.Channel objects are only created when a channel is accessed and kept in a cache with a memory
+limit (least recently used channels leave the cache first). Cached channels can be edited as usual, and
+their values are written back to the buffers when they leave the cache (or on flush). Channels of a
+channel file that were not edited are read again from the file when needed.
+"""
+
+import os
+from collections import OrderedDict
+import numpy as np
+from landspy import Channel
+from .array_file import has_magic, write_array_file, append_array_file, open_array_file
+
+MAGIC = b"CHANNELS"
+VERSION = 2
+
+# Float attributes of the channel vertices (rows of the float buffer)
+FIELDS = ("_ax", "_dx", "_zx", "_zx0", "_chi", "_slp", "_ksn", "_r2slp", "_r2ksn", "_dd")
+
+# Bytes of a vertex of a landspy.Channel (int64 cell index and float64 attributes)
+VERTEX_BYTES = 8 * (len(FIELDS) + 1)
+
+
+def _channel_info(canal):
+    # Channel properties that are not vertex attributes
+    return {"name": canal._name, "oid": int(canal._oid), "flow": int(canal._flowto), "size": tuple(canal._size),
+            "geot": tuple(canal._geot), "proj": canal._proj, "thetaref": canal._thetaref, "chi0": canal._chi0,
+            "slp_np": canal._slp_np, "ksn_np": canal._ksn_np, "kp": np.array(canal._kp, int).reshape(-1, 2),
+            "regressions": list(canal._regressions)}
+
+
+def _same_info(info1, info2):
+    # True if two channel property dictionaries (see _channel_info) are equal
+    for key, value in info1.items():
+        if key == "kp":
+            if not np.array_equal(value, info2[key]):
+                return False
+        elif key == "regressions":
+            if len(value) != len(info2[key]):
+                return False
+            for reg1, reg2 in zip(value, info2[key]):
+                if tuple(reg1[:3]) != tuple(reg2[:3]) or not np.allclose(reg1[3], reg2[3]) or reg1[4] != reg2[4]:
+                    return False
+        elif value != info2[key]:
+            return False
+    return True
+
+
+def is_channel_file(path):
+    """
+    Returns True if the file is a channel file (checks the magic bytes)
+    """
+    return has_magic(path, MAGIC)
+
+
+def _bounding_box(xy):
+    # Bounding box (xmin, ymin, xmax, ymax) of a two-columns array of coordinates
+    if xy.size == 0:
+        return np.full(4, np.nan)
+    return np.concatenate((xy.min(axis=0), xy.max(axis=0)))
+
+
+def _cell_xy(ix, ncols, geot):
+    # Coordinates of the cell centers of linear cell indexes (as landspy indToCell and cellToXY)
+    row, col = np.divmod(ix, ncols)
+    return np.array((geot[0] + geot[1] * col + geot[1] / 2, geot[3] + geot[5] * row + geot[5] / 2)).T
+
+
+class ChannelStore:
+    """
+    Read-only access to a channel file. Arrays are memory-mapped, so channels are only read when used.
+
+    Parameters
+    ----------
+    path : str
+        Path to the channel file
+    """
+    def __init__(self, path):
+        header, self._arrays = open_array_file(path, MAGIC, VERSION, "channel")
+        arrays = self._arrays
+        self.path = path
+        self.version = header["version"]
+        self.crs = header["crs"]
+        self.appendable = "stub" in header
+        self._count = header["count"]
+        self._names = None
+        keys = ["ix"] + [key[1:] for key in FIELDS]
+        if self.version == 1:
+            offsets = arrays["offsets"]
+            self._starts, self._counts = offsets[:-1], np.diff(offsets)
+            self._segments = [{key: arrays[key] for key in keys}]
+        else:
+            self._starts, self._counts = arrays["start"], arrays["count"]
+            self._segments = [{key: arrays["{}.{}".format(key, n)] for key in keys}
+                              for n in range(len(header["segments"]))]
+        self._bases = np.concatenate(([0], np.cumsum([seg["ix"].size for seg in self._segments])))
+        self.nvertices = int(self._bases[-1])
+
+    def __len__(self):
+        return self._count
+
+    def getOids(self):
+        """
+        Returns the ids of all the channels
+        """
+        return self._arrays["oid"]
+
+    def getFlows(self):
+        """
+        Returns the flow (id of the receiver channel) of all the channels
+        """
+        return self._arrays["flow"]
+
+    def getStarts(self):
+        """
+        Returns the position of the first vertex of all the channels
+        """
+        return self._starts
+
+    def getCounts(self):
+        """
+        Returns the number of vertices of all the channels
+        """
+        return self._counts
+
+    def getNames(self):
+        """
+        Returns the names of all the channels
+        """
+        if self._names is None:
+            data = bytes(self._arrays["name_data"])
+            offsets = self._arrays["name_offsets"].tolist()
+            self._names = [data[start:end].decode("utf8") for start, end in zip(offsets[:-1], offsets[1:])]
+        return self._names
+
+    def getBBoxes(self):
+        """
+        Returns the bounding boxes (xmin, ymin, xmax, ymax) of all the channels. Bounding boxes of
+        version 1 files are calculated from the vertices.
+        """
+        if "bbox" in self._arrays:
+            return self._arrays["bbox"]
+        return np.array([_bounding_box(self.getXY(row)) for row in range(self._count)]).reshape(-1, 4)
+
+    def _locate(self, row):
+        # Segment of the channel row and position of its vertices in the segment
+        start = int(self._starts[row])
+        seg = int(np.searchsorted(self._bases, start, "right")) - 1
+        start -= int(self._bases[seg])
+        return self._segments[seg], start, start + int(self._counts[row])
+
+    def getIx(self, row):
+        """
+        Returns the cell indexes of the vertices of the channel row
+        """
+        segment, start, stop = self._locate(row)
+        return np.array(segment["ix"][start:stop])
+
+    def getXY(self, row):
+        """
+        Returns the coordinates of the vertices of the channel row (two-columns array)
+        """
+        return _cell_xy(self.getIx(row), int(self._arrays["raster"][row][0]), self._arrays["geot"][row])
+
+    def getVertices(self, row):
+        """
+        Returns the vertices of the channel row as a tuple (ix, values), with the cell indexes and a
+        float32 array with the vertex attributes (one row per attribute of FIELDS)
+        """
+        segment, start, stop = self._locate(row)
+        values = np.array([segment[key[1:]][start:stop] for key in FIELDS], np.float32).reshape(len(FIELDS), -1)
+        return np.array(segment["ix"][start:stop]), values
+
+    def getField(self, row, key):
+        """
+        Returns the values of a vertex attribute of FIELDS (e.g. "_ksn") of the channel row
+        """
+        segment, start, stop = self._locate(row)
+        return np.array(segment[key[1:]][start:stop])
+
+    def getKP(self, row):
+        """
+        Returns the knickpoints (position, type) of the channel row
+        """
+        arrays = self._arrays
+        kp = arrays["kp"][arrays["kp_offsets"][row]:arrays["kp_offsets"][row + 1]]
+        return np.array(kp, int).reshape(-1, 2)
+
+    def getRegressions(self, row):
+        """
+        Returns the regressions of the channel row, as landspy.Channel regressions (id, p1, p2, poly, r2)
+        """
+        arrays = self._arrays
+        regs = arrays["reg"][arrays["reg_offsets"][row]:arrays["reg_offsets"][row + 1]]
+        return [(int(reg[0]), int(reg[1]), int(reg[2]), np.array(reg[3:5]), float(reg[5])) for reg in regs]
+
+    def getInfo(self, row):
+        """
+        Returns the properties of the channel row (dictionary as in ChannelCollection)
+        """
+        arrays = self._arrays
+        params = arrays["params"][row]
+        return {"name": self.getNames()[row], "oid": int(arrays["oid"][row]), "flow": int(arrays["flow"][row]),
+                "size": tuple(int(val) for val in arrays["raster"][row]),
+                "geot": tuple(float(val) for val in arrays["geot"][row]), "proj": self.crs,
+                "thetaref": float(params[0]), "chi0": float(params[1]), "slp_np": int(params[2]),
+                "ksn_np": int(params[3]), "kp": self.getKP(row), "regressions": self.getRegressions(row)}
+
+    def close(self):
+        """
+        Releases the memory-mapped arrays, so the file can be replaced. The store cannot be used after it
+        """
+        self._arrays = {}
+        self._segments = []
+        self._starts = self._counts = np.empty(0, np.int64)
+
+
+class ChannelCollection:
+    """
+    Ordered collection of channels with the vertices stored in flat buffers (or in a channel file)
+
+    Parameters
+    ----------
+    channels : iterable, optional
+        landspy.Channel objects with the initial channels (added after the channels of the store)
+    store : ChannelStore, optional
+        Channel store with the initial channels
+    cache_bytes : int
+        Memory limit (bytes) of the channels kept as landspy.Channel objects. The channel in use is
+        always kept, even if it is larger.
+    """
+    def __init__(self, channels=(), store=None, cache_bytes=128 * 2 ** 20):
+        self._ix = np.empty(0, np.int64)
+        self._values = np.empty((len(FIELDS), 0), np.float32)
+        self._used = 0
+        self._garbage = 0
+        self._store = store
+        # Offsets table, store row and properties of each slot (None for removed channels or
+        # channels that are only in the store)
+        nstore = len(store) if store is not None else 0
+        self._starts = [0] * nstore
+        self._counts = [0] * nstore
+        self._rows = list(range(nstore))
+        self._info = [None] * nstore
+        # Slots (unique internal ids) in channel order, removed slots not yet taken out of the order,
+        # position of each slot (None when the order changes) and registered oid of each slot
+        self._order = list(range(nstore))
+        self._dropped = set()
+        self._positions = None
+        self._oids = store.getOids().tolist() if store is not None else []
+        # Slots of each oid (old files can have several channels with the same oid)
+        self._slots = {}
+        for slot, oid in enumerate(self._oids):
+            self._slots.setdefault(oid, []).append(slot)
+        # Least recently used cache of landspy.Channel objects
+        self._cache = OrderedDict()
+        self._cache_sizes = {}
+        self._cache_nbytes = 0
+        self._cache_bytes = cache_bytes
+        for canal in channels:
+            self.append(canal)
+
+    def __len__(self):
+        return len(self._order) - len(self._dropped)
+
+    def __getitem__(self, idx):
+        return self._channel(self._live()[idx])
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def _live(self):
+        # Slots in channel order, without the removed slots (taken out of the order at once)
+        if self._dropped:
+            self._order = [slot for slot in self._order if slot not in self._dropped]
+            self._dropped.clear()
+        return self._order
+
+    def _position(self, slot):
+        # Position of a slot in the channel order (positions are indexed again after the order changes)
+        if self._positions is None:
+            self._positions = {slot: pos for pos, slot in enumerate(self._live())}
+        return self._positions[slot]
+
+    def _register(self, slot, oid):
+        # Adds a new slot to the oid index (a duplicated oid gets a new one) and returns its oid
+        if oid in self._slots:
+            oid = max(self._slots) + 1
+        self._oids.append(oid)
+        self._slots[oid] = [slot]
+        self._positions = None
+        return oid
+
+    def _reserve(self, count):
+        # Makes room for count new vertices (the capacity of the buffers is doubled when full)
+        capacity = self._ix.size
+        if self._used + count <= capacity:
+            return
+        capacity = max(2 * capacity, self._used + count, 1024)
+        ix = np.empty(capacity, np.int64)
+        ix[:self._used] = self._ix[:self._used]
+        values = np.empty((len(FIELDS), capacity), np.float32)
+        values[:, :self._used] = self._values[:, :self._used]
+        self._ix, self._values = ix, values
+
+    def _write(self, slot, canal):
+        # Writes the vertices and properties of canal into the slot
+        count = canal._ix.size
+        if self._rows[slot] >= 0 or count != self._counts[slot]:
+            self._garbage += self._counts[slot]
+            self._reserve(count)
+            self._starts[slot] = self._used
+            self._counts[slot] = count
+            self._used += count
+            self._rows[slot] = -1
+        start = self._starts[slot]
+        self._ix[start:start + count] = canal._ix
+        for row, key in enumerate(FIELDS):
+            self._values[row, start:start + count] = getattr(canal, key)
+        self._info[slot] = _channel_info(canal)
+
+    def _sync(self, slot, canal):
+        # Writes a cached channel back to the buffers (channels of the store only if they were edited)
+        row = self._rows[slot]
+        if row >= 0:
+            ix, values = self._store.getVertices(row)
+            same = ix.size == canal._ix.size and np.array_equal(ix, canal._ix)
+            same = same and all(np.array_equal(values[n], np.asarray(getattr(canal, key), np.float32))
+                                for n, key in enumerate(FIELDS))
+            if same and _same_info(self._store.getInfo(row), _channel_info(canal)):
+                return
+        self._write(slot, canal)
+
+    def _read(self, slot):
+        # Vertices (ix, values) and properties of the slot, from the buffers or from the store
+        row = self._rows[slot]
+        if row >= 0:
+            ix, values = self._store.getVertices(row)
+            return ix, values, self._store.getInfo(row)
+        start, stop = self._starts[slot], self._starts[slot] + self._counts[slot]
+        return self._ix[start:stop], self._values[:, start:stop], self._info[slot]
+
+    def _channel(self, slot):
+        # Returns the channel of the slot as a landspy.Channel (from the cache or created when needed)
+        if slot in self._cache:
+            self._cache.move_to_end(slot)
+            return self._cache[slot]
+        ix, values, info = self._read(slot)
+        canal = Channel.__new__(Channel)
+        canal._size = info["size"]
+        canal._geot = info["geot"]
+        canal._proj = info["proj"]
+        canal._ix = ix.astype(np.int64)
+        for row, key in enumerate(FIELDS):
+            setattr(canal, key, values[row].astype(np.float64))
+        canal._thetaref = info["thetaref"]
+        canal._chi0 = info["chi0"]
+        canal._slp_np = info["slp_np"]
+        canal._ksn_np = info["ksn_np"]
+        canal._kp = info["kp"].copy()
+        canal._regressions = list(info["regressions"])
+        canal._name = info["name"]
+        canal._oid = info["oid"]
+        canal._flowto = info["flow"]
+
+        self._cache[slot] = canal
+        self._cache_sizes[slot] = ix.size * VERTEX_BYTES
+        self._cache_nbytes += self._cache_sizes[slot]
+        while self._cache_nbytes > self._cache_bytes and len(self._cache) > 1:
+            old_slot, old_canal = self._cache.popitem(last=False)
+            self._cache_nbytes -= self._cache_sizes.pop(old_slot)
+            self._sync(old_slot, old_canal)
+        return canal
+
+    def _compact(self):
+        # Moves the vertices of the remaining channels (not in the store) to the start of the buffers
+        self.flush()
+        slots = [slot for slot in self._live() if self._rows[slot] < 0]
+        counts = np.array([self._counts[slot] for slot in slots], np.int64)
+        positions = np.concatenate([np.arange(self._starts[slot], self._starts[slot] + self._counts[slot])
+                                    for slot in slots]) if slots else np.empty(0, np.int64)
+        self._ix = self._ix[positions]
+        self._values = self._values[:, positions]
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1])) if slots else []
+        for slot, start in zip(slots, starts):
+            self._starts[slot] = int(start)
+        self._used = int(counts.sum())
+        self._garbage = 0
+
+    def insert(self, idx, canal):
+        """
+        Inserts a channel at the position idx. A channel with an oid already in the collection gets a
+        new oid (maximum oid + 1).
+
+        Parameters
+        ----------
+        idx : int
+            Position of the new channel
+        canal : landspy.Channel
+            Channel to insert (its values are copied to the buffers)
+        """
+        slot = len(self._info)
+        canal._oid = self._register(slot, int(canal._oid))
+        self._starts.append(self._used)
+        self._counts.append(0)
+        self._rows.append(-1)
+        self._info.append(None)
+        self._write(slot, canal)
+        self._live().insert(idx, slot)
+
+    def append(self, canal):
+        """
+        Adds a channel at the end of the collection (see insert)
+        """
+        self.insert(len(self), canal)
+
+    def extend_vertices(self, ix, values, offsets, infos):
+        """
+        Adds channels at the end of the collection from their concatenated vertices, which are copied
+        straight to the buffers without creating landspy.Channel objects. Oids are checked as in insert.
+
+        Parameters
+        ----------
+        ix : numpy.ndarray
+            Cell indexes of the vertices
+        values : dict
+            Vertex attributes of FIELDS (arrays with the values of all the vertices)
+        offsets : numpy.ndarray
+            Start of each channel in the vertex arrays, and the total number of vertices at the end
+        infos : list
+            Properties of each channel (dictionaries with the keys of the channel properties, see
+            ChannelTree.getInfo)
+        """
+        offsets = np.asarray(offsets, np.int64)
+        count = int(offsets[-1])
+        self._reserve(count)
+        base = self._used
+        self._ix[base:base + count] = ix
+        for row, key in enumerate(FIELDS):
+            self._values[row, base:base + count] = values[key]
+        self._used += count
+        for n, info in enumerate(infos):
+            slot = len(self._info)
+            oid = self._register(slot, int(info["oid"]))
+            self._starts.append(base + int(offsets[n]))
+            self._counts.append(int(offsets[n + 1] - offsets[n]))
+            self._rows.append(-1)
+            self._info.append(info if oid == info["oid"] else dict(info, oid=oid))
+            self._order.append(slot)
+
+    def pop(self, idx):
+        """
+        Removes the channel at the position idx and returns its oid
+        """
+        slot = self._live().pop(idx)
+        return self._drop(slot)
+
+    def remove(self, oid):
+        """
+        Removes the channel with the given oid (the first one if several channels have the same oid).
+        The channel is taken out of the channel order at once with the other removed channels.
+        """
+        slots = self._slots[oid]
+        slot = slots[0] if len(slots) == 1 else min(slots, key=self._position)
+        self._dropped.add(slot)
+        self._drop(slot)
+
+    def _drop(self, slot):
+        # Frees a slot (its vertices in the buffers are reclaimed by _compact)
+        oid = self._get_slot(slot, "oid")
+        if slot in self._cache:
+            del self._cache[slot]
+            self._cache_nbytes -= self._cache_sizes.pop(slot)
+        slots = self._slots[self._oids[slot]]
+        slots.remove(slot)
+        if not slots:
+            del self._slots[self._oids[slot]]
+        self._positions = None
+        self._info[slot] = None
+        self._rows[slot] = -1
+        self._garbage += self._counts[slot]
+        self._counts[slot] = 0
+        if self._garbage > self._used // 2:
+            self._compact()
+        return oid
+
+    def flush(self):
+        """
+        Writes the values of the cached channels back to the buffers
+        """
+        for slot, canal in self._cache.items():
+            self._sync(slot, canal)
+
+    def index(self, oid):
+        """
+        Returns the position of the channel with the given oid (the first one if several channels have
+        the same oid)
+        """
+        return min(self._position(slot) for slot in self._slots[oid])
+
+    def _get_slot(self, slot, key):
+        # Property of a slot (from the cached channel, if any, which can have been edited)
+        if slot in self._cache:
+            return _channel_info(self._cache[slot])[key]
+        if self._rows[slot] >= 0:
+            row = self._rows[slot]
+            if key == "oid":
+                return int(self._store.getOids()[row])
+            if key == "flow":
+                return int(self._store.getFlows()[row])
+            if key == "name":
+                return self._store.getNames()[row]
+            if key == "proj":
+                return self._store.crs
+            if key == "kp":
+                return self._store.getKP(row)
+            if key == "regressions":
+                return self._store.getRegressions(row)
+            return self._store.getInfo(row)[key]
+        return self._info[slot][key]
+
+    def getOid(self, idx):
+        """
+        Returns the oid of the channel idx
+        """
+        return self._get_slot(self._live()[idx], "oid")
+
+    def getName(self, idx):
+        """
+        Returns the name of the channel idx
+        """
+        return self._get_slot(self._live()[idx], "name")
+
+    def getFlow(self, idx):
+        """
+        Returns the flow (oid of the receiver channel) of the channel idx
+        """
+        return self._get_slot(self._live()[idx], "flow")
+
+    def getRegressions(self, idx):
+        """
+        Returns the regressions of the channel idx (see landspy.Channel.addRegression)
+        """
+        return self._get_slot(self._live()[idx], "regressions")
+
+    def getCRS(self, idx=0):
+        """
+        Returns the coordinate system (WKT) of the channel idx
+        """
+        return self._get_slot(self._live()[idx], "proj")
+
+    def hasSingleCRS(self):
+        """
+        Returns True if all the channels have the same coordinate system. The coordinate system of the
+        channels of a channel file is stored once in its header.
+        """
+        order = self._live()
+        projs = {self._get_slot(slot, "proj") for slot in order if self._rows[slot] < 0}
+        if any(self._rows[slot] >= 0 for slot in order):
+            projs.add(self._store.crs)
+        return len(projs) <= 1
+
+    def getXY(self, idx):
+        """
+        Returns the coordinates of the vertices of the channel idx (two-columns array), as
+        landspy.Channel.getXY() but without creating the Channel
+        """
+        slot = self._live()[idx]
+        if slot in self._cache:
+            return self._cache[slot].getXY()
+        if self._rows[slot] >= 0:
+            return self._store.getXY(self._rows[slot])
+        start = self._starts[slot]
+        info = self._info[slot]
+        return _cell_xy(self._ix[start:start + self._counts[slot]], info["size"][0], info["geot"])
+
+    def getField(self, idx, key):
+        """
+        Returns the values of a vertex attribute of FIELDS (e.g. "_ksn") of the channel idx, without
+        creating the Channel
+        """
+        slot = self._live()[idx]
+        if slot in self._cache:
+            return getattr(self._cache[slot], key)
+        if self._rows[slot] >= 0:
+            return self._store.getField(self._rows[slot], key)
+        start = self._starts[slot]
+        return self._values[FIELDS.index(key), start:start + self._counts[slot]]
+
+    def getKP(self, idx):
+        """
+        Returns the knickpoints (position, type) of the channel idx, without creating the Channel
+        """
+        slot = self._live()[idx]
+        if slot in self._cache:
+            return np.asarray(self._cache[slot]._kp, int).reshape(-1, 2)
+        if self._rows[slot] >= 0:
+            return self._store.getKP(self._rows[slot])
+        return self._info[slot]["kp"]
+
+    def _reset(self, store):
+        # Reloads the collection from a store with its channels (in the same order), keeping the cache
+        positions = {slot: pos for pos, slot in enumerate(self._live())}
+        cached = [(positions[slot], canal, self._cache_sizes[slot]) for slot, canal in self._cache.items()]
+        self.__init__(store=store, cache_bytes=self._cache_bytes)
+        for slot, canal, nbytes in cached:
+            self._cache[slot] = canal
+            self._cache_sizes[slot] = nbytes
+            self._cache_nbytes += nbytes
+
+    def save(self, path):
+        """
+        Saves the channels to a channel file (all the channels must have the same coordinate system)
+        and reloads the collection from the file. If the channels were loaded from the same file, only
+        the vertices of the new and edited channels are appended to the file, with a new index. The
+        file is rewritten when its unused vertices would exceed the used ones (the store is closed before
+        replacing the file, see write_array_file).
+        """
+        self.flush()
+        if not self.hasSingleCRS():
+            raise ValueError("Channels have different coordinate systems")
+        store = self._store
+        order = self._live()
+        nchan = len(order)
+        rows = np.array([self._rows[slot] for slot in order], np.int64)
+        stored = rows >= 0
+        counts = np.zeros(nchan, np.int64)
+        counts[stored] = store.getCounts()[rows[stored]] if stored.any() else 0
+        append = (store is not None and store.appendable and os.path.exists(path) and
+                  os.path.samefile(store.path, path) and 2 * counts[stored].sum() >= store.nvertices)
+
+        # Vertices written to the file (only the new and edited channels when appending)
+        new = ~stored if append else np.ones(nchan, bool)
+        parts = []
+        for slot, row in zip(np.array(order)[new], rows[new]):
+            if row >= 0:
+                parts.append(store.getVertices(row))
+            else:
+                start, stop = self._starts[slot], self._starts[slot] + self._counts[slot]
+                parts.append((self._ix[start:stop], self._values[:, start:stop]))
+        counts[new] = [part[0].size for part in parts]
+        base = store.nvertices if append else 0
+        starts = np.zeros(nchan, np.int64)
+        if append:
+            starts[stored] = store.getStarts()[rows[stored]]
+        starts[new] = base + np.cumsum(counts[new]) - counts[new]
+
+        # Index, with the properties of the channels of the store read at once
+        infos = {pos: self._info[slot] for pos, slot in enumerate(order) if not stored[pos]}
+        index = {"start": starts, "count": counts,
+                 "oid": np.zeros(nchan, np.int64), "flow": np.zeros(nchan, np.int64),
+                 "bbox": np.zeros((nchan, 4)), "raster": np.zeros((nchan, 2), np.int64),
+                 "geot": np.zeros((nchan, 6)), "params": np.zeros((nchan, 4))}
+        names = [""] * nchan
+        kps = [None] * nchan
+        regs = [None] * nchan
+        if stored.any():
+            srows = rows[stored]
+            arrays = store._arrays
+            for key in ("oid", "flow", "raster", "geot", "params"):
+                index[key][stored] = arrays[key][srows]
+            index["bbox"][stored] = store.getBBoxes()[srows]
+            store_names = store.getNames()
+            for pos in np.flatnonzero(stored):
+                row = rows[pos]
+                names[pos] = store_names[row]
+                kps[pos] = arrays["kp"][arrays["kp_offsets"][row]:arrays["kp_offsets"][row + 1]]
+                regs[pos] = arrays["reg"][arrays["reg_offsets"][row]:arrays["reg_offsets"][row + 1]]
+        for pos, info in infos.items():
+            index["oid"][pos] = info["oid"]
+            index["flow"][pos] = info["flow"]
+            index["raster"][pos] = info["size"]
+            index["geot"][pos] = info["geot"]
+            index["params"][pos] = (info["thetaref"], info["chi0"], info["slp_np"], info["ksn_np"])
+            slot = order[pos]
+            start = self._starts[slot]
+            index["bbox"][pos] = _bounding_box(_cell_xy(self._ix[start:start + self._counts[slot]],
+                                                        info["size"][0], info["geot"]))
+            names[pos] = str(info["name"])
+            kps[pos] = info["kp"]
+            regs[pos] = np.array([(reg[0], reg[1], reg[2], reg[3][0], reg[3][1], reg[4])
+                                  for reg in info["regressions"]], np.float64).reshape(-1, 6)
+        encoded = [name.encode("utf8") for name in names]
+        index.update({
+            "kp_offsets": np.concatenate(([0], np.cumsum([len(kp) for kp in kps]))).astype(np.int64),
+            "kp": np.concatenate(kps + [np.empty((0, 2))]).astype(np.int64).reshape(-1, 2),
+            "reg_offsets": np.concatenate(([0], np.cumsum([len(reg) for reg in regs]))).astype(np.int64),
+            "reg": np.concatenate(regs + [np.empty((0, 6))]).astype(np.float64).reshape(-1, 6),
+            "name_offsets": np.concatenate(([0], np.cumsum([len(name) for name in encoded]))).astype(np.int64),
+            "name_data": np.frombuffer(b"".join(encoded), np.uint8)})
+        # Knickpoints and regressions of the store were views of its memory-mapped arrays
+        kps = regs = arrays = None
+
+        # New vertex segment (columns)
+        nseg = len(store._segments) if append else 0
+        segment = {"ix.{}".format(nseg): np.concatenate([part[0] for part in parts] +
+                                                        [np.empty(0, np.int64)]).astype(np.int64)}
+        values = np.concatenate([part[1] for part in parts] + [np.empty((len(FIELDS), 0), np.float32)], axis=1)
+        for row, key in enumerate(FIELDS):
+            segment["{}.{}".format(key[1:], nseg)] = values[row]
+
+        sizes = ([int(seg["ix"].size) for seg in store._segments] if append else []) + [int(counts[new].sum())]
+        header = {"count": nchan, "crs": self.getCRS() if nchan else "", "segments": sizes}
+        if append:
+            keep = ["{}.{}".format(key, n) for n in range(nseg) for key in ["ix"] + [key[1:] for key in FIELDS]]
+            append_array_file(path, MAGIC, header, {**segment, **index}, keep)
+            self._reset(ChannelStore(path))
+            return
+
+        # The memory maps of the store must be released before replacing its file
+        overwrite = store is not None and os.path.exists(path) and os.path.samefile(store.path, path)
+        if not overwrite:
+            write_array_file(path, MAGIC, VERSION, header, {**segment, **index}, appendable=True)
+            self._reset(ChannelStore(path))
+            return
+        store.close()
+        try:
+            write_array_file(path, MAGIC, VERSION, header, {**segment, **index}, appendable=True)
+        finally:
+            # If writing fails the old file is kept and opened again
+            self._store = ChannelStore(store.path)
+        self._reset(self._store)
+
+
+def load_channels(path, cache_bytes=128 * 2 ** 20):
+    """
+    Loads the channels of a channel file (only its header and index are read), or of an old numpy file
+    (.npy) with a pickled array of landspy.Channel objects
+
+    Returns
+    -------
+    ChannelCollection
+        Collection of channels
+    """
+    if is_channel_file(path):
+        return ChannelCollection(store=ChannelStore(path), cache_bytes=cache_bytes)
+    channels = np.load(path, allow_pickle=True)
+    if any(type(canal) is not Channel for canal in channels):
+        raise TypeError("{} does not contain channels".format(path))
+    return ChannelCollection(channels, cache_bytes=cache_bytes)
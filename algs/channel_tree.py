@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Channels of a drainage network stored as a tree of shared segments.
+
+The cells walked by network_tools.trace_channels are stored once (cell data in a single array, in the
+walk order) and each channel is a list of slices of those cells. Channels that share a trunk share its
+cells, and the landspy.Channel of each channel is only created (with its own arrays) when the channel
+is accessed. The vertices of many channels can also be taken at once as flat arrays (see getVertices),
+without creating the Channel objects.
+"""
+
+import numpy as np
+from landspy import Channel
+from .network_tools import receiver_positions, trace_channels, channel_positions
+
+# Network arrays with the data of the channel cells (columns of the landspy.Channel data)
+CHANNEL_FIELDS = ("_ix", "_ax", "_dx", "_zx", "_chi", "_slp", "_ksn", "_r2slp", "_r2ksn", "_dd")
+
+
+class ChannelTree:
+    """
+    Tree of channels of a landspy Network (or BNetwork)
+
+    Parameters
+    ----------
+    net : landspy.Network
+        Network with the channel cells
+    heads : numpy.ndarray
+        Positions (in the network cells) of the channel heads. Channels are traced in this order.
+    to_outlet : bool
+        If True, channels go from their heads to the outlet. If False (as in landspy
+        BNetwork.getChannels), each channel ends at the first cell of a previous channel.
+    """
+    def __init__(self, net, heads, to_outlet=False):
+        self._net = net
+        self._to_outlet = to_outlet
+        path, self._slices = trace_channels(receiver_positions(net._ix, net._ixc), heads)
+        self._path = path
+        # Data of the walked cells, stored once
+        self._data = np.array([getattr(net, field)[path] for field in CHANNEL_FIELDS]).T
+
+        # Channel (owner) of each walked cell, to get the channel where each channel flows
+        owner = np.empty(path.size, np.int64)
+        for n, chan in enumerate(self._slices):
+            start, stop = chan[0]
+            owner[start:stop] = n
+        self._flowto = np.array([owner[chan[1][0]] if len(chan) > 1 else -1 for chan in self._slices], np.int64)
+
+    def __len__(self):
+        return len(self._slices)
+
+    def __getitem__(self, idx):
+        return self.getChannel(idx)
+
+    def __iter__(self):
+        for idx in range(len(self._slices)):
+            yield self.getChannel(idx)
+
+    def _positions(self, idx):
+        # Positions (in the walked cells) of the cells of the channel idx
+        chan = self._slices[idx]
+        if self._to_outlet:
+            return channel_positions(np.arange(self._path.size), chan)
+        start, stop = chan[0]
+        if len(chan) > 1:
+            # The channel ends in the first cell of the channel where it flows
+            return np.append(np.arange(start, stop), chan[1][0])
+        return np.arange(start, stop)
+
+    def getFlowTo(self):
+        """
+        Returns the index of the channel where each channel flows (-1 for the channel that reaches the outlet)
+        """
+        return self._flowto
+
+    def getLengths(self):
+        """
+        Returns the length of all the channels, without creating the Channel objects
+        """
+        dx = self._data[:, 2]
+        lengths = np.empty(len(self._slices))
+        for idx in range(len(self._slices)):
+            chan = self._slices[idx]
+            if self._to_outlet:
+                last = chan[-1][1] - 1
+            else:
+                last = chan[1][0] if len(chan) > 1 else chan[0][1] - 1
+            lengths[idx] = dx[chan[0][0]] - dx[last]
+        return lengths
+
+    def getChannel(self, idx, name=None, oid=None):
+        """
+        Returns the channel idx as a new landspy.Channel
+
+        Parameters
+        ----------
+        idx : int
+            Index of the channel
+        name : str, optional
+            Name of the channel (by default, the channel index)
+        oid : int, optional
+            Id of the channel (by default, the channel index)
+        """
+        net = self._net
+        flowto = -1 if self._to_outlet else int(self._flowto[idx])
+        return Channel(net, self._data[self._positions(idx)], net._thetaref, net._chi[-1], net._slp_np,
+                       net._ksn_np, str(idx) if name is None else name, idx if oid is None else oid, flowto)
+
+    def getVertices(self, indexes):
+        """
+        Returns the vertices of a set of channels concatenated in flat arrays, without creating the
+        Channel objects
+
+        Parameters
+        ----------
+        indexes : array_like
+            Indexes of the channels
+
+        Returns
+        -------
+        tuple (ix, values, offsets)
+            ix : Cell indexes of the vertices
+            values : Dictionary with the vertex attributes (landspy.Channel names, "_zx0" included)
+            offsets : Start of each channel in the vertex arrays, and the total number of vertices at the end
+        """
+        positions = [self._positions(idx) for idx in indexes]
+        offsets = np.concatenate(([0], np.cumsum([pos.size for pos in positions]))).astype(np.int64)
+        data = self._data[np.concatenate(positions + [np.empty(0, np.int64)])]
+        values = {key: data[:, n] for n, key in enumerate(CHANNEL_FIELDS) if key != "_ix"}
+        values["_zx0"] = values["_zx"].copy()
+        return data[:, 0].astype(np.int64), values, offsets
+
+    def getInfo(self, idx, name=None, oid=None):
+        """
+        Returns the properties of the channel idx that are not vertex attributes (dictionary as in
+        ChannelCollection), the same ones of the Channel returned by getChannel
+        """
+        net = self._net
+        flowto = -1 if self._to_outlet else int(self._flowto[idx])
+        return {"name": str(idx) if name is None else name, "oid": int(idx if oid is None else oid),
+                "flow": flowto, "size": tuple(net._size), "geot": tuple(net._geot), "proj": net._proj,
+                "thetaref": net._thetaref, "chi0": net._chi[-1], "slp_np": net._slp_np, "ksn_np": net._ksn_np,
+                "kp": np.empty((0, 2), int), "regressions": []}
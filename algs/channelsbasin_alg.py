@@ -1 +1 @@
-from qgis.PyQt.QtCore import QCoreApplicationfrom qgis.core import QgsProcessingAlgorithm, QgsProcessingParameterFile, QgsProcessingParameterRasterLayer, QgsProcessingParameterNumberfrom qgis.core import QgsProcessingParameterFeatureSource, QgsProcessingParameterField, QgsProcessing, QgsProcessingParameterFileDestinationfrom landspy import Network, BNetwork, Gridimport numpy as npimport osfrom qgis import processingclass ChannelsFromBasin(QgsProcessingAlgorithm):    # Constants used to refer to parameters and outputs They will be    # used when calling the algorithm from another algorithm, or when    # calling from the QGIS console.    NET = 'NET'    BASINS = 'BASINS'    BASIN_ID = 'BASIN_ID'    MIN_DIST = 'MIN_DIST'    HEAD_SHP = 'HEAD_SHP'    ID_HEAD = 'ID_HEAD'    OUT_NPY = 'OUT_NPY'     def __init__(self):        super().__init__()    def createInstance(self):        return type(self)()     def name(self):        """        Rerturns the algorithm name, used to identify the algorithm.        Must be unique within each provider and should contain lowercase alphanumeric characters only.        """        return "channelsFromBasin"         def displayName(self):        """        Returns the translated algorithm name, which should be used for any        user-visible display of the algorithm name.        """        return self.tr("Get channels from basin")         def groupId(self):        """        Returns the unique ID of the group this algorithm belongs to.        """        return "geomorphic_indexes"    def group(self):        """        Returns the name of the group this algoritm belongs to.        """        return self.tr("Geomorphic Indexes")    def shortHelpString(self):        """        Returns a localised short helper string for the algorithm.         """        texto = """                    This script get all the channels (.npy file) for a single drainage basin.                     Network : Network object (*.dat file)                    Basins: Raster with the drainage basins.                     Basin Id: Id of the basin in the basins raster.                    Channel minimum length [Optional]: Channel minimum length to consider. Channels with lower lengtsh will be discarded.                    Heads [Optional]: Point shapefile wiht the basin heads. Points in this shapefile will be processed before any other head of the Network.                    Heads id[Optional]: Field of the heads shapefile with the orders. Lower id number will process first.                     Output channels: Output channels. All channels will be returned into a *.npy file (numpy array).                    """        return texto     def tr(self, string):        return QCoreApplication.translate('Processing', string)    def helpUrl(self):        return "https://github.com/geolovic/qgs_landspy"             def initAlgorithm(self, config=None):        """        Here we define the inputs and output of the algorithm, along        with some other properties.        """        self.addParameter(QgsProcessingParameterFile(self.NET, self.tr("Network (.dat)"), extension="dat"))        self.addParameter(QgsProcessingParameterRasterLayer(self.BASINS, self.tr("Basins")))        self.addParameter(QgsProcessingParameterNumber(self.BASIN_ID, self.tr("Basin Id"), QgsProcessingParameterNumber.Integer, 1))        self.addParameter(QgsProcessingParameterNumber(self.MIN_DIST, self.tr("Channel minimum length"), QgsProcessingParameterNumber.Double, optional=True))        self.addParameter(QgsProcessingParameterFeatureSource(self.HEAD_SHP, self.tr("Heads"), [QgsProcessing.TypeVectorPoint], optional=True))        self.addParameter(QgsProcessingParameterField(self.ID_HEAD, self.tr("Heads id"), parentLayerParameterName=self.HEAD_SHP, type=QgsProcessingParameterField.Numeric, optional=True))        self.addParameter(QgsProcessingParameterFileDestination(self.OUT_NPY, self.tr("Output channels"), fileFilter="Numpy file (*.npy)"))    def processAlgorithm(self, parameters, context, feedback):        """        Here is where the processing itself takes place.        """        input_net = self.parameterAsFile(parameters, self.NET, context)        basin_ras = self.parameterAsRasterLayer(parameters, self.BASINS, context)        basin_id = self.parameterAsInt(parameters, self.BASIN_ID, context)        heads_id = self.parameterAsString(parameters, self.ID_HEAD, context)        mindist = self.parameterAsDouble(parameters, self.MIN_DIST, context)        heads_shp = self.parameterAsVectorLayer(parameters, self.HEAD_SHP, context)        out_npy = self.parameterAsString(parameters, self.OUT_NPY, context)                # Get Network and Basins        net = Network(input_net)        basins = Grid(basin_ras.source())                # Chek basin_id        if (basin_id not in basins.readArray()) or (basin_id == 0):            feedback.setProgressText("Wrong basin id!!")            return {}                if not mindist:            mindist = 0                # Get heads array        if not heads_shp:            heads = None        else:            field_idx = heads_shp.fields().indexFromName(heads_id)            puntos = []            for n, feat in enumerate(heads_shp.getFeatures()):                if field_idx >= 0:                    idx = feat[field_idx]                else:                    idx = n + 1                pto = feat.geometry().asPoint()                puntos.append([pto.x(), pto.y(), idx])                        heads = np.array(puntos)                    bnet = BNetwork(net, basins, heads, basin_id)        canales = bnet.getChannels("ALL", min_length=mindist)        np.save(out_npy, canales, allow_pickle=True)        results = {self.OUT_NPY:out_npy}        return results
\ No newline at end of file
+from qgis.PyQt.QtCore import QCoreApplicationfrom qgis.core import QgsProcessingAlgorithm, QgsProcessingParameterFile, QgsProcessingParameterRasterLayer, QgsProcessingParameterNumberfrom qgis.core import QgsProcessingParameterFeatureSource, QgsProcessingParameterField, QgsProcessing, QgsProcessingParameterFileDestinationfrom qgis.core import QgsProcessingParameterBooleanfrom landspy import Network, BNetwork, Grid, Basinimport numpy as npimport osfrom qgis import processingfrom .network_tools import snap_points, vertex_gradients, resample_verticesfrom .raster_tools import label_window, read_windowfrom .channel_tree import ChannelTreefrom .channel_store import ChannelCollectiondef read_basin(path, bid, margin=1):    """    Reads a single basin of a basins raster as a landspy.Basin (basin cells = 1, NoData = 0). Only the    window with the basin cells (plus a margin) is read from the raster.    Parameters    ----------    path : str        Path to the basins raster    bid : int        Id of the basin    margin : int        Number of cells added around the basin window    Returns    -------    tuple (basin, offset)        landspy.Basin and (row, col) of its upper-left cell in the raster, (None, None) if the basin is        not in the raster    """    window = label_window(path, [bid])    if window is None:        return None, None    arr, geot, nodata, proj = read_window(path, window, margin)    basin = Basin.__new__(Basin)    Grid.__init__(basin)    basin.setArray((arr == bid).astype(np.int8))    basin.setNodata(0)    basin._geot = geot    basin._cellsize = (geot[1], geot[5])    basin._proj = proj    basin._ncells = arr.size    return basin, (max(window[0] - margin, 0), max(window[2] - margin, 0))class ChannelsFromBasin(QgsProcessingAlgorithm):    # Constants used to refer to parameters and outputs They will be    # used when calling the algorithm from another algorithm, or when    # calling from the QGIS console.    NET = 'NET'    BASINS = 'BASINS'    BASIN_ID = 'BASIN_ID'    MIN_DIST = 'MIN_DIST'    HEAD_SHP = 'HEAD_SHP'    ID_HEAD = 'ID_HEAD'    OUT_NPY = 'OUT_NPY'    SNAP_RADIUS = 'SNAP_RADIUS'    TO_OUTLET = 'TO_OUTLET'    RESAMPLE = 'RESAMPLE'    NPOINTS = 'NPOINTS'    N_PROCESSES = 'N_PROCESSES'     def __init__(self):        super().__init__()    def createInstance(self):        return type(self)()     def name(self):        """        Rerturns the algorithm name, used to identify the algorithm.        Must be unique within each provider and should contain lowercase alphanumeric characters only.        """        return "channelsFromBasin"         def displayName(self):        """        Returns the translated algorithm name, which should be used for any        user-visible display of the algorithm name.        """        return self.tr("Get channels from basin")         def groupId(self):        """        Returns the unique ID of the group this algorithm belongs to.        """        return "geomorphic_indexes"    def group(self):        """        Returns the name of the group this algoritm belongs to.        """        return self.tr("Geomorphic Indexes")    def shortHelpString(self):        """        Returns a localised short helper string for the algorithm.         """        texto = """                    This script get all the channels (.chn file) for a single drainage basin.                     Network : Network object (*.dat file)                    Basins: Raster with the drainage basins. Only the window of the selected basin is read.                    Basin Id: Id of the basin in the basins raster.                    Channel minimum length [Optional]: Channel minimum length to consider. Channels with lower lengtsh will be discarded.                    Heads [Optional]: Point shapefile wiht the basin heads. Points in this shapefile will be processed before any other head of the Network.                    Heads id[Optional]: Field of the heads shapefile with the orders. Lower id number will process first.                     Snap radius [Optional]: Heads are snapped to the network head with the longest flow path within this radius (map units). If 0, heads are snapped to the closest network head.                    Channels to outlet [Optional]: If checked, all the channels go from their heads to the basin outlet. If not, each channel ends where it joins a previous channel.                    Resampling step [Optional]: Channels are resampled to vertices every step map units from the head (elevation, area and chi are interpolated, and each vertex keeps its closest network cell). If 0, channels keep all the network cells.                    N Points [Optional]: Number of points at each side of the cell to recalculate channel slope and ksn (at least 2, as landspy). If 0 or 1, channels keep the slope and ksn values of the Network.                    Processes [Optional]: Number of processes to recalculate slope and ksn of the channels                    Output channels: Output channels. All channels will be returned into a channel file (*.chn).                    Channels are traced as a tree of shared segments (trunks are walked and stored once).                    """        return texto     def tr(self, string):        return QCoreApplication.translate('Processing', string)    def helpUrl(self):        return "https://github.com/geolovic/qgs_landspy"             def initAlgorithm(self, config=None):        """        Here we define the inputs and output of the algorithm, along        with some other properties.        """        self.addParameter(QgsProcessingParameterFile(self.NET, self.tr("Network (.dat)"), extension="dat"))        self.addParameter(QgsProcessingParameterRasterLayer(self.BASINS, self.tr("Basins")))        self.addParameter(QgsProcessingParameterNumber(self.BASIN_ID, self.tr("Basin Id"), QgsProcessingParameterNumber.Integer, 1))        self.addParameter(QgsProcessingParameterNumber(self.MIN_DIST, self.tr("Channel minimum length"), QgsProcessingParameterNumber.Double, optional=True))        self.addParameter(QgsProcessingParameterFeatureSource(self.HEAD_SHP, self.tr("Heads"), [QgsProcessing.TypeVectorPoint], optional=True))        self.addParameter(QgsProcessingParameterField(self.ID_HEAD, self.tr("Heads id"), parentLayerParameterName=self.HEAD_SHP, type=QgsProcessingParameterField.Numeric, optional=True))        self.addParameter(QgsProcessingParameterFileDestination(self.OUT_NPY, self.tr("Output channels"), fileFilter="Channel files (*.chn)"))        self.addParameter(QgsProcessingParameterNumber(self.SNAP_RADIUS, self.tr("Snap radius"), QgsProcessingParameterNumber.Double, 0.0, optional=True))        self.addParameter(QgsProcessingParameterBoolean(self.TO_OUTLET, self.tr("Channels to outlet"), False, optional=True))        self.addParameter(QgsProcessingParameterNumber(self.RESAMPLE, self.tr("Resampling step"), QgsProcessingParameterNumber.Double, 0.0, True, 0.0))        self.addParameter(QgsProcessingParameterNumber(self.NPOINTS, self.tr("N Points"), QgsProcessingParameterNumber.Integer, 0, True, 0, 1000))        self.addParameter(QgsProcessingParameterNumber(self.N_PROCESSES, self.tr("Processes"), QgsProcessingParameterNumber.Integer, 1, True, 1, 64))    def processAlgorithm(self, parameters, context, feedback):        """        Here is where the processing itself takes place.        """        input_net = self.parameterAsFile(parameters, self.NET, context)        basin_ras = self.parameterAsRasterLayer(parameters, self.BASINS, context)        basin_id = self.parameterAsInt(parameters, self.BASIN_ID, context)        heads_id = self.parameterAsString(parameters, self.ID_HEAD, context)        mindist = self.parameterAsDouble(parameters, self.MIN_DIST, context)        heads_shp = self.parameterAsVectorLayer(parameters, self.HEAD_SHP, context)        out_npy = self.parameterAsString(parameters, self.OUT_NPY, context)        radius = self.parameterAsDouble(parameters, self.SNAP_RADIUS, context)        to_outlet = self.parameterAsBool(parameters, self.TO_OUTLET, context)        step = self.parameterAsDouble(parameters, self.RESAMPLE, context)        npoints = self.parameterAsInt(parameters, self.NPOINTS, context)        n_processes = self.parameterAsInt(parameters, self.N_PROCESSES, context)                if os.path.splitext(out_npy)[1] not in [".chn"]:            out_npy = os.path.splitext(out_npy)[0] + ".chn"        # Get Network and Basin (windowed read of the basin cells)        net = Network(input_net)        if basin_id == 0:            feedback.setProgressText("Wrong basin id!!")            return {}        basin, offset = read_basin(basin_ras.source(), basin_id)                # Chek basin_id        if basin is None:            feedback.setProgressText("Wrong basin id!!")            return {}                if not mindist:            mindist = 0                # Get heads array        if not heads_shp:            heads = None        else:            field_idx = heads_shp.fields().indexFromName(heads_id)            puntos = []            for n, feat in enumerate(heads_shp.getFeatures()):                if field_idx >= 0:                    idx = feat[field_idx]                else:                    idx = n + 1                pto = feat.geometry().asPoint()                puntos.append([pto.x(), pto.y(), idx])                        heads = np.array(puntos)            # Snap all the heads at once to the network heads inside the basin            basin_arr = basin.readArray()            net_heads = net.streamPoi("heads", "IND")            row, col = net.indToCell(net_heads)            x, y = net.cellToXY(row, col)            brow, bcol = row - offset[0], col - offset[1]            inside = (brow >= 0) & (brow < basin_arr.shape[0]) & (bcol >= 0) & (bcol < basin_arr.shape[1])            inside[inside] = basin_arr[brow[inside], bcol[inside]] == 1            ixcix = np.zeros(net.getNCells(), np.int64)            ixcix[net._ix] = np.arange(net._ix.size)            if heads.size and inside.any():                cells = np.array((x[inside], y[inside])).T                pos = snap_points(heads, cells, net._dx[ixcix[net_heads[inside]]], radius, net.getCellSize()[0])                heads[:, :2] = cells[pos]            else:                heads = None        bnet = BNetwork(net, basin, heads, basin_id)        # Channel heads: main heads first, then the other network heads from the highest to the lowest        # (as in BNetwork.getChannels)        ixcix = np.zeros(bnet.getNCells(), np.int64)        ixcix[bnet._ix] = np.arange(bnet._ix.size)        net_heads = bnet.streamPoi("heads", "IND")        all_heads = np.append(bnet._heads, net_heads[np.argsort(-bnet._zx[ixcix[net_heads]])]).astype(np.int64)        all_heads = all_heads[np.sort(np.unique(all_heads, return_index=True)[1])]        # Channels are traced once as a tree and their vertices are written straight to the channel        # collection (no Channel objects are created)        tree = ChannelTree(bnet, ixcix[all_heads], to_outlet)        selected = np.flatnonzero(tree.getLengths() >= mindist)        feedback.pushInfo("{} channels ({} with minimum length)".format(len(tree), selected.size))        ix, values, offsets = tree.getVertices(selected)        infos = [tree.getInfo(idx) for idx in selected]        if step > 0:            before = int(offsets[-1])            ix, values, offsets = resample_vertices(ix, values, offsets, step)            feedback.pushInfo("Channels resampled every {} map units ({} to {} vertices)".format(                step, before, int(offsets[-1])))        if npoints > 1 and selected.size:            try:                wall, busy = vertex_gradients(values, offsets, npoints, n_processes)            except (OSError, RuntimeError):                # The pool of processes cannot be started in some QGIS installations                feedback.reportError("Process pool not available, calculating channel gradients in one process")                n_processes = 1                wall, busy = vertex_gradients(values, offsets, npoints, 1)            for info in infos:                info["slp_np"] = npoints                info["ksn_np"] = npoints            feedback.pushInfo("Channel gradients: {} channels in {:.3f} s with {} processes (speed-up {:.1f}x)".format(                selected.size, wall, n_processes, busy / wall if wall > 0 else 1.0))        canales = ChannelCollection()        canales.extend_vertices(ix, values, offsets, infos)        canales.save(out_npy)        results = {self.OUT_NPY:out_npy}        return results
\ No newline at end of file
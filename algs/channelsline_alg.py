@@ -1 +1 @@
-from qgis.PyQt.QtCore import QCoreApplicationfrom qgis.core import QgsProcessingAlgorithm, QgsProcessingParameterFile, QgsProcessingParameterFileDestinationfrom qgis.core import QgsProcessingParameterFeatureSource, QgsProcessingParameterField, QgsProcessingfrom landspy import Network, shp_to_channelsimport numpy as npimport osfrom qgis import processingclass ChannelsFromLines(QgsProcessingAlgorithm):    # Constants used to refer to parameters and outputs They will be    # used when calling the algorithm from another algorithm, or when    # calling from the QGIS console.    NET = 'NET'    LINE_SHP = 'LINE_SHP'    OUT_NPY = 'OUT_NPY'    ID_FIELD = 'ID_FIELD'    NAME_FIELD = 'NAME_FIELD'    def __init__(self):        super().__init__()    def createInstance(self):        return type(self)()    def name(self):        """        Rerturns the algorithm name, used to identify the algorithm.        Must be unique within each provider and should contain lowercase alphanumeric characters only.        """        return "channelsFromLines"    def displayName(self):        """        Returns the translated algorithm name, which should be used for any        user-visible display of the algorithm name.        """        return self.tr("Get channels from lines")    def groupId(self):        """        Returns the unique ID of the group this algorithm belongs to.        """        return "geomorphic_indexes"    def group(self):        """        Returns the name of the group this algoritm belongs to.        """        return self.tr("Geomorphic Indexes")    def shortHelpString(self):        """        Returns a localised short helper string for the algorithm.         """        texto = """                    This script get channels from a river (polyline) shapefile                    Channel shapefile : Polyline shapefile with the channels to extract. It is recommended that this shapefile is computed from landspy functions. Multipart features will be discarded.                    Name field [Optional]: Field of the channel shapefile with channels names (labels)                    Output channels: Output channels corresponding to channel shapefile                    """        return texto    def tr(self, string):        return QCoreApplication.translate('Processing', string)    def helpUrl(self):        return "https://github.com/geolovic/qgs_landspy"    def initAlgorithm(self, config=None):        """        Here we define the inputs and output of the algorithm, along        with some other properties.        """        self.addParameter(QgsProcessingParameterFile(self.NET, self.tr("Network (.dat)"), extension="dat"))        self.addParameter(QgsProcessingParameterFeatureSource(self.LINE_SHP, self.tr("Channel shapefile"),                                                              [QgsProcessing.TypeVectorLine]))        self.addParameter(            QgsProcessingParameterField(self.ID_FIELD, self.tr("Id Field"), parentLayerParameterName=self.LINE_SHP,                                        type=QgsProcessingParameterField.Numeric, optional=True))        self.addParameter(            QgsProcessingParameterField(self.NAME_FIELD, self.tr("Name Field"), parentLayerParameterName=self.LINE_SHP,                                        type=QgsProcessingParameterField.String, optional=True))        self.addParameter(            QgsProcessingParameterFileDestination(self.OUT_NPY, self.tr("Output channels"), fileFilter="Numpy file (*.npy)"))    def processAlgorithm(self, parameters, context, feedback):        """        Here is where the processing itself takes place.        """        input_net = self.parameterAsFile(parameters, self.NET, context)        line_shp = self.parameterAsVectorLayer(parameters, self.LINE_SHP, context)        out_npy = self.parameterAsString(parameters, self.OUT_NPY, context)        id_field = self.parameterAsString(parameters, self.ID_FIELD, context)        name_field = self.parameterAsString(parameters, self.NAME_FIELD, context)        if os.path.splitext(out_npy)[1] not in [".npy"]:            out_npy = os.path.splitext(out_npy)[0] + ".npy"        net = Network(input_net)        n_id = line_shp.fields().indexFromName(id_field)        n_name = line_shp.fields().indexFromName(name_field)        canales = []        for n, feat in enumerate(line_shp.getFeatures()):            if feat.hasGeometry():                if n_id >= 0:                    idx = feat[n_id]                else:                    idx = n + 1                if n_name >= 0:                    name = feat[n_name]                else:                    name = str(n)                geom = feat.geometry()                for part in geom.get():                    first_point = part[0]                    last_point = part[-1]                    head = [first_point.x(), first_point.y()]                    mouth = [last_point.x(), last_point.y()]                    canal = net.getChannel(head, mouth, name=name, oid=idx)                    canales.append(canal)        np.save(out_npy, canales, allow_pickle=True)        results = {self.OUT_NPY: out_npy}        return results
\ No newline at end of file
+from qgis.PyQt.QtCore import QCoreApplicationfrom qgis.core import QgsProcessingAlgorithm, QgsProcessingParameterFile, QgsProcessingParameterFileDestinationfrom qgis.core import QgsProcessingParameterFeatureSource, QgsProcessingParameterField, QgsProcessingfrom qgis.core import QgsProcessingParameterNumberfrom landspy import Network, Channelimport numpy as npimport osfrom qgis import processingfrom .network_tools import snap_points, receiver_positions, trace_channels, channel_positionsfrom .network_tools import batch_channel_gradients, resample_channelsfrom .channel_store import ChannelCollectionclass ChannelsFromLines(QgsProcessingAlgorithm):    # Constants used to refer to parameters and outputs They will be    # used when calling the algorithm from another algorithm, or when    # calling from the QGIS console.    NET = 'NET'    LINE_SHP = 'LINE_SHP'    OUT_NPY = 'OUT_NPY'    ID_FIELD = 'ID_FIELD'    NAME_FIELD = 'NAME_FIELD'    SNAP_RADIUS = 'SNAP_RADIUS'    RESAMPLE = 'RESAMPLE'    NPOINTS = 'NPOINTS'    N_PROCESSES = 'N_PROCESSES'    def __init__(self):        super().__init__()    def createInstance(self):        return type(self)()    def name(self):        """        Rerturns the algorithm name, used to identify the algorithm.        Must be unique within each provider and should contain lowercase alphanumeric characters only.        """        return "channelsFromLines"    def displayName(self):        """        Returns the translated algorithm name, which should be used for any        user-visible display of the algorithm name.        """        return self.tr("Get channels from lines")    def groupId(self):        """        Returns the unique ID of the group this algorithm belongs to.        """        return "geomorphic_indexes"    def group(self):        """        Returns the name of the group this algoritm belongs to.        """        return self.tr("Geomorphic Indexes")    def shortHelpString(self):        """        Returns a localised short helper string for the algorithm.         """        texto = """                    This script get channels from a river (polyline) shapefile                    Channel shapefile : Polyline shapefile with the channels to extract. It is recommended that this shapefile is computed from landspy functions. Multipart features will be discarded.                    Name field [Optional]: Field of the channel shapefile with channels names (labels)                    Snap radius [Optional]: Heads are snapped to the closest channel cell, and mouths to the channel cell with maximum drainage area within this radius (map units). If 0, mouths are also snapped to the closest channel cell.                    Resampling step [Optional]: Channels are resampled to vertices every step map units from the head (elevation, area and chi are interpolated, and each vertex keeps its closest network cell). If 0, channels keep all the network cells.                    N Points [Optional]: Number of points at each side of the cell to recalculate channel slope and ksn (at least 2, as landspy). If 0 or 1, channels keep the slope and ksn values of the Network.                    Processes [Optional]: Number of processes to recalculate slope and ksn of the channels                    Output channels: Output channel file (*.chn) with the channels corresponding to channel shapefile                    """        return texto    def tr(self, string):        return QCoreApplication.translate('Processing', string)    def helpUrl(self):        return "https://github.com/geolovic/qgs_landspy"    def initAlgorithm(self, config=None):        """        Here we define the inputs and output of the algorithm, along        with some other properties.        """        self.addParameter(QgsProcessingParameterFile(self.NET, self.tr("Network (.dat)"), extension="dat"))        self.addParameter(QgsProcessingParameterFeatureSource(self.LINE_SHP, self.tr("Channel shapefile"),                                                              [QgsProcessing.TypeVectorLine]))        self.addParameter(            QgsProcessingParameterField(self.ID_FIELD, self.tr("Id Field"), parentLayerParameterName=self.LINE_SHP,                                        type=QgsProcessingParameterField.Numeric, optional=True))        self.addParameter(            QgsProcessingParameterField(self.NAME_FIELD, self.tr("Name Field"), parentLayerParameterName=self.LINE_SHP,                                        type=QgsProcessingParameterField.String, optional=True))        self.addParameter(            QgsProcessingParameterFileDestination(self.OUT_NPY, self.tr("Output channels"), fileFilter="Channel files (*.chn)"))        self.addParameter(            QgsProcessingParameterNumber(self.SNAP_RADIUS, self.tr("Snap radius"), type=QgsProcessingParameterNumber.Double,                                         defaultValue=0.0, optional=True))        self.addParameter(            QgsProcessingParameterNumber(self.RESAMPLE, self.tr("Resampling step"), type=QgsProcessingParameterNumber.Double,                                         defaultValue=0.0, optional=True, minValue=0.0))        self.addParameter(            QgsProcessingParameterNumber(self.NPOINTS, self.tr("N Points"), type=QgsProcessingParameterNumber.Integer,                                         defaultValue=0, optional=True, minValue=0, maxValue=1000))        self.addParameter(            QgsProcessingParameterNumber(self.N_PROCESSES, self.tr("Processes"), type=QgsProcessingParameterNumber.Integer,                                         defaultValue=1, optional=True, minValue=1, maxValue=64))    def processAlgorithm(self, parameters, context, feedback):        """        Here is where the processing itself takes place.        """        input_net = self.parameterAsFile(parameters, self.NET, context)        line_shp = self.parameterAsVectorLayer(parameters, self.LINE_SHP, context)        out_npy = self.parameterAsString(parameters, self.OUT_NPY, context)        id_field = self.parameterAsString(parameters, self.ID_FIELD, context)        name_field = self.parameterAsString(parameters, self.NAME_FIELD, context)        radius = self.parameterAsDouble(parameters, self.SNAP_RADIUS, context)        step = self.parameterAsDouble(parameters, self.RESAMPLE, context)        npoints = self.parameterAsInt(parameters, self.NPOINTS, context)        n_processes = self.parameterAsInt(parameters, self.N_PROCESSES, context)        if os.path.splitext(out_npy)[1] not in [".chn"]:            out_npy = os.path.splitext(out_npy)[0] + ".chn"        net = Network(input_net)        n_id = line_shp.fields().indexFromName(id_field)        n_name = line_shp.fields().indexFromName(name_field)        lineas = []        for n, feat in enumerate(line_shp.getFeatures()):            if feat.hasGeometry():                if n_id >= 0:                    idx = feat[n_id]                else:                    idx = n + 1                if n_name >= 0:                    name = feat[n_name]                else:                    name = str(n)                geom = feat.geometry()                for part in geom.get():                    first_point = part[0]                    last_point = part[-1]                    head = [first_point.x(), first_point.y()]                    mouth = [last_point.x(), last_point.y()]                    if not net.isInside(head[0], head[1]):                        continue                    elif not net.isInside(mouth[0], mouth[1]):                        # Channels with the mouth outside the network go down to the outlet                        mouth = None                    lineas.append([head, mouth, name, idx])        # Snap all heads and mouths at once        row, col = net.indToCell(net._ix)        x, y = net.cellToXY(row, col)        cells = np.array((x, y)).T        heads = snap_points(np.array([linea[0] for linea in lineas]).reshape(-1, 2), cells)        has_mouth = np.array([linea[1] is not None for linea in lineas], bool)        mouths = np.full(len(lineas), -1, np.int64)        mouths[has_mouth] = snap_points(np.array([linea[1] for linea in lineas if linea[1] is not None]).reshape(-1, 2),                                        cells, net._ax, radius, net.getCellSize()[0])        # Mouths snapped to the head cell would give one-cell channels, these channels go down to the outlet        mouths[mouths == heads] = -1        if np.any(mouths < 0):            feedback.pushInfo("{} channels traced down to the outlet (mouth outside the network or at the head)".format(                np.count_nonzero(mouths < 0)))        # All the channels are traced in one walk (shared trunks are walked once)        path, slices = trace_channels(receiver_positions(net._ix, net._ixc), heads, mouths)        feedback.pushInfo("{} channels traced ({} walked cells)".format(len(slices), path.size))        net_data = (net._ix, net._ax, net._dx, net._zx, net._chi, net._slp, net._ksn, net._r2slp, net._r2ksn,                    net._dd)        canales = []        for n, (head, mouth, name, idx) in enumerate(lineas):            pos = channel_positions(path, slices[n])            chandata = np.array([arr[pos] for arr in net_data]).T            canales.append(Channel(net, chandata, net._thetaref, net._chi[-1], net._slp_np, net._ksn_np,                                   name=name, oid=idx))        if step > 0:            before, after = resample_channels(canales, step)            feedback.pushInfo("Channels resampled every {} map units ({} to {} vertices)".format(step, before, after))        if npoints > 1:            try:                wall, busy = batch_channel_gradients(canales, npoints, n_processes)            except (OSError, RuntimeError):                # The pool of processes cannot be started in some QGIS installations                feedback.reportError("Process pool not available, calculating channel gradients in one process")                n_processes = 1                wall, busy = batch_channel_gradients(canales, npoints, 1)            feedback.pushInfo("Channel gradients: {} channels in {:.3f} s with {} processes (speed-up {:.1f}x)".format(                len(canales), wall, n_processes, busy / wall if wall > 0 else 1.0))        ChannelCollection(canales).save(out_npy)        results = {self.OUT_NPY: out_npy}        return results
\ No newline at end of file
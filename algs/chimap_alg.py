@@ -1 +1 @@
-from qgis.PyQt.QtCore import QCoreApplicationfrom qgis.core import QgsProcessingAlgorithm, QgsProcessingParameterFile, QgsProcessingParameterVectorDestination, QgsProcessingParameterNumberfrom landspy import DEM, Flow, Grid, Networkfrom qgis import processingclass ChiMap(QgsProcessingAlgorithm):    # Constants used to refer to parameters and outputs They will be    # used when calling the algorithm from another algorithm, or when    # calling from the QGIS console.    NET = 'NET'    CHI_SHP = 'CHI_SHP'    DIST = 'DIST'     def __init__(self):        super().__init__()    def createInstance(self):        return type(self)()     def name(self):        """        Rerturns the algorithm name, used to identify the algorithm.        Must be unique within each provider and should contain lowercase alphanumeric characters only.        """        return "chiMap"         def displayName(self):        """        Returns the translated algorithm name, which should be used for any        user-visible display of the algorithm name.        """        return self.tr("Chi Shapefile")         def groupId(self):        """        Returns the unique ID of the group this algorithm belongs to.        """        return "geomorphic_indexes"    def group(self):        """        Returns the name of the group this algoritm belongs to.        """        return self.tr("Geomorphic Indexes")    def shortHelpString(self):        """        Returns a localised short helper string for the algorithm.         """        texto = """                    This script creates a polyline Chi shapefile                    Network : Network object (.dat)                    Distance : Segment distance to calculate ksn, slope, Chi, etc.                     Chi shapefile :  Line shapefile with Chi metrics (ksn, area, slope, etc.)                    """        return texto     def tr(self, string):        return QCoreApplication.translate('Processing', string)    def helpUrl(self):        return "https://github.com/geolovic/qgs_landspy"             def initAlgorithm(self, config=None):        """        Here we define the inputs and output of the algorithm, along        with some other properties.        """        self.addParameter(QgsProcessingParameterFile(self.NET, self.tr("Network (.dat)"), extension = "dat"))        self.addParameter(QgsProcessingParameterNumber(self.DIST, self.tr("Segment distance"), type=QgsProcessingParameterNumber.Double))        self.addParameter(QgsProcessingParameterVectorDestination(self.CHI_SHP, self.tr("Chi Shapefile")))     def processAlgorithm(self, parameters, context, feedback):        """        Here is where the processing itself takes place.        """        input_net = self.parameterAsFile(parameters, self.NET, context)        distance = self.parameterAsDouble(parameters, self.DIST, context)        out_shp = self.parameterAsOutputLayer(parameters, self.CHI_SHP, context)        net = Network(input_net)        net.chiShapefile(out_shp, distance)                results = {self.CHI_SHP : out_shp}        return results
\ No newline at end of file
+# -*- coding: utf-8 -*-import osimport timeimport numpy as npfrom osgeo import ogr, osrfrom qgis.PyQt.QtCore import QCoreApplication, QVariantfrom qgis.core import (QgsProcessing, QgsProcessingAlgorithm, QgsProcessingParameterFile,                       QgsProcessingParameterNumber, QgsProcessingParameterRasterDestination,                       QgsProcessingParameterVectorDestination, QgsProcessingParameterFeatureSink,                       QgsFeatureSink, QgsFields, QgsField, QgsFeature, QgsWkbTypes, QgsCoordinateReferenceSystem)from landspy import Grid, Networkfrom .network_tools import NetworkGeometry, theta_sweep, polyline_wkbclass ChiMap(QgsProcessingAlgorithm):    # Constants used to refer to parameters and outputs They will be    # used when calling the algorithm from another algorithm, or when    # calling from the QGIS console.    NET = 'NET'    CHI_SHP = 'CHI_SHP'    DIST = 'DIST'    THETAREF = 'THETAREF'    A0 = 'A0'    NPOINTS = 'NPOINTS'    THETA_MIN = 'THETA_MIN'    THETA_MAX = 'THETA_MAX'    THETA_STEP = 'THETA_STEP'    N_PROCESSES = 'N_PROCESSES'    OUTPUT_CHI = 'OUTPUT_CHI'    OUTPUT_KSN = 'OUTPUT_KSN'    OUTPUT_SCORES = 'OUTPUT_SCORES'    def __init__(self):        super().__init__()    def createInstance(self):        return type(self)()    def name(self):        """        Rerturns the algorithm name, used to identify the algorithm.        Must be unique within each provider and should contain lowercase alphanumeric characters only.        """        return "chiMap"    def displayName(self):        """        Returns the translated algorithm name, which should be used for any        user-visible display of the algorithm name.        """        return self.tr("Chi Shapefile")    def groupId(self):        """        Returns the unique ID of the group this algorithm belongs to.        """        return "geomorphic_indexes"    def group(self):        """        Returns the name of the group this algoritm belongs to.        """        return self.tr("Geomorphic Indexes")    def shortHelpString(self):        """        Returns a localised short helper string for the algorithm.        """        texto = """                    This script creates a polyline Chi shapefile                    Network : Network object (.dat)                    Distance : Segment distance to calculate ksn, slope, Chi, etc.                    Chi shapefile :  Line shapefile with Chi metrics (ksn, area, slope, etc.), same fields as landspy Network.chiShapefile:                    id_profile (profile id, profiles go from the heads, highest first, to the first cell of a previous profile), L (distance                    from the profile head to the middle of the segment), area_e6 (area in cells at the segment mouth / 1e6), z and chi (middle                    of the segment), ksn, slope (linear regressions) and rksn, rslope (R2 of the regressions)                    Thetaref [Optional] : m/n coefficient (concavity) used to calculate chi. If not set (and A0 is 1), the chi of the Network is used (as landspy Network.chiShapefile)                    A0 : Reference area to calculate chi (chi = integral of A0 / A^thetaref dx, with the area A in cells, as landspy). If it is not 1, chi is recalculated with the thetaref of the Network (if Thetaref is not set)                    N Points : Number of cells up and downstream used to calculate ksn by linear regression                    (window of N Points * 2 + 1 cells along the flow path)                    Chi Map [Optional] : Output raster with the chi values of the channel cells                    Ksn Map [Optional] : Output raster with the ksn values of the channel cells                    Theta min / max / step : Range of thetaref values for the concavity analysis                    Processes : Number of processes to run the concavity analysis                    Theta scores [Optional] : Output table with the collinearity (R2) and disorder of chi-elevation                    for each thetaref of the range (the best thetaref has max. R2 and min. disorder)                    """        return texto    def tr(self, string):        return QCoreApplication.translate('Processing', string)    def helpUrl(self):        return "https://github.com/geolovic/qgs_landspy"    def initAlgorithm(self, config=None):        """        Here we define the inputs and output of the algorithm, along        with some other properties.        """        self.addParameter(QgsProcessingParameterFile(self.NET, self.tr("Network (.dat)"), extension="dat"))        self.addParameter(QgsProcessingParameterNumber(self.DIST, self.tr("Segment distance"),                                                       type=QgsProcessingParameterNumber.Double))        self.addParameter(QgsProcessingParameterVectorDestination(self.CHI_SHP, self.tr("Chi Shapefile")))        self.addParameter(QgsProcessingParameterNumber(self.THETAREF, self.tr("Thetaref (m/n)"),                                                       QgsProcessingParameterNumber.Double, None, True, 0.0, 2.0))        self.addParameter(QgsProcessingParameterNumber(self.A0, self.tr("Reference area (A0)"),                                                       QgsProcessingParameterNumber.Double, 1.0, False, 0.0))        self.addParameter(QgsProcessingParameterNumber(self.NPOINTS, self.tr("N Points"),                                                       QgsProcessingParameterNumber.Integer, 5, False, 1, 1000))        self.addParameter(QgsProcessingParameterNumber(self.THETA_MIN, self.tr("Theta min"),                                                       QgsProcessingParameterNumber.Double, 0.2, False, 0.0, 2.0))        self.addParameter(QgsProcessingParameterNumber(self.THETA_MAX, self.tr("Theta max"),                                                       QgsProcessingParameterNumber.Double, 0.8, False, 0.0, 2.0))        self.addParameter(QgsProcessingParameterNumber(self.THETA_STEP, self.tr("Theta step"),                                                       QgsProcessingParameterNumber.Double, 0.01, False, 0.001, 1.0))        self.addParameter(QgsProcessingParameterNumber(self.N_PROCESSES, self.tr("Processes"),                                                       QgsProcessingParameterNumber.Integer, 1, False, 1, 64))        self.addParameter(QgsProcessingParameterRasterDestination(self.OUTPUT_CHI, "Chi Map", None, True, False))        self.addParameter(QgsProcessingParameterRasterDestination(self.OUTPUT_KSN, "Ksn Map", None, True, False))        self.addParameter(QgsProcessingParameterFeatureSink(self.OUTPUT_SCORES, self.tr("Theta scores"),                                                            QgsProcessing.TypeVector, None, True, False))    def processAlgorithm(self, parameters, context, feedback):        """        Here is where the processing itself takes place.        """        input_net = self.parameterAsFile(parameters, self.NET, context)        distance = self.parameterAsDouble(parameters, self.DIST, context)        out_shp = self.parameterAsOutputLayer(parameters, self.CHI_SHP, context)        has_thetaref = parameters.get(self.THETAREF) not in (None, "")        thetaref = self.parameterAsDouble(parameters, self.THETAREF, context)        a0 = self.parameterAsDouble(parameters, self.A0, context)        npoints = self.parameterAsInt(parameters, self.NPOINTS, context)        theta_min = self.parameterAsDouble(parameters, self.THETA_MIN, context)        theta_max = self.parameterAsDouble(parameters, self.THETA_MAX, context)        theta_step = self.parameterAsDouble(parameters, self.THETA_STEP, context)        n_processes = self.parameterAsInt(parameters, self.N_PROCESSES, context)        output_chi = self.parameterAsOutputLayer(parameters, self.OUTPUT_CHI, context)        output_ksn = self.parameterAsOutputLayer(parameters, self.OUTPUT_KSN, context)        # Network arrays (topological order, areas and distances) are read once and cached        net = Network(input_net)        geom = NetworkGeometry(net)        crs = QgsCoordinateReferenceSystem(net.getCRS())        if not has_thetaref and a0 == 1.0:            # Chi of the Network (calculated with its thetaref and A0 = 1), as landspy Network.chiShapefile            chi = np.asarray(net._chi, dtype=np.float64)            feedback.pushInfo("Using the chi of the Network (thetaref = {})".format(net._thetaref))        else:            # Chi is integrated for all the channel cells in one downstream-to-upstream sweep            if not has_thetaref:                thetaref = net._thetaref            t0 = time.perf_counter()            chi = geom.calculateChi(thetaref, a0)            feedback.pushInfo("Chi integration (thetaref = {}, A0 = {}): {} cells in {:.3f} s".format(                thetaref, a0, geom.ix.size, time.perf_counter() - t0))        results = {}        # Chi shapefile, segments of [distance] length with aggregated values        seg_names = ["L", "area_e6", "z", "chi", "ksn", "rksn", "slope", "rslope"]        t0 = time.perf_counter()        vertices, offsets, values = geom.getSegments(chi, distance)        values["area_e6"] = values.pop("area") / 1000000        xyz = np.column_stack((geom.getXY(vertices), geom.zx[vertices]))        profiles = values["profile"].tolist()        table = np.array([values[name] for name in seg_names]).T.tolist()        # The shapefile is written with OGR, as landspy.Network.chiShapefile        driver = ogr.GetDriverByName("GPKG" if out_shp.lower().endswith(".gpkg") else "ESRI Shapefile")        if os.path.exists(out_shp):            driver.DeleteDataSource(out_shp)        dataset = driver.CreateDataSource(out_shp)        sp = osr.SpatialReference()        sp.ImportFromWkt(net.getCRS())        layer = dataset.CreateLayer("rivers", sp, ogr.wkbLineString25D)        layer.CreateField(ogr.FieldDefn("id_profile", ogr.OFTInteger))        for name in seg_names:            layer.CreateField(ogr.FieldDefn(name, ogr.OFTReal))        layer.StartTransaction()        nfeats = len(offsets) - 1        for n in range(nfeats):            feat = ogr.Feature(layer.GetLayerDefn())            for idx, value in enumerate([profiles[n]] + table[n]):                feat.SetField(idx, value)            feat.SetGeometry(ogr.CreateGeometryFromWkb(polyline_wkb(xyz[offsets[n]:offsets[n + 1]])))            layer.CreateFeature(feat)        layer.CommitTransaction()        layer = None        dataset = None        feedback.pushInfo("Chi segments: {} segments from {} channel cells in {:.3f} s".format(            nfeats, geom.ix.size, time.perf_counter() - t0))        results[self.CHI_SHP] = out_shp        if output_chi:            chi_grid = Grid()            chi_grid.copyLayout(net)            chi_grid.setArray(geom.toArray(chi))            chi_grid.setNodata(-9999.)            chi_grid.save(output_chi)            results[self.OUTPUT_CHI] = output_chi        if output_ksn:            # Ksn by sliding linear regression (chi-elevation) along the flow paths            t0 = time.perf_counter()            ksn = geom.calculateGradients(chi, npoints)[0]            feedback.pushInfo("Ksn regression: {:.3f} s".format(time.perf_counter() - t0))            ksn_grid = Grid()            ksn_grid.copyLayout(net)            ksn_grid.setArray(geom.toArray(ksn))            ksn_grid.setNodata(-9999.)            ksn_grid.save(output_ksn)            results[self.OUTPUT_KSN] = output_ksn        # Concavity analysis (only if the scores table was requested)        fields = QgsFields()        fields.append(QgsField("theta", QVariant.Double))        fields.append(QgsField("r2", QVariant.Double))        fields.append(QgsField("disorder", QVariant.Double))        sink, dest_id = self.parameterAsSink(parameters, self.OUTPUT_SCORES, context, fields,                                             QgsWkbTypes.NoGeometry, crs)        if sink is None:            return results        thetas = np.arange(theta_min, theta_max + theta_step / 2, theta_step)        t0 = time.perf_counter()        try:            scores = theta_sweep(geom, thetas, a0, n_processes)        except (OSError, RuntimeError):            # The pool of processes cannot be started in some QGIS installations            feedback.reportError("Process pool not available, running the concavity analysis in one process")            scores = theta_sweep(geom, thetas, a0, 1)        feedback.pushInfo("Concavity analysis: {} thetaref values in {:.3f} s".format(            len(thetas), time.perf_counter() - t0))        for theta, r2, disorder in scores:            feat = QgsFeature(fields)            feat.setAttributes([float(theta), float(r2), float(disorder)])            sink.addFeature(feat, QgsFeatureSink.FastInsert)        if scores.size:            feedback.pushInfo("Max. R2: thetaref = {:.3f}".format(scores[np.argmax(scores[:, 1]), 0]))            feedback.pushInfo("Min. disorder: thetaref = {:.3f}".format(scores[np.argmin(scores[:, 2]), 0]))        results[self.OUTPUT_SCORES] = dest_id        return results
\ No newline at end of file
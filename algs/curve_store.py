@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar file format to store many hypsometric curves.
+
+A curve file has a fixed preamble (magic bytes, format version and header length), a JSON header
+and the data arrays, each one aligned to 64 bytes:
+
+    a            : float32 (K)        Relative areas, shared by all the curves
+    h            : float32 (N x K)    Relative elevations of the curves
+    hi, hi2      : float64 (N)        Hypsometric integrals (see HCurve.getHI() and HCurve.getHI2())
+    moments      : float64 (N x 5)    Moments of the curves (same order as HCurve.moments)
+    valid        : uint8 (N)          0 for empty curves (basins with less than 50 cells)
+    name_offsets : int64 (N + 1)      Offsets of the curve names in name_data
+    name_data    : uint8              Curve names (UTF-8)
+
+The header stores the dtype, shape and offset of each array, so arrays are opened lazily with
+numpy.memmap and a file with many curves opens without reading the curves. Old files with a pickled
+numpy array of landspy.HCurve objects can still be loaded (see load_curves).
+"""
+
+import os
+import numpy as np
+from landspy import HCurve
+from .hypsometry_tools import curve_matrix, hypsometric_moments
+from .array_file import has_magic, write_array_file, open_array_file
+
+MAGIC = b"HCURVES\0"
+VERSION = 1
+
+
+def make_hcurve(a, h, hi, hi2, name="", valid=True, moments=None):
+    """
+    Creates a landspy.HCurve from already calculated curve values (without reading the DEM)
+
+    Parameters
+    ----------
+    a, h : numpy.ndarray
+        Relative areas and elevations of the curve
+    hi, hi2 : float
+        Hypsometric integrals (see HCurve.getHI() and HCurve.getHI2())
+    name : str
+        Name of the curve
+    valid : bool
+        If False, the curve is an empty curve (basins with less than 50 cells), as in landspy.HCurve
+    moments : array_like, optional
+        Moments of the curve (see hypsometric_moments), calculated from the curve if not given
+    """
+    curve = HCurve.__new__(HCurve)
+    curve._name = name
+    if valid:
+        curve._data = np.array((a, h), dtype=np.float64).T
+        curve._HI = float(hi)
+        curve._HI2 = float(hi2)
+        if moments is None:
+            moments = hypsometric_moments(a, h)[0]
+        curve.moments = [float(val) for val in moments]
+    else:
+        curve._data = np.array([[0, 1], [1, 0]])
+        curve._HI = 0.5
+        curve._HI2 = 0.5
+        curve.moments = [0, 0, 0, 0, 0]
+    return curve
+
+
+def is_curve_file(path):
+    """
+    Returns True if the file is a curve file (checks the magic bytes)
+    """
+    return has_magic(path, MAGIC)
+
+
+def write_curves(path, a, h, names, hi, hi2, moments, valid):
+    """
+    Writes a set of hypsometric curves to a curve file. The file is written to a temporary file that
+    replaces the output file at the end. A curve file cannot be replaced while a CurveStore has it opened
+    (the memory maps lock the file in Windows), so the store must be closed first (see CurveList.save).
+
+    Parameters
+    ----------
+    path : str
+        Path of the output file
+    a : numpy.ndarray
+        Relative areas (K array, shared by all the curves)
+    h : numpy.ndarray
+        Relative elevations (N x K array)
+    names : list
+        Names of the curves
+    hi, hi2 : numpy.ndarray
+        Hypsometric integrals of the curves
+    moments : numpy.ndarray
+        Moments of the curves (N x 5 array, see hypsometric_moments)
+    valid : numpy.ndarray
+        Boolean array, False for empty curves
+    """
+    encoded = [str(name).encode("utf8") for name in names]
+    name_offsets = np.zeros(len(encoded) + 1, np.int64)
+    name_offsets[1:] = np.cumsum([len(name) for name in encoded])
+    arrays = {"a": np.asarray(a, np.float32),
+              "h": np.asarray(h, np.float32).reshape(len(encoded), -1),
+              "hi": np.asarray(hi, np.float64),
+              "hi2": np.asarray(hi2, np.float64),
+              "moments": np.asarray(moments, np.float64).reshape(len(encoded), 5),
+              "valid": np.asarray(valid, np.uint8),
+              "name_offsets": name_offsets,
+              "name_data": np.frombuffer(b"".join(encoded), np.uint8)}
+    write_array_file(path, MAGIC, VERSION, {"count": len(encoded)}, arrays)
+
+
+class CurveStore:
+    """
+    Read-only access to a curve file. Arrays are memory-mapped, so curves are only read when used.
+
+    Parameters
+    ----------
+    path : str
+        Path to the curve file
+    """
+    def __init__(self, path):
+        header, self._arrays = open_array_file(path, MAGIC, VERSION, "hypsometric curve")
+        self.path = path
+        self.version = header["version"]
+        self._count = header["count"]
+
+    def __len__(self):
+        return self._count
+
+    def __getattr__(self, key):
+        # Arrays (a, h, hi, hi2, moments, valid) as attributes
+        try:
+            return self.__dict__["_arrays"][key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def getName(self, idx):
+        """
+        Returns the name of the curve idx
+        """
+        offsets = self._arrays["name_offsets"]
+        return bytes(self._arrays["name_data"][offsets[idx]:offsets[idx + 1]]).decode("utf8")
+
+    def getNames(self):
+        """
+        Returns the names of all the curves
+        """
+        data = bytes(self._arrays["name_data"])
+        offsets = self._arrays["name_offsets"].tolist()
+        return [data[start:end].decode("utf8") for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def close(self):
+        """
+        Releases the memory-mapped arrays, so the file can be replaced. The store cannot be used after it
+        """
+        self._arrays = {}
+
+    def getCurve(self, idx):
+        """
+        Returns the curve idx as a landspy.HCurve
+        """
+        arrays = self._arrays
+        return make_hcurve(arrays["a"], arrays["h"][idx], arrays["hi"][idx], arrays["hi2"][idx],
+                           self.getName(idx), bool(arrays["valid"][idx]), arrays["moments"][idx])
+
+
+class CurveList:
+    """
+    Editable list of hypsometric curves. Curves of a CurveStore are kept as row numbers and converted
+    to landspy.HCurve objects only when they are accessed; curves can be added and removed as in a list.
+
+    Parameters
+    ----------
+    store : CurveStore, optional
+        Curve store with the initial curves
+    curves : list, optional
+        List of landspy.HCurve objects (used if store is None)
+    """
+    def __init__(self, store=None, curves=()):
+        self._store = store
+        self._items = list(range(len(store))) if store is not None else list(curves)
+        self._cache = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, idx):
+        item = self._items[idx]
+        if isinstance(item, HCurve):
+            return item
+        if item not in self._cache:
+            self._cache[item] = self._store.getCurve(item)
+        return self._cache[item]
+
+    def __iter__(self):
+        for idx in range(len(self._items)):
+            yield self[idx]
+
+    def __delitem__(self, idx):
+        item = self._items.pop(idx)
+        if not isinstance(item, HCurve):
+            self._cache.pop(item, None)
+
+    def insert(self, idx, curve):
+        self._items.insert(idx, curve)
+
+    def _rows(self):
+        # Store rows of the curves (-1 for curves that are not in the store)
+        return np.array([-1 if isinstance(item, HCurve) else item for item in self._items], np.int64)
+
+    def getMoments(self):
+        """
+        Returns the moments of all the curves (N x 5 array, same order as HCurve.moments). Moments of the
+        store curves are read from the store and the other curves keep their own HCurve.moments.
+        """
+        rows = self._rows()
+        moments = np.zeros((len(rows), 5))
+        stored = rows >= 0
+        if stored.any():
+            moments[stored] = self._store.moments[rows[stored]]
+        for idx in np.flatnonzero(~stored):
+            moments[idx] = self._items[idx].moments
+        return moments
+
+    def _values(self, getter, key):
+        # Values of all the curves, read from the store except for the curves already converted to HCurves
+        rows = self._rows()
+        values = np.zeros(len(rows))
+        stored = rows >= 0
+        if stored.any():
+            values[stored] = getattr(self._store, key)[rows[stored]]
+        for idx, item in enumerate(self._items):
+            curva = item if isinstance(item, HCurve) else self._cache.get(item)
+            if curva is not None:
+                values[idx] = getattr(curva, getter)()
+        return values
+
+    def getNames(self):
+        """
+        Returns the names of all the curves
+        """
+        names = self._store.getNames() if self._store is not None else []
+        curves = [self._cache.get(item) if not isinstance(item, HCurve) else item for item in self._items]
+        return [curva.getName() if curva is not None else names[item] for item, curva in zip(self._items, curves)]
+
+    def getHI(self):
+        """
+        Returns the hypsometric integrals (HCurve.getHI()) of all the curves
+        """
+        return self._values("getHI", "hi")
+
+    def save(self, path):
+        """
+        Saves the curves to a curve file (see write_curves). Curves that are not in the store are
+        resampled to the relative areas of the store (or 1024 points). If the file is the one of the store,
+        the store is closed before replacing the file and the list is reopened from the new file.
+        """
+        rows = self._rows()
+        stored = rows >= 0
+        other = np.flatnonzero(~stored)
+        npoints = self._store.a.size if self._store is not None else 1024
+        a, h_other = curve_matrix([(self._items[idx].getA(), self._items[idx].getH()) for idx in other], npoints)
+        h = np.empty((len(rows), npoints), np.float32)
+        h[other] = h_other
+        valid = np.ones(len(rows), bool)
+        if stored.any():
+            a = np.array(self._store.a)
+            h[stored] = self._store.h[rows[stored]]
+            valid[stored] = self._store.valid[rows[stored]] > 0
+        valid[other] = [self._items[idx].getA().size > 2 for idx in other]
+        names = self.getNames()
+        hi = self.getHI()
+        hi2 = self._values("getHI2", "hi2")
+        moments = self.getMoments()
+
+        # The memory maps of the store must be released before replacing its file
+        overwrite = (self._store is not None and os.path.exists(path)
+                     and os.path.samefile(path, self._store.path))
+        if not overwrite:
+            write_curves(path, a, h, names, hi, hi2, moments, valid)
+            return
+        store_path = self._store.path
+        self._store.close()
+        try:
+            write_curves(path, a, h, names, hi, hi2, moments, valid)
+        finally:
+            # If writing fails the old file is kept and opened again
+            self._store = CurveStore(store_path)
+        self._items = list(range(len(rows)))
+        self._cache = {}
+
+
+def load_curves(path):
+    """
+    Loads the curves of a curve file, or of an old numpy file (.npy) with a pickled array of HCurves
+
+    Returns
+    -------
+    CurveList
+        List of curves
+    """
+    if is_curve_file(path):
+        return CurveList(CurveStore(path))
+    curves = np.load(path, allow_pickle=True)
+    if any(type(curva) is not HCurve for curva in curves):
+        raise TypeError("{} does not contain hypsometric curves".format(path))
+    return CurveList(curves=list(curves))
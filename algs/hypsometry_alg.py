@@ -1 +1 @@
-from qgis.PyQt.QtCore import QCoreApplicationfrom qgis.core import QgsProcessingAlgorithm, QgsProcessingParameterRasterLayer, QgsProcessingParameterFileDestinationfrom qgis.core import QgsProcessingParameterFile, QgsProcessingParameterEnumfrom landspy import DEM, Grid, HCurvefrom qgis import processingimport numpy as npclass HypsometricCurves(QgsProcessingAlgorithm):    # Constants used to refer to parameters and outputs They will be    # used when calling the algorithm from another algorithm, or when    # calling from the QGIS console.    INPUT_DEM = 'INPUT_DEM'    BASINS = 'BASINS'    OUT_CURVES = 'OUT_CURVES'    NAMES = "NAMES"    def __init__(self):        super().__init__()    def createInstance(self):        return type(self)()     def name(self):        """        Rerturns the algorithm name, used to identify the algorithm.        Must be unique within each provider and should contain lowercase alphanumeric characters only.        """        return "hypsometricCurves"         def displayName(self):        """        Returns the translated algorithm name, which should be used for any        user-visible display of the algorithm name.        """        return self.tr("Get Hypsometric Curves")        def groupId(self):        """        Returns the unique ID of the group this algorithm belongs to.        """        return "geomorphic_indexes"    def group(self):        """        Returns the name of the group this algorithm belongs to.        """        return self.tr("Geomorphic Indexes")    def shortHelpString(self):        """        Returns a localised short helper string for the algorithm.         """        texto = """                    This script creates a Network object (*.dat file).                    DEM : Input Digital Elevation Model                    Basins: Raster with the drainage basins.                     Output Hypsometric Curves (*.npy): Output file with the hypsometric curves                    """        return texto     def tr(self, string):        return QCoreApplication.translate('Processing', string)    def helpUrl(self):        return "https://github.com/geolovic/qgs_landspy"    def initAlgorithm(self, config=None):        """        Here we define the inputs and output of the algorithm, along        with some other properties.        """        self.addParameter(QgsProcessingParameterRasterLayer(self.INPUT_DEM,  self.tr("DEM")))        self.addParameter(QgsProcessingParameterRasterLayer(self.BASINS, self.tr("Basins")))        self.addParameter(QgsProcessingParameterFileDestination(self.OUT_CURVES, self.tr("Hypsometric Curves")))        self.addParameter(QgsProcessingParameterFile(self.NAMES, self.tr("Basin Names"), defaultValue="", optional=True))     def processAlgorithm(self, parameters, context, feedback):        """        Here is where the processing itself takes place.        """        input_dem = self.parameterAsRasterLayer(parameters, self.INPUT_DEM, context)        input_basins = self.parameterAsRasterLayer(parameters, self.BASINS, context)        names_file = self.parameterAsString(parameters, self.NAMES, context)        out_curves = self.parameterAsString(parameters, self.OUT_CURVES, context)        dem = DEM(input_dem.source())        basins = Grid(input_basins.source())        nodata = basins.getNodata()        bids = np.unique(basins.readArray()).tolist()        bids.remove(nodata)        if names_file:            try:                names = {}                infile = open(names_file)                for linea in infile:                    data = linea.split(";")                    names[int(data[0])] = data[1]            except:                feedback.setProgressText("Wrong names file!!, using ids as names...")                names = {}                for bid in bids:                    names[bid] = str(bid)        else:            names = {}            for bid in bids:                names[bid] = str(bid)        curves = []        for bid in bids:            curva = HCurve(dem, basins, bid=bid, name=names[bid])            curves.append(curva)        curves = np.array(curves)        np.save(out_curves, curves, allow_pickle=True)        return {self.OUT_CURVES: out_curves}
\ No newline at end of file
+from qgis.PyQt.QtCore import QCoreApplicationfrom qgis.core import QgsProcessingAlgorithm, QgsProcessingParameterRasterLayer, QgsProcessingParameterFileDestinationfrom qgis.core import QgsProcessingParameterFile, QgsProcessingParameterEnumfrom qgis.core import QgsProcessing, QgsProcessingParameterFeatureSource, QgsProcessingParameterFieldfrom qgis.core import QgsFeatureRequestfrom qgis import processingfrom .hypsometry_tools import compact_labels, hypsometric_curves, MIN_CELLSfrom .curve_store import write_curvesfrom .raster_tools import rasterize_polygons, label_window, extent_window, read_windowclass HypsometricCurves(QgsProcessingAlgorithm):    # Constants used to refer to parameters and outputs They will be    # used when calling the algorithm from another algorithm, or when    # calling from the QGIS console.    INPUT_DEM = 'INPUT_DEM'    BASINS = 'BASINS'    BASINS_SHP = 'BASINS_SHP'    ID_FIELD = 'ID_FIELD'    NAME_FIELD = 'NAME_FIELD'    OUT_CURVES = 'OUT_CURVES'    NAMES = "NAMES"    def __init__(self):        super().__init__()    def createInstance(self):        return type(self)()     def name(self):        """        Rerturns the algorithm name, used to identify the algorithm.        Must be unique within each provider and should contain lowercase alphanumeric characters only.        """        return "hypsometricCurves"         def displayName(self):        """        Returns the translated algorithm name, which should be used for any        user-visible display of the algorithm name.        """        return self.tr("Get Hypsometric Curves")        def groupId(self):        """        Returns the unique ID of the group this algorithm belongs to.        """        return "geomorphic_indexes"    def group(self):        """        Returns the name of the group this algorithm belongs to.        """        return self.tr("Geomorphic Indexes")    def shortHelpString(self):        """        Returns a localised short helper string for the algorithm.         """        texto = """                    This script calculates the hypsometric curves of drainage basins.                    DEM : Input Digital Elevation Model                    Basins [Optional]: Raster with the drainage basins                    Basin polygons [Optional]: Polygon layer with the drainage basins (used if no basins raster is given). Polygons are rasterized at once to the DEM grid (if polygons overlap, the last one gets the shared cells)                    Id Field [Optional]: Field with the basin ids of the polygons (if not specified, the polygon position is used)                    Name Field [Optional]: Field with the basin names of the polygons                    Basin Names [Optional]: Text file with a basin id and name per line (id;name)                    All the curves are calculated at once (the basin cells are sorted together) following the landspy HCurve convention. Only the DEM window that covers the basins is read.                    Output Hypsometric Curves (*.hcv): Output curve file (columnar format with the curves, metrics and names, see curve_store.py)                    """        return texto     def tr(self, string):        return QCoreApplication.translate('Processing', string)    def helpUrl(self):        return "https://github.com/geolovic/qgs_landspy"    def initAlgorithm(self, config=None):        """        Here we define the inputs and output of the algorithm, along        with some other properties.        """        self.addParameter(QgsProcessingParameterRasterLayer(self.INPUT_DEM,  self.tr("DEM")))        self.addParameter(QgsProcessingParameterRasterLayer(self.BASINS, self.tr("Basins"), optional=True))        self.addParameter(QgsProcessingParameterFeatureSource(self.BASINS_SHP, self.tr("Basin polygons"),                                                              [QgsProcessing.TypeVectorPolygon], optional=True))        self.addParameter(            QgsProcessingParameterField(self.ID_FIELD, self.tr("Id Field"), parentLayerParameterName=self.BASINS_SHP,                                        type=QgsProcessingParameterField.Numeric, optional=True))        self.addParameter(            QgsProcessingParameterField(self.NAME_FIELD, self.tr("Name Field"), parentLayerParameterName=self.BASINS_SHP,                                        type=QgsProcessingParameterField.String, optional=True))        self.addParameter(QgsProcessingParameterFileDestination(self.OUT_CURVES, self.tr("Hypsometric Curves"),                                                                fileFilter="Hypsometric curves (*.hcv)"))        self.addParameter(QgsProcessingParameterFile(self.NAMES, self.tr("Basin Names"), defaultValue="", optional=True))     def processAlgorithm(self, parameters, context, feedback):        """        Here is where the processing itself takes place.        """        input_dem = self.parameterAsRasterLayer(parameters, self.INPUT_DEM, context)        input_basins = self.parameterAsRasterLayer(parameters, self.BASINS, context)        basins_shp = self.parameterAsSource(parameters, self.BASINS_SHP, context)        id_field = self.parameterAsString(parameters, self.ID_FIELD, context)        name_field = self.parameterAsString(parameters, self.NAME_FIELD, context)        names_file = self.parameterAsString(parameters, self.NAMES, context)        out_curves = self.parameterAsString(parameters, self.OUT_CURVES, context)        # Only the DEM window with the basins is read (windowed GDAL reads)        dem_path = input_dem.source()        dem_dims = (input_dem.height(), input_dem.width())        poly_names = {}        if input_basins is not None:            if dem_dims != (input_basins.height(), input_basins.width()):                feedback.reportError("DEM and Basins have different dimensions!!")                return {}            window = label_window(input_basins.source())            if window is None:                feedback.reportError("No basins in the basins raster!!")                return {}            basin_arr, _, basin_nodata, _ = read_window(input_basins.source(), window)        elif basins_shp is not None:            # Polygons (in the DEM CRS) and the DEM window that covers them            n_id = basins_shp.fields().indexFromName(id_field)            n_name = basins_shp.fields().indexFromName(name_field)            request = QgsFeatureRequest().setDestinationCrs(input_dem.crs(), context.transformContext())            geoms = []            poly_labels = []            poly_ids = {}            extent = None            for n, feat in enumerate(basins_shp.getFeatures(request)):                if not feat.hasGeometry():                    continue                bid = int(feat[n_id]) if n_id >= 0 else n + 1                # Polygons with the same id are burned with the same label (one curve per id)                geoms.append(feat.geometry().asWkb())                if extent is None:                    extent = feat.geometry().boundingBox()                else:                    extent.combineExtentWith(feat.geometry().boundingBox())                poly_labels.append(poly_ids.setdefault(bid, len(poly_ids) + 1))                if n_name >= 0:                    poly_names[bid] = str(feat[n_name])            window = None            if extent is not None:                window = extent_window(dem_path, (extent.xMinimum(), extent.yMinimum(),                                                  extent.xMaximum(), extent.yMaximum()))            if window is None:                feedback.reportError("No basin polygons inside the DEM!!")                return {}            basin_nodata = 0        else:            feedback.reportError("A basins raster or a basin polygon layer is needed!!")            return {}        # All the curves are calculated at once from the sorted basin cells        dem_arr, geot, dem_nodata, proj = read_window(dem_path, window)        if input_basins is None:            # All the polygons are rasterized at once to the DEM window grid            basin_arr = rasterize_polygons(geoms, geot, dem_arr.shape, proj, poly_labels)        ids, labels, z = compact_labels(basin_arr, dem_arr, basin_nodata, dem_nodata)        if ids.size == 0:            feedback.reportError("No basins in the basins raster!!")            return {}        if input_basins is None:            label_ids = {label: bid for bid, label in poly_ids.items()}            bids = [label_ids[int(label)] for label in ids]        else:            bids = [int(bid) for bid in ids]        data = hypsometric_curves(labels, z)        moments = data["moments"]        feedback.pushInfo("{} hypsometric curves calculated".format(len(bids)))        if names_file:            try:                names = {}                infile = open(names_file)                for linea in infile:                    data_line = linea.split(";")                    names[int(data_line[0])] = data_line[1]            except:                feedback.setProgressText("Wrong names file!!, using ids as names...")                names = {}        else:            names = {}        names = {**poly_names, **names}        # Curves are saved in a columnar curve file (see curve_store), without creating HCurve objects        # Basins with less than 50 cells or flat are empty curves (as in landspy.HCurve)        valid = (data["cells"] >= MIN_CELLS) & (data["zmax"] > data["zmin"])        moments[~valid] = 0        write_curves(out_curves, data["a"], data["h"], [names.get(bid, str(bid)) for bid in bids],                     data["hi"], data["hi2"], moments, valid)        return {self.OUT_CURVES: out_curves}
\ No newline at end of file
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized helpers to calculate hypsometric curves for many basins at once.
+
+Instead of masking and sorting the DEM once per basin (as landspy.HCurve does), elevations are
+normalized by the elevation range of their basin and all the basin cells are sorted at once (a single
+numpy.lexsort by basin label and descending elevation). Curves, integrals and moments follow the
+landspy.HCurve convention: a point per sorted cell (relative areas from 1/n to 1), resampled to 1024
+points for basins with 1024 cells or more, and the last segment of the curve is not integrated.
+"""
+
+import numpy as np
+
+# Minimum number of cells to calculate a hypsometric curve (as in landspy.HCurve)
+MIN_CELLS = 50
+
+
+def compact_labels(basins, dem, basin_nodata=None, dem_nodata=None):
+    """
+    Gets the basin cells with valid elevations and relabels the basins with consecutive labels
+
+    Parameters
+    ----------
+    basins : numpy.ndarray
+        Array with basin ids
+    dem : numpy.ndarray
+        Array with elevations (same shape as basins)
+    basin_nodata, dem_nodata : float, optional
+        NoData values of basins and dem
+
+    Returns
+    -------
+    tuple (ids, labels, z)
+        ids : Basin ids (sorted)
+        labels : Label (position in ids) of each valid cell
+        z : Elevation of each valid cell
+    """
+    basins = basins.ravel()
+    z = dem.ravel()
+    valid = np.isfinite(z)
+    if basin_nodata is not None:
+        valid &= basins != basin_nodata
+    if dem_nodata is not None:
+        valid &= z != dem_nodata
+    ids, labels = np.unique(basins[valid], return_inverse=True)
+    return ids, labels.ravel(), z[valid].astype(np.float64)
+
+
+def hypsometric_curves(labels, z, npoints=1024):
+    """
+    Calculates the hypsometric curves of all the basins at once, as landspy.HCurve does
+
+    Each basin curve has a point per cell (elevations sorted in descending order, relative areas from
+    1/n to 1). Curves of basins with npoints cells or more are linearly interpolated to npoints regular
+    relative areas, and their integral (hi2) and moments are calculated from these points. Basins with
+    less cells keep the integral and moments of their cell points, and their output curves are
+    interpolated to the same relative areas (the elevation is 1 for relative areas below 1/n).
+
+    Parameters
+    ----------
+    labels : numpy.ndarray
+        Consecutive labels (0 to n-1) of the basin cells (see compact_labels)
+    z : numpy.ndarray
+        Elevations of the basin cells
+    npoints : int
+        Number of points of the output curves
+
+    Returns
+    -------
+    dict
+        Dictionary with the keys:
+        a : Relative areas (npoints array, shared by all the curves, from 0 to 1)
+        h : Relative elevations (n x npoints array)
+        hi : Hypsometric integral (hmean - hmin) / (hmax - hmin)
+        hi2 : Hypsometric integral calculated by integrating the curves
+        moments : Statistical moments of the curves (n x 5 array, see hypsometric_moments)
+        cells : Number of cells of each basin
+        zmin, zmax : Minimum and maximum elevations of each basin
+    """
+    nlab = int(labels.max()) + 1 if labels.size else 0
+    cells = np.bincount(labels, minlength=nlab)
+    zmin = np.full(nlab, np.inf)
+    zmax = np.full(nlab, -np.inf)
+    np.minimum.at(zmin, labels, z)
+    np.maximum.at(zmax, labels, z)
+    zsum = np.bincount(labels, z, nlab)
+    zrange = zmax - zmin
+    flat = ~(zrange > 0)
+    zrange[flat] = 1.0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        hi = (zsum / np.maximum(cells, 1) - zmin) / zrange
+
+    # Basins too small (or flat) get the diagonal curve and no moments, as empty HCurves
+    a = np.linspace(0, 1, npoints)
+    h = np.empty((nlab, npoints))
+    hi2 = np.full(nlab, 0.5)
+    moments = np.zeros((nlab, 5))
+    empty = flat | (cells < MIN_CELLS)
+    h[empty] = 1 - a
+    hi[empty] = 0.5
+    if not empty.all():
+        rel = (z - zmin[labels]) / zrange[labels]
+        _sorted_curves(labels, rel, cells, ~empty, a, h, hi2, moments)
+    return {"a": a, "h": h, "hi": hi, "hi2": hi2, "moments": moments, "cells": cells, "zmin": zmin,
+            "zmax": zmax}
+
+
+def _sorted_curves(labels, rel, cells, valid, a, h, hi2, moments):
+    """
+    Calculates (in place) the curves, integrals and moments of the valid basins from their sorted cells,
+    as landspy.HCurve does
+
+    Parameters
+    ----------
+    labels, rel : numpy.ndarray
+        Labels and relative elevations of the basin cells
+    cells : numpy.ndarray
+        Number of cells of each basin
+    valid : numpy.ndarray
+        Boolean array with the basins to calculate
+    a, h, hi2, moments : numpy.ndarray
+        Shared relative areas and output curves, integrals and moments (see hypsometric_curves)
+    """
+    sel = valid[labels]
+    lab = labels[sel]
+    hh = rel[sel]
+    order = np.lexsort((-hh, lab))
+    lab = lab[order]
+    hh = hh[order]
+
+    # Relative area of each cell (rank / n, from 1/n to 1)
+    count = np.where(valid, cells, 0)
+    rank = np.arange(lab.size) - (np.cumsum(count) - count)[lab]
+    n = cells[lab].astype(np.float64)
+    aa = (rank + 1) / n
+
+    # Curves interpolated to the shared relative areas (rows are offset to interpolate at once, and
+    # HCurve keeps h = 1 below the first point)
+    rows = np.flatnonzero(valid)
+    curves = np.interp((a + 2.0 * rows[:, None]).ravel(), aa + 2.0 * lab, hh).reshape(rows.size, a.size)
+    curves[a[None, :] < 1.0 / cells[rows, None]] = 1.0
+    h[rows] = curves
+
+    # Large basins, integral (without the last segment) and moments of the interpolated curves
+    large = rows[cells[rows] >= a.size]
+    if large.size:
+        trapz = np.trapz if hasattr(np, "trapz") else np.trapezoid
+        hi2[large] = trapz(h[large][:, :-1], a[:-1], axis=1)
+        moments[large] = hypsometric_moments(a, h[large])
+
+    # Small basins, integral and moments of the cell points
+    small = valid & (cells < a.size)
+    rows = np.flatnonzero(small)
+    if rows.size == 0:
+        return
+    pts = small[lab]
+    lab, hh, rank, n, aa = lab[pts], hh[pts], rank[pts], n[pts], aa[pts]
+
+    # Trapezoidal integral between consecutive points (HCurve leaves out the last segment)
+    seg = rank[:-1] < n[:-1] - 2
+    width = 1.0 / n[:-1][seg]
+    hi2[rows] = np.bincount(lab[:-1][seg], width * (hh[:-1][seg] + hh[1:][seg]) / 2, h.shape[0])[rows]
+
+    # 3rd degree polynomials fitted to the points (normal equations solved for all the basins at once)
+    nlab = h.shape[0]
+    pw = aa[:, None] ** np.arange(7)
+    sa = np.stack([np.bincount(lab, pw[:, k], nlab)[rows] for k in range(7)], axis=1)
+    sh = np.stack([np.bincount(lab, hh * pw[:, k], nlab)[rows] for k in range(4)], axis=1)
+    idx = np.arange(4)
+    c = np.linalg.solve(sa[:, idx[:, None] + idx[None, :]], sh[:, :, None])[:, :, 0]
+    moments[rows] = _polynomial_moments(c.T)
+
+
+def curve_matrix(curves, npoints=1024):
+    """
+    Resamples a list of hypsometric curves to the same relative areas
+
+    Parameters
+    ----------
+    curves : list
+        List of tuples (a, h) with the relative areas and elevations of each curve
+    npoints : int
+        Number of points of the resampled curves
+
+    Returns
+    -------
+    tuple (a, h)
+        a : Relative areas (npoints array)
+        h : Relative elevations (N x npoints array)
+    """
+    a = np.linspace(0, 1, npoints)
+    h = np.empty((len(curves), npoints))
+    for n, (ca, ch) in enumerate(curves):
+        h[n] = np.interp(a, ca, ch)
+    return a, h
+
+
+def hypsometric_moments(a, h):
+    """
+    Calculates the statistical moments of a set of hypsometric curves at once. Curves are fitted
+    to a 3rd degree polynomial (a single least squares solve for all the curves) and the moments are
+    derived from the polynomial coefficients following Harlin (1978), as landspy.HCurve does.
+
+    Harlin, J. M. (1978). Statistical Moments of the Hypsometric Curve and Its Density
+    Function. Mathematical Geology, Vol. 10 (1), 59-72.
+
+    Parameters
+    ----------
+    a : numpy.ndarray
+        Relative areas (K array, shared by all the curves)
+    h : numpy.ndarray
+        Relative elevations (N x K array)
+
+    Returns
+    -------
+    numpy.ndarray
+        N x 5 array with the moments in the same order as HCurve.moments: integral of the polynomial,
+        kurtosis, skewness, density kurtosis and density skewness
+    """
+    h = np.atleast_2d(h)
+    vander = np.vander(a, 4, increasing=True)
+    c = np.linalg.lstsq(vander, h.T, rcond=None)[0]
+    return _polynomial_moments(c)
+
+
+def _polynomial_moments(c):
+    """
+    Moments of the hypsometric curves (Harlin, 1978) given the coefficients of their 3rd degree
+    polynomials (4 x N array, increasing degree). See hypsometric_moments.
+    """
+    idx = np.arange(4)[:, None]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # Moments of the hypsometric curve
+        ia = (c / (idx + 1)).sum(axis=0)
+        m10 = (c / (idx + 2)).sum(axis=0) / ia
+        tmp1 = (c / (idx + 3)).sum(axis=0) / ia
+        tmp2 = (c / (idx + 4)).sum(axis=0) / ia
+        tmp3 = (c / (idx + 5)).sum(axis=0) / ia
+        m20 = tmp1 - m10 ** 2
+        m30 = tmp2 - 3 * m10 * tmp1 + 2 * m10 ** 3
+        m40 = tmp3 - 4 * m10 * tmp2 + 6 * m10 ** 2 * tmp1 - 3 * m10 ** 4
+
+        # Moments of the density function (derivative of the polynomial)
+        k = np.arange(1, 4)[:, None]
+        dc = k * c[1:]
+        demon = c[1:].sum(axis=0)
+        ex = (dc / (k + 1)).sum(axis=0) / demon
+        dtmp1 = (dc / (k + 2)).sum(axis=0) / demon
+        dtmp2 = (dc / (k + 3)).sum(axis=0) / demon
+        ex4 = (dc / (k + 4)).sum(axis=0) / demon
+        ex2 = dtmp1 - ex ** 2
+        ex3 = dtmp2 - 3.0 * ex * dtmp1 + 2.0 * ex ** 3
+        ex4 = ex4 - 4.0 * ex * dtmp2 + 6.0 * ex ** 2 * dtmp1 - 3.0 * ex ** 4
+
+        return np.array((ia, m30 / m20 ** 1.5, m40 / m20 ** 2, ex3 / ex2 ** 1.5, ex4 / ex2 ** 2)).T
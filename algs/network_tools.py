@@ -0,0 +1,1283 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized helpers to work with the topologically sorted cells of a landspy Flow.
+
+Flow (and Network) cells are stored as two arrays of linear indexes, givers (ix) and receivers (ixc),
+sorted so that every giver appears before its receiver. Instead of walking these arrays cell by cell
+in Python, the functions of this module propagate values along the flow paths by pointer doubling:
+on each iteration every cell adds the value of the cell its pointer refers to, and then jumps to the
+pointer of that cell. A flow path of L cells is resolved in log2(L) vectorized iterations.
+"""
+
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+def receiver_positions(ix, ixc):
+    """
+    Gets, for each giver, the position of its receiver within the givers array.
+
+    Parameters
+    ----------
+    ix : numpy.ndarray
+        Giver cells (linear indexes) in topological order
+    ixc : numpy.ndarray
+        Receiver cells (linear indexes)
+
+    Returns
+    -------
+    numpy.ndarray
+        Array with the same size as ix with the receiver positions. Receivers that are not givers
+        (outlets) are marked with -1.
+    """
+    if ix.size == 0:
+        return np.array([], np.int64)
+    ixcix = np.full(max(int(ix.max()), int(ixc.max())) + 1, -1, np.int64)
+    ixcix[ix] = np.arange(ix.size)
+    return ixcix[ixc]
+
+
+def accumulate_downstream(values, rpos):
+    """
+    Sums values along the flow paths, from each cell to its outlet (both included).
+    output[n] = values[n] + values[rpos[n]] + values[rpos[rpos[n]]] + ...
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        Values for each cell
+    rpos : numpy.ndarray
+        Receiver positions (see receiver_positions). Cells with -1 are outlets.
+
+    Returns
+    -------
+    numpy.ndarray (float64)
+    """
+    acc = np.array(values, dtype=np.float64)
+    nxt = np.array(rpos, dtype=np.int64)
+    active = np.flatnonzero(nxt >= 0)
+    while active.size:
+        # Right hand sides are evaluated before the assignment, so all cells jump simultaneously
+        pointed = nxt[active]
+        acc[active] += acc[pointed]
+        nxt[active] = nxt[pointed]
+        active = active[nxt[active] >= 0]
+    return acc
+
+
+def find_roots(pointers):
+    """
+    Follows an array of pointers until every element points to a root (an element pointing to itself).
+
+    Parameters
+    ----------
+    pointers : numpy.ndarray
+        Array of integer pointers. Roots are elements with pointers[n] == n
+
+    Returns
+    -------
+    numpy.ndarray
+        Root reached from each element
+    """
+    ptr = np.array(pointers, dtype=np.int64)
+    active = np.flatnonzero(ptr[ptr] != ptr)
+    while active.size:
+        ptr[active] = ptr[ptr[active]]
+        active = active[ptr[active] != ptr[ptr[active]]]
+    return ptr
+
+
+def jump_pointers(pointers, steps):
+    """
+    Follows an array of pointers a given number of steps (binary lifting: log2(steps) iterations).
+    Pointers of roots (pointers[n] == n) are saturated, so paths stop at them.
+
+    Parameters
+    ----------
+    pointers : numpy.ndarray
+        Array of integer pointers
+    steps : int
+        Number of steps
+
+    Returns
+    -------
+    numpy.ndarray
+        Element reached from each element after (up to) steps jumps
+    """
+    result = np.arange(pointers.size)
+    power = np.asarray(pointers, dtype=np.int64)
+    while steps > 0:
+        if steps & 1:
+            result = power[result]
+        steps >>= 1
+        if steps:
+            power = power[power]
+    return result
+
+
+def link_tops(rpos):
+    """
+    Gets the top cell of the stream link of each cell. Links are pieces of the network between
+    heads/confluences and the next confluence, so cells follow their single giver upstream until a
+    head (no givers) or a confluence (two or more givers), which is the top of the link.
+
+    Parameters
+    ----------
+    rpos : numpy.ndarray
+        Receiver positions (see receiver_positions)
+
+    Returns
+    -------
+    numpy.ndarray
+        Position of the top of the link of each cell
+    """
+    ncells = rpos.size
+    cells = np.arange(ncells)
+    has_rcv = rpos >= 0
+    ngivers = np.bincount(rpos[has_rcv], minlength=ncells)
+    up = cells.copy()
+    single = has_rcv & (ngivers[np.where(has_rcv, rpos, 0)] == 1)
+    up[rpos[single]] = cells[single]
+    return find_roots(up)
+
+
+def stream_links(rpos):
+    """
+    Gets the stream links of the network (see link_tops) and how they are connected.
+
+    Parameters
+    ----------
+    rpos : numpy.ndarray
+        Receiver positions (see receiver_positions) in topological order
+
+    Returns
+    -------
+    tuple (tops, link, down)
+        tops : Position of the top of each link (in topological order)
+        link : Link of each cell
+        down : Downstream link of each link (the link of the receiver of its mouth, -1 at outlets)
+    """
+    top = link_tops(rpos)
+    tops, link = np.unique(top, return_inverse=True)
+    link = link.ravel()
+    rcv_link = np.where(rpos >= 0, link[np.where(rpos >= 0, rpos, 0)], -1)
+    leaves = np.flatnonzero(rcv_link != link)
+    down = np.full(tops.size, -1, np.int64)
+    down[link[leaves]] = rcv_link[leaves]
+    return tops, link, down
+
+
+def strahler_order(rpos):
+    """
+    Calculates the Strahler order of the network cells. Orders are solved at link level (one loop
+    iteration per link, in topological order) and then broadcast to the cells of each link.
+
+    Parameters
+    ----------
+    rpos : numpy.ndarray
+        Receiver positions (see receiver_positions) in topological order
+
+    Returns
+    -------
+    numpy.ndarray
+        Strahler order of each cell
+    """
+    if rpos.size == 0:
+        return np.array([], np.int64)
+    tops, link, down = stream_links(rpos)
+
+    # Tops are in topological order, so every link is solved before its downstream link
+    order = np.ones(tops.size, np.int64)
+    maxo = np.zeros(tops.size, np.int64)
+    nmax = np.zeros(tops.size, np.int64)
+    for n, d in enumerate(down.tolist()):
+        if maxo[n]:
+            order[n] = maxo[n] + (nmax[n] > 1)
+        if d >= 0:
+            if order[n] > maxo[d]:
+                maxo[d] = order[n]
+                nmax[d] = 1
+            elif order[n] == maxo[d]:
+                nmax[d] += 1
+    return order[link]
+
+
+def area_outlets(ix, ixc, fac, min_area, max_area):
+    """
+    Gets the outlets of the largest basins with drainage area within a range: cells with area within
+    the range that drain to a cell with area greater than the maximum (or to the grid outlet).
+
+    Parameters
+    ----------
+    ix : numpy.ndarray
+        Giver cells (linear indexes) of the Flow
+    ixc : numpy.ndarray
+        Receiver cells (linear indexes) of the Flow
+    fac : numpy.ndarray
+        Drainage area of all the cells of the grid (any units)
+    min_area, max_area : float
+        Range of drainage areas (same units as fac)
+
+    Returns
+    -------
+    numpy.ndarray
+        Outlet cells (linear indexes)
+    """
+    fac = fac.ravel()
+    inrange = (fac >= min_area) & (fac <= max_area)
+    valid = np.zeros(fac.size, bool)
+    valid[ix] = True
+    valid[ixc] = True
+    rcv_area = np.full(fac.size, np.inf)
+    rcv_area[ix] = fac[ixc]
+    return np.flatnonzero(inrange & valid & (rcv_area > max_area))
+
+
+def label_basins(ix, ixc, ncells, outlets, ids):
+    """
+    Labels the drainage basins of a set of outlets in a single sweep. Every outlet is seeded as a root
+    and the rest of the cells point to their receivers, so all the basins are resolved at once by
+    following the pointers (see find_roots) regardless of the number of outlets. Nested outlets keep
+    their own labels (upper basins are excluded from the basins that contain them).
+
+    Parameters
+    ----------
+    ix : numpy.ndarray
+        Giver cells (linear indexes) of the Flow
+    ixc : numpy.ndarray
+        Receiver cells (linear indexes) of the Flow
+    ncells : int
+        Total number of cells of the grid
+    outlets : numpy.ndarray
+        Outlet cells (linear indexes)
+    ids : numpy.ndarray
+        Basin ids for each outlet (non zero integers)
+
+    Returns
+    -------
+    numpy.ndarray
+        Array (ncells) with the basin id of each cell (0 for cells outside the basins)
+    """
+    pointers = np.arange(ncells)
+    pointers[ix] = ixc
+    outlets = np.asarray(outlets, dtype=np.int64)
+    pointers[outlets] = outlets
+    seeds = np.zeros(ncells, np.int64)
+    seeds[outlets] = ids
+    return seeds[find_roots(pointers)]
+
+
+def basin_parents(ix, ixc, ncells, outlets, labels):
+    """
+    Gets the parent of each basin of a label array created with label_basins (the basin that receives
+    the flow of its outlet). Together with the incremental labels, parents define the basin tree:
+    the full basin of an outlet is the union of its label and the labels of all its descendants.
+
+    Parameters
+    ----------
+    ix : numpy.ndarray
+        Giver cells (linear indexes) of the Flow
+    ixc : numpy.ndarray
+        Receiver cells (linear indexes) of the Flow
+    ncells : int
+        Total number of cells of the grid
+    outlets : numpy.ndarray
+        Outlet cells (linear indexes)
+    labels : numpy.ndarray
+        Basin labels (ncells array, see label_basins)
+
+    Returns
+    -------
+    numpy.ndarray
+        Parent basin id for each outlet (0 for basins that do not drain to another basin)
+    """
+    receivers = np.arange(ncells)
+    receivers[ix] = ixc
+    outlets = np.asarray(outlets, dtype=np.int64)
+    rcv = receivers[outlets]
+    return np.where(rcv == outlets, 0, labels.ravel()[rcv])
+
+
+def trace_channels(rpos, heads, mouths=None):
+    """
+    Traces the flow paths of a set of channels (from each head down to its mouth, or to the outlet if
+    the mouth is not downstream of the head) in a single walk. Walked cells are stored once in a flat
+    path array, as runs of consecutive cells, and marked as visited. When a channel reaches a visited
+    cell, it follows the runs already walked (by their offsets), so trunks shared by several channels
+    are walked only once.
+
+    Parameters
+    ----------
+    rpos : numpy.ndarray
+        Receiver positions (see receiver_positions)
+    heads : numpy.ndarray
+        Positions of the channel heads
+    mouths : numpy.ndarray, optional
+        Positions of the channel mouths (-1 or None to walk down to the outlet)
+
+    Returns
+    -------
+    tuple (path, slices)
+        path : Array with the walked positions
+        slices : List with the (start, stop) slices of path of each channel, from head to mouth
+    """
+    heads = np.asarray(heads, np.int64)
+    mouths = np.full(heads.size, -1, np.int64) if mouths is None else np.asarray(mouths, np.int64)
+    where = np.full(rpos.size, -1, np.int64)
+    path = []
+    run_of = []
+    # Runs: start, stop and path index where the run continues (-1 outlet, -2 not walked yet)
+    runs = []
+
+    def walk(cell, mouth):
+        # Walks a new run from an unvisited cell until a visited cell, an outlet or the mouth
+        start = len(path)
+        run = len(runs)
+        nxt = -1
+        while True:
+            where[cell] = len(path)
+            path.append(cell)
+            run_of.append(run)
+            rcv = rpos[cell]
+            if cell == mouth:
+                nxt = -2 if rcv >= 0 else -1
+                break
+            if rcv < 0:
+                break
+            if where[rcv] >= 0:
+                nxt = int(where[rcv])
+                break
+            cell = rcv
+        runs.append([start, len(path), nxt])
+        return run
+
+    slices = []
+    for head, mouth in zip(heads.tolist(), mouths.tolist()):
+        chan = []
+        cell = head
+        while True:
+            if where[cell] < 0:
+                walk(cell, mouth)
+            idx = int(where[cell])
+            run = runs[run_of[idx]]
+            if mouth >= 0 and where[mouth] >= idx and run_of[where[mouth]] == run_of[idx]:
+                chan.append((idx, int(where[mouth]) + 1))
+                break
+            chan.append((idx, run[1]))
+            if run[2] == -1:
+                break
+            if run[2] == -2:
+                # The run was stopped at the mouth of another channel, the walk goes on downstream
+                cell = int(rpos[path[run[1] - 1]])
+                if where[cell] < 0:
+                    walk(cell, mouth)
+                run[2] = int(where[cell])
+            cell = path[run[2]]
+        slices.append(chan)
+    return np.array(path, np.int64), slices
+
+
+def channel_positions(path, slices):
+    """
+    Gets the positions of the cells of a channel traced with trace_channels
+    """
+    return np.concatenate([path[start:stop] for start, stop in slices])
+
+
+def snap_points(points, xy, weights=None, radius=0.0, cellsize=1.0):
+    """
+    Snaps points to a set of cells (e.g. channel cells). All the points are snapped at once with a
+    single query to a KD-tree of the cells. If weights (e.g. flow accumulation) and a search radius
+    are given, points are snapped to the cell with the maximum weight within the radius (or to the
+    closest cell if there are no cells within the radius), otherwise to the closest cell.
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        Array with the [x, y] coordinates of the points to snap (first two columns)
+    xy : numpy.ndarray
+        Array with the [x, y] coordinates of the cells
+    weights : numpy.ndarray, optional
+        Weight of each cell
+    radius : float
+        Search radius (map units)
+    cellsize : float
+        Cell size of the grid, to bound the number of cells within the radius
+
+    Returns
+    -------
+    numpy.ndarray
+        Position (in xy) of the cell for each point
+    """
+    points = np.asarray(points, dtype=np.float64)[:, :2]
+    if points.shape[0] == 0 or len(xy) == 0:
+        return np.zeros(points.shape[0], np.int64)
+    tree = cKDTree(xy)
+    pos = tree.query(points, 1)[1]
+    if weights is None or radius <= 0:
+        return pos
+
+    ncand = min(len(xy), int(np.ceil(np.pi * (radius / abs(cellsize) + 1) ** 2)))
+    cand = tree.query(points, ncand, distance_upper_bound=radius)[1].reshape(points.shape[0], -1)
+    valid = cand < len(xy)
+    weights = np.asarray(weights, dtype=np.float64)
+    cand_w = np.where(valid, weights[np.where(valid, cand, 0)], -np.inf)
+    best = cand[np.arange(cand.shape[0]), np.argmax(cand_w, axis=1)]
+    return np.where(valid.any(axis=1), best, pos)
+
+
+# Number of cells of the blocks where the cumulative sums of the regressions restart
+SUM_BLOCK_CELLS = 256
+
+
+def _shift_sums(cnt, sums, dx, dy):
+    """
+    Moves the regression sums (sx, sy, sxx, syy, sxy) of values centred on (a, b) to values centred
+    on (a - dx, b - dy)
+    """
+    sx, sy, sxx, syy, sxy = sums
+    return [sx + cnt * dx, sy + cnt * dy, sxx + 2 * dx * sx + cnt * dx ** 2, syy + 2 * dy * sy + cnt * dy ** 2,
+            sxy + dx * sy + dy * sx + cnt * dx * dy]
+
+
+def _regression(cnt, sx, sy, sxx, syy, sxy):
+    """
+    Slope and R2 of the y = ax + b linear regression from the sums of the regression points
+    """
+    varx = cnt * sxx - sx ** 2
+    vary = cnt * syy - sy ** 2
+    cov = cnt * sxy - sx * sy
+    # Differences of cumulative sums leave some round-off in constant windows
+    okx = varx > 1e-12 * np.maximum(cnt * sxx, 1e-300)
+    oky = vary > 1e-12 * np.maximum(cnt * syy, 1e-300)
+    slope = np.zeros(cnt.shape)
+    r2 = np.zeros(cnt.shape)
+    np.divide(cov, varx, out=slope, where=okx)
+    np.divide(cov ** 2, varx * vary, out=r2, where=okx & oky)
+    return slope, r2
+
+
+def sliding_regression(x, y, npoints):
+    """
+    Slope and R2 of the linear regression y = ax + b in a moving window of (npoints * 2 + 1) elements
+    centered in each element (windows are clipped at the ends of the arrays). Window sums are taken
+    from the cumulative sums of x, y, x^2, y^2 and xy, so the cost is linear for any window size.
+    Cumulative sums restart every block of cells, with values centred on the first value of the
+    block, so they do not lose precision in long series.
+
+    Parameters
+    ----------
+    x, y : numpy.ndarray
+        Ordered values (e.g. chi and elevation of a channel from head to mouth)
+    npoints : int
+        Number of points at each side of the window center
+
+    Returns
+    -------
+    tuple
+        (slope, r2) numpy arrays
+    """
+    return segmented_regression(x, y, np.array([0, np.size(x)]), npoints)
+
+
+def segmented_regression(x, y, offsets, npoints):
+    """
+    Same as sliding_regression for several series at once (e.g. the concatenated cells of several
+    channels). Windows are clipped at the ends of each series.
+
+    Parameters
+    ----------
+    x, y : numpy.ndarray
+        Concatenated values of all the series
+    offsets : numpy.ndarray
+        Start of each series in x and y, and the total size at the end (N + 1 values)
+    npoints : int
+        Number of points at each side of the window center
+
+    Returns
+    -------
+    tuple
+        (slope, r2) numpy arrays
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    sizes = np.diff(offsets)
+    seg = np.repeat(np.arange(sizes.size), sizes)
+    if x.size == 0:
+        return np.zeros(0), np.zeros(0)
+
+    idx = np.arange(x.size)
+    low = np.maximum(idx - npoints, offsets[:-1][seg])
+    last = np.minimum(idx + npoints + 1, offsets[1:][seg]) - 1
+
+    # Cumulative sums by blocks of cells. Windows are not longer than a block, so each window takes the
+    # end of the block of its first cell and the start of the next block (if it does not fit in one)
+    nblock = max(SUM_BLOCK_CELLS, 2 * npoints + 1)
+    first = idx // nblock * nblock
+    u = x - x[first]
+    v = y - y[first]
+    nblocks = -(-x.size // nblock)
+    values = [u, v, u * u, v * v, u * v]
+    csums = []
+    for val in values:
+        block_sum = np.zeros(nblocks * nblock)
+        block_sum[:x.size] = val
+        csums.append(np.cumsum(block_sum.reshape(nblocks, nblock), axis=1).ravel())
+
+    split = last >= first[low] + nblock
+    end = np.where(split, first[low] + nblock - 1, last)
+    head = [csum[end] - csum[low] + val[low] for csum, val in zip(csums, values)]
+    cnt = (end - low + 1).astype(np.float64)
+    tail = [np.where(split, csum[last], 0.) for csum in csums]
+    tail_cnt = np.where(split, last - first[last] + 1, 0).astype(np.float64)
+    tail = _shift_sums(tail_cnt, tail, x[first[last]] - x[first[low]], y[first[last]] - y[first[low]])
+    return _regression(cnt + tail_cnt, *[hs + ts for hs, ts in zip(head, tail)])
+
+
+def polyline_wkb(xy):
+    """
+    Encodes a polyline as WKB (little endian LineString) directly from a numpy array of coordinates.
+
+    Parameters
+    ----------
+    xy : numpy.ndarray
+        Array with two columns [x, y], or three columns [x, y, z] (LineString25D)
+
+    Returns
+    -------
+    bytes
+    """
+    xy = np.ascontiguousarray(xy, dtype="<f8")
+    wkb_type = 0x80000002 if xy.shape[1] == 3 else 2
+    return struct.pack("<BII", 1, wkb_type, xy.shape[0]) + xy.tobytes()
+
+
+def calculate_channel_gradients(channel, npoints, kind='slp'):
+    """
+    Calculates gradients (slope or ksn) of a landspy.Channel by linear regression in a window of
+    (npoints * 2 + 1) cells. Same results as Channel.calculateGradients(), computed with
+    sliding_regression() instead of a polynomial fit per cell.
+
+    Parameters
+    ----------
+    channel : landspy.Channel
+        Channel instance (modified in place)
+    npoints : int
+        Number of points at each side of the cell
+    kind : str {'slp', 'ksn'}
+        Calculates the gradients for slope (distance-elevation) or ksn (chi-elevation)
+    """
+    if npoints < 2:
+        return
+
+    x_arr = channel._chi if kind == 'ksn' else channel._dx
+    g, r2 = sliding_regression(x_arr, channel._zx, npoints)
+    g[np.abs(g) < 0.001] = 0.001
+
+    if kind == 'ksn':
+        channel._ksn = g
+        channel._r2ksn = r2
+        channel._ksn_np = npoints
+    else:
+        channel._slp = g
+        channel._r2slp = r2
+        channel._slp_np = npoints
+
+
+# Shared arrays of the channel gradient workers (see channel_gradients)
+_GRADIENT_DATA = {}
+# Maximum number of cells of a batch of channels (bounds the temporary arrays of each batch)
+GRADIENT_BATCH_CELLS = 65536
+
+
+def _attach_shared(name, shape):
+    # Numpy array over an existing shared memory block
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, np.float64, buffer=shm.buf)
+
+
+def _init_gradients(in_name, out_name, ncells, offsets, slp_np, ksn_np):
+    in_shm, values = _attach_shared(in_name, (3, ncells))
+    out_shm, grads = _attach_shared(out_name, (4, ncells))
+    _GRADIENT_DATA.update(shm=(in_shm, out_shm), values=values, grads=grads, offsets=offsets,
+                          slp_np=slp_np, ksn_np=ksn_np)
+
+
+def _gradient_batch(batch):
+    # Gradients of the channels [c0, c1), written in the shared output array. Returns the CPU time.
+    t0 = time.process_time()
+    data = _GRADIENT_DATA
+    c0, c1 = batch
+    offsets = data["offsets"][c0:c1 + 1]
+    start, stop = offsets[0], offsets[-1]
+    dx, zx, chi = data["values"][:, start:stop]
+    out = data["grads"][:, start:stop]
+    out[0], out[1] = segmented_regression(dx, zx, offsets - start, data["slp_np"])
+    out[2], out[3] = segmented_regression(chi, zx, offsets - start, data["ksn_np"])
+    return time.process_time() - t0
+
+
+def channel_gradients(dx, zx, chi, offsets, slp_np, ksn_np, workers=1):
+    """
+    Calculates slope (distance-elevation) and ksn (chi-elevation) by sliding linear regression for
+    the concatenated cells of several channels. Channels are split in batches of similar size (see
+    segmented_regression). If workers > 1, batches are calculated in a pool of processes, and input and
+    output arrays are placed in shared memory blocks, so they are not copied to or from the processes.
+
+    Parameters
+    ----------
+    dx, zx, chi : numpy.ndarray
+        Distances, elevations and chi of the concatenated channel cells
+    offsets : numpy.ndarray
+        Start of each channel in the cell arrays, and the total number of cells at the end
+    slp_np, ksn_np : int
+        Number of points at each side of the regression windows for slope and ksn
+    workers : int
+        Number of processes
+
+    Returns
+    -------
+    tuple (gradients, busy, wall)
+        gradients : Array with four rows (slope, slope R2, ksn, ksn R2)
+        busy : Total CPU time of all the batches (serial time estimation), in seconds
+        wall : Elapsed time of the batches (without the copies to and from the shared memory), in seconds
+    """
+    offsets = np.asarray(offsets, np.int64)
+    nchannels = offsets.size - 1
+    ncells = int(offsets[-1])
+
+    # Batches of channels with a similar number of cells (several batches per process)
+    nbatches = max(min(nchannels, workers * 4), -(-ncells // GRADIENT_BATCH_CELLS), 1)
+    cuts = np.searchsorted(offsets, np.linspace(0, ncells, nbatches + 1)[1:-1])
+    cuts = np.unique(np.concatenate(([0], np.clip(cuts, 0, nchannels), [nchannels])))
+    batches = list(zip(cuts[:-1].tolist(), cuts[1:].tolist()))
+
+    if workers <= 1 or len(batches) < 2:
+        _GRADIENT_DATA.update(values=np.array((dx, zx, chi), np.float64), grads=np.empty((4, ncells)),
+                              offsets=offsets, slp_np=slp_np, ksn_np=ksn_np)
+        t0 = time.perf_counter()
+        busy = sum(_gradient_batch(batch) for batch in batches)
+        wall = time.perf_counter() - t0
+        grads = _GRADIENT_DATA.pop("grads")
+        _GRADIENT_DATA.clear()
+        return grads, busy, wall
+
+    in_shm = shared_memory.SharedMemory(create=True, size=max(3 * ncells * 8, 1))
+    out_shm = shared_memory.SharedMemory(create=True, size=max(4 * ncells * 8, 1))
+    try:
+        values = np.ndarray((3, ncells), np.float64, buffer=in_shm.buf)
+        values[0], values[1], values[2] = dx, zx, chi
+        args = (in_shm.name, out_shm.name, ncells, offsets, slp_np, ksn_np)
+        with ProcessPoolExecutor(workers, initializer=_init_gradients, initargs=args) as pool:
+            t0 = time.perf_counter()
+            busy = sum(pool.map(_gradient_batch, batches))
+            wall = time.perf_counter() - t0
+        grads = np.array(np.ndarray((4, ncells), np.float64, buffer=out_shm.buf))
+        del values
+    finally:
+        in_shm.close()
+        in_shm.unlink()
+        out_shm.close()
+        out_shm.unlink()
+    return grads, busy, wall
+
+
+def _concat_channels(channels, keys):
+    # Concatenated cell indexes and attributes (dict) of a list of landspy.Channel objects, with the
+    # start of each channel and the total number of vertices at the end
+    offsets = np.concatenate(([0], np.cumsum([canal._ix.size for canal in channels]))).astype(np.int64)
+    ix = np.concatenate([canal._ix for canal in channels] + [np.empty(0, np.int64)])
+    values = {key: np.concatenate([getattr(canal, key) for canal in channels] + [np.empty(0)]) for key in keys}
+    return ix, values, offsets
+
+
+def vertex_gradients(values, offsets, npoints, workers=1):
+    """
+    Recalculates slope and ksn (and their R2) of the concatenated vertices of several channels (see
+    channel_gradients). Slopes and ksn below 0.001 are set to 0.001, as in calculate_channel_gradients.
+
+    Parameters
+    ----------
+    values : dict
+        Vertex attributes with the landspy.Channel names ("_dx", "_zx", "_chi", ...). The "_slp", "_r2slp",
+        "_ksn" and "_r2ksn" arrays are replaced.
+    offsets : numpy.ndarray
+        Start of each channel in the vertex arrays, and the total number of vertices at the end
+    npoints : int
+        Number of points at each side of the cell (nothing is calculated if less than 2, as in
+        calculate_channel_gradients)
+    workers : int
+        Number of processes
+
+    Returns
+    -------
+    tuple (wall, busy)
+        Elapsed time and total CPU time of the batches (serial time estimation), in seconds. The time
+        spent gathering the channel values in the main process is not counted, so busy / wall is the
+        speed-up of the batches.
+    """
+    if len(offsets) < 2 or npoints < 2:
+        return 0.0, 0.0
+    grads, busy, wall = channel_gradients(values["_dx"], values["_zx"], values["_chi"], offsets, npoints, npoints,
+                                    workers)
+    grads[0][np.abs(grads[0]) < 0.001] = 0.001
+    grads[2][np.abs(grads[2]) < 0.001] = 0.001
+    values["_slp"], values["_r2slp"], values["_ksn"], values["_r2ksn"] = grads
+    return wall, busy
+
+
+def batch_channel_gradients(channels, npoints, workers=1):
+    """
+    Recalculates slope and ksn (and their R2) of a list of landspy.Channel objects at once (see
+    vertex_gradients). Channels are modified in place, as in calculate_channel_gradients.
+
+    Parameters
+    ----------
+    channels : list
+        List of landspy.Channel objects
+    npoints : int
+        Number of points at each side of the cell (channels are not modified if less than 2)
+    workers : int
+        Number of processes
+
+    Returns
+    -------
+    tuple (wall, busy)
+        Elapsed time and total CPU time of the batches (see vertex_gradients), in seconds
+    """
+    if len(channels) == 0 or npoints < 2:
+        return 0.0, 0.0
+    _, values, offsets = _concat_channels(channels, ("_dx", "_zx", "_chi"))
+    wall, busy = vertex_gradients(values, offsets, npoints, workers)
+    for n, canal in enumerate(channels):
+        start, stop = offsets[n], offsets[n + 1]
+        for key in ("_slp", "_r2slp", "_ksn", "_r2ksn"):
+            setattr(canal, key, values[key][start:stop].copy())
+        canal._slp_np = npoints
+        canal._ksn_np = npoints
+    return wall, busy
+
+
+def resample_vertices(ix, values, offsets, step):
+    """
+    Resamples the concatenated vertices of several channels to a regular distance step along the
+    channels. Vertices are placed every step map units from the head (plus the mouth) and distances,
+    elevations, areas, chi and gradients are linearly interpolated at once for all the channels. Each
+    vertex keeps the index of its closest original cell, so vertices can still be linked to the map.
+
+    Parameters
+    ----------
+    ix : numpy.ndarray
+        Cell indexes of the vertices
+    values : dict
+        Vertex attributes with the landspy.Channel names ("_ax", "_dx", "_zx", "_chi", "_slp", "_ksn",
+        "_r2slp", "_r2ksn" and "_dd")
+    offsets : numpy.ndarray
+        Start of each channel in the vertex arrays, and the total number of vertices at the end
+    step : float
+        Distance between vertices (map units)
+
+    Returns
+    -------
+    tuple (ix, values, offsets)
+        Cell indexes, attributes (with the original elevations "_zx0" equal to the new elevations) and
+        offsets of the new vertices
+    """
+    offsets = np.asarray(offsets, np.int64)
+    sizes = np.diff(offsets)
+    if sizes.size == 0 or step <= 0:
+        return ix, values, offsets
+
+    # Distance from the head of each cell, with the channels laid out one after another in a single axis
+    dx = values["_dx"]
+    first = dx[offsets[:-1]]
+    lengths = first - dx[offsets[1:] - 1]
+    starts = np.concatenate(([0], np.cumsum(lengths + step)[:-1]))
+    chan = np.repeat(np.arange(sizes.size), sizes)
+    axis = starts[chan] + first[chan] - dx
+
+    # New vertices, every step from the head of each channel plus the mouth
+    counts = np.ceil(lengths / step).astype(np.int64) + 1
+    new_offsets = np.concatenate(([0], np.cumsum(counts)))
+    new_chan = np.repeat(np.arange(sizes.size), counts)
+    dist = np.minimum((np.arange(new_offsets[-1]) - new_offsets[new_chan]) * step, lengths[new_chan])
+    new_axis = starts[new_chan] + dist
+
+    # Closest original cell of each vertex (channels are step apart, so it is always a cell of the same channel)
+    pos = np.clip(np.searchsorted(axis, new_axis), 1, axis.size - 1)
+    pos -= (new_axis - axis[pos - 1]) < (axis[pos] - new_axis)
+
+    new = {key: np.interp(new_axis, axis, values[key])
+           for key in ("_ax", "_zx", "_chi", "_slp", "_ksn", "_r2slp", "_r2ksn")}
+    new["_dx"] = first[new_chan] - dist
+    new["_zx0"] = new["_zx"].copy()
+    # Giver - receiver distances (the last vertex keeps the distance of the original mouth cell)
+    new["_dd"] = np.append(new["_dx"][:-1] - new["_dx"][1:], 0.0)
+    new["_dd"][new_offsets[1:] - 1] = values["_dd"][offsets[1:] - 1]
+    return ix[pos], new, new_offsets
+
+
+def resample_channels(channels, step):
+    """
+    Resamples a list of landspy.Channel objects to a regular distance step along the channels (see
+    resample_vertices). Channels are modified in place.
+
+    Parameters
+    ----------
+    channels : list
+        List of landspy.Channel objects
+    step : float
+        Distance between vertices (map units)
+
+    Returns
+    -------
+    tuple (before, after)
+        Total number of vertices before and after the resampling
+    """
+    keys = ("_ax", "_dx", "_zx", "_chi", "_slp", "_ksn", "_r2slp", "_r2ksn", "_dd")
+    ix, values, offsets = _concat_channels(channels, keys)
+    if len(channels) == 0 or step <= 0:
+        return int(offsets[-1]), int(offsets[-1])
+    ix, values, new_offsets = resample_vertices(ix, values, offsets, step)
+    for n, canal in enumerate(channels):
+        start, stop = new_offsets[n], new_offsets[n + 1]
+        canal._ix = ix[start:stop]
+        for key, arr in values.items():
+            setattr(canal, key, arr[start:stop])
+    return int(offsets[-1]), int(new_offsets[-1])
+
+
+class NetworkGeometry:
+    """
+    Channel cells of a landspy.Flow (cells with flow accumulation >= threshold) or a landspy.Network
+    together with the geometric arrays needed to integrate values along the network. Arrays are
+    computed once and follow the topological order of the Flow (givers before receivers).
+
+    Parameters
+    ----------
+    flow : landspy.Flow | landspy.Network
+        Flow instance with the topologically sorted cells, or Network instance (the channel cells,
+        areas and distances stored in the Network are used, threshold and fac are ignored)
+    threshold : int
+        Flow accumulation threshold (in cells) to initiate a channel. If 0, the 0.25% of the total
+        number of cells is used (as in landspy.Network)
+    fac : numpy.ndarray, optional
+        Flow accumulation array (in cells) with the Flow dimensions. If None, it's calculated.
+
+    Attributes
+    ----------
+    ix, ixc : Giver and receiver cells (linear indexes)
+    rpos : Position of the receiver of each cell (-1 for outlets)
+    ax : Upstream drainage area (in cells, as landspy.Network)
+    zx : Elevation
+    dd : Giver - receiver distance
+    dx : Distance to the outlet
+    """
+    def __init__(self, flow, threshold=0, fac=None):
+        self._dims = flow.getDims()
+        self._geot = flow.getGeot()
+        cellsize = flow.getCellSize()
+        if hasattr(flow, "_dd"):
+            # landspy.Network, channel cells and distances are already computed
+            self.threshold = int(flow._threshold)
+            self.ix = flow._ix.astype(np.int64)
+            self.ixc = flow._ixc.astype(np.int64)
+            self.zx = np.asarray(flow._zx, dtype=np.float64)
+            self.ax = np.asarray(flow._ax, dtype=np.float64)
+            self.rpos = receiver_positions(self.ix, self.ixc)
+            self.dd = np.asarray(flow._dd, dtype=np.float64)
+            self.dx = np.asarray(flow._dx, dtype=np.float64)
+            self._basins = None
+            return
+
+        if threshold == 0:
+            threshold = int(self._dims[0] * self._dims[1] * 0.0025)
+        self.threshold = int(threshold)
+
+        if fac is None:
+            fac = flow.flowAccumulation(nodata=False, asgrid=False)
+        fac = fac.ravel()
+
+        # Channel cells
+        w = fac[flow._ix] >= self.threshold
+        self.ix = flow._ix[w].astype(np.int64)
+        self.ixc = flow._ixc[w].astype(np.int64)
+        self.zx = np.asarray(flow._zx, dtype=np.float64)[w]
+        self.ax = fac[self.ix].astype(np.float64)
+        self.rpos = receiver_positions(self.ix, self.ixc)
+
+        # Giver - receiver distances and distances to outlet
+        grow, gcol = np.unravel_index(self.ix, self._dims)
+        rrow, rcol = np.unravel_index(self.ixc, self._dims)
+        self.dd = np.hypot((gcol - rcol) * cellsize[0], (grow - rrow) * cellsize[1])
+        self.dx = accumulate_downstream(self.dd, self.rpos)
+        self._basins = None
+
+    def getDims(self):
+        """
+        Returns the dimensions (nrow, ncol) of the grid of the network
+        """
+        return self._dims
+
+    def getXY(self, positions=None):
+        """
+        Returns the coordinates (numpy.ndarray with two columns, x and y) of channel cells
+
+        Parameters
+        ----------
+        positions : numpy.ndarray, optional
+            Positions of the channel cells (all the cells if None)
+        """
+        ix = self.ix if positions is None else self.ix[positions]
+        row, col = np.unravel_index(ix, self._dims)
+        x = self._geot[0] + self._geot[1] * col + self._geot[1] / 2
+        y = self._geot[3] + self._geot[5] * row + self._geot[5] / 2
+        return np.array((x, y)).T
+
+    def getBasins(self):
+        """
+        Returns a basin label (0 to nbasins - 1) for each channel cell. Cells draining to the same
+        outlet share the label.
+        """
+        if self._basins is None:
+            ptr = np.where(self.rpos >= 0, self.rpos, np.arange(self.rpos.size))
+            self._basins = np.unique(find_roots(ptr), return_inverse=True)[1].ravel()
+        return self._basins
+
+    def calculateChi(self, thetaref=0.45, a0=1.0):
+        """
+        Calculates chi for all the channel cells as the integral of a0 / A^thetaref * dx from the
+        outlet to each cell, with the area A in cells (same values as landspy.Network.calculateChi).
+
+        Parameters
+        ----------
+        thetaref : float
+            m/n coefficient (concavity)
+        a0 : float
+            Reference area (as in landspy, usually 1)
+
+        Returns
+        -------
+        numpy.ndarray
+            Chi values for each channel cell (following the order of ix)
+        """
+        return accumulate_downstream(a0 * self.dd / self.ax ** thetaref, self.rpos)
+
+    def calculateGradients(self, x, npoints):
+        """
+        Calculates the gradient of elevations respect to x (distances for slope, chi for ksn) for all
+        the channel cells by linear regression. The regression window of each cell follows the flow
+        path npoints cells downstream and npoints cells upstream along the main tributary (the giver
+        with the largest area). Window sums come from sums accumulated along the flow paths, so every
+        window is solved in O(1) regardless of npoints. Path sums restart every block of cells along the
+        flow paths (at the cells whose distance in cells to the outlet is a multiple of the block size),
+        with values centred on the value of that cell, so they do not lose precision in long paths.
+
+        Parameters
+        ----------
+        x : numpy.ndarray
+            Values of the channel cells (dx for slope, chi for ksn)
+        npoints : int
+            Number of cells upstream and downstream of each cell
+
+        Returns
+        -------
+        tuple
+            (gradient, r2) numpy arrays
+        """
+        ncells = self.ix.size
+        cells = np.arange(ncells)
+
+        # Downstream and main-upstream pointers (saturated at outlets and heads)
+        down = np.where(self.rpos >= 0, self.rpos, cells)
+        up = cells.copy()
+        givers = np.flatnonzero(self.rpos >= 0)
+        order = np.lexsort((self.ax[givers], self.rpos[givers]))
+        givers = givers[order]
+        last = np.append(self.rpos[givers][1:] != self.rpos[givers][:-1], True)
+        up[self.rpos[givers[last]]] = givers[last]
+
+        # Window ends: path from head_end to mouth_end (both included)
+        head_end = jump_pointers(up, npoints)
+        mouth_end = jump_pointers(down, npoints)
+
+        # Blocks of the flow paths, each one ends at its root cell
+        nblock = max(SUM_BLOCK_CELLS, 2 * npoints + 1)
+        depth = accumulate_downstream(np.ones(ncells), self.rpos).astype(np.int64) - 1
+        is_root = depth % nblock == 0
+        root = find_roots(np.where(is_root, cells, self.rpos))
+        x = np.asarray(x, dtype=np.float64)
+        u = x - x[root]
+        v = self.zx - self.zx[root]
+        values = [u, v, u * u, v * v, u * v]
+        rpos_block = np.where(is_root, -1, self.rpos)
+        path_cnt = accumulate_downstream(np.ones(ncells), rpos_block)
+        path_sums = [accumulate_downstream(val, rpos_block) for val in values]
+
+        # Windows that pass the root of the block of their head end are split below the root
+        head_root = root[head_end]
+        split = depth[mouth_end] < depth[head_root]
+        below = np.where(split, self.rpos[head_root], mouth_end)
+        cnt = path_cnt[head_end] - np.where(split, 0, path_cnt[mouth_end] - 1)
+        head = [psum[head_end] - np.where(split, 0, psum[mouth_end] - val[mouth_end])
+                for psum, val in zip(path_sums, values)]
+        tail_cnt = np.where(split, path_cnt[below] - path_cnt[mouth_end] + 1, 0)
+        tail = [np.where(split, psum[below] - psum[mouth_end] + val[mouth_end], 0)
+                for psum, val in zip(path_sums, values)]
+        tail = _shift_sums(tail_cnt, tail, x[root[mouth_end]] - x[head_root],
+                           self.zx[root[mouth_end]] - self.zx[head_root])
+        return _regression(cnt + tail_cnt, *[hs + ts for hs, ts in zip(head, tail)])
+
+    def getProfiles(self):
+        """
+        Gets the profiles of the network as in landspy.Network.chiShapefile: heads are taken from the
+        highest to the lowest and each profile goes down from its head until a cell of a previous
+        profile (or an outlet). Each cell belongs to the profile of the highest head upstream of it, so
+        profiles are solved at link level (see strahler_order) instead of walking the cells.
+
+        Returns
+        -------
+        tuple (profile, heads)
+            profile : Profile of each channel cell (0 to nprofiles - 1, in the order of the heads)
+            heads : Position of the head of each profile
+        """
+        has_rcv = self.rpos >= 0
+        ngivers = np.bincount(self.rpos[has_rcv], minlength=self.rpos.size)
+        heads = np.flatnonzero(ngivers == 0)
+        heads = heads[np.argsort(-self.zx[heads], kind="stable")]
+        if heads.size == 0:
+            return np.zeros(0, np.int64), heads
+        rank = np.full(self.rpos.size, heads.size, np.int64)
+        rank[heads] = np.arange(heads.size)
+
+        # Links are in topological order, so every link is solved before its downstream link
+        tops, link, down = stream_links(self.rpos)
+        best = rank[tops]
+        for n, d in enumerate(down.tolist()):
+            if d >= 0 and best[n] < best[d]:
+                best[d] = best[n]
+        return best[link], heads
+
+    def getSegments(self, chi, distance):
+        """
+        Splits the network profiles (see getProfiles) into segments and aggregates the values of their
+        cells, as landspy.Network.chiShapefile. Each segment goes down from its first cell until the
+        cell where its length reaches [distance] (segments have at least 3 cells), and that cell is
+        also the first cell of the next segment. The last segment of a profile ends at the cell of the
+        previous profile where it flows (or at the outlet) and it's dropped if it has less than 3 cells.
+        Segments of all the profiles are cut at once (one iteration per segment of the longest profile)
+        and values are aggregated with numpy.add.reduceat over the segment vertices.
+
+        Parameters
+        ----------
+        chi : numpy.ndarray
+            Chi values of the channel cells
+        distance : float
+            Segment length (map units)
+
+        Returns
+        -------
+        tuple (vertices, offsets, fields)
+            vertices : Positions of the channel cells of the segments, from head to mouth
+            offsets : Vertices of the segment n are vertices[offsets[n]:offsets[n + 1]]
+            fields : dict with arrays for each segment: profile (profile id, from 1), L (distance from
+              the profile head to the middle cell), area (cells, at the segment mouth), z and chi
+              (middle cell), ksn and rksn (chi-elevation regression), slope and rslope
+              (distance-elevation regression)
+        """
+        profile, heads = self.getProfiles()
+        nprof = heads.size
+
+        # Cells of each profile from head to mouth, followed by the cell where the profile flows
+        order = np.lexsort((-self.dx, profile))
+        counts = np.bincount(profile, minlength=nprof)
+        ends = np.cumsum(counts)
+        mouth = order[ends - 1]
+        closed = self.rpos[mouth] >= 0
+        cells = np.insert(order, ends[closed], self.rpos[mouth][closed])
+        sizes = counts + closed
+        prof = np.repeat(np.arange(nprof), sizes)
+        first = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        last = first + sizes - 1
+
+        # End of a segment starting at each cell: first cell at [distance] from it (along a single axis
+        # with all the profiles, separated by more than distance), with at least 3 cells per segment
+        length = self.dx[heads][prof] - self.dx[cells]
+        starts = np.concatenate(([0], np.cumsum(length[last] + distance + 1)[:-1]))
+        axis = starts[prof] + length
+        nxt = np.searchsorted(axis, axis + distance)
+        nxt = np.minimum(np.maximum(nxt, np.arange(cells.size) + 2), last[prof])
+
+        # Segments follow each other from the heads, all the profiles are advanced at once
+        seg_start = []
+        seg_end = []
+        cur = first[sizes >= 3]
+        while cur.size:
+            end = nxt[cur]
+            valid = end - cur >= 2
+            seg_start.append(cur[valid])
+            seg_end.append(end[valid])
+            cur = end[valid & (end < last[prof[cur]])]
+        seg_start = np.concatenate(seg_start) if seg_start else np.zeros(0, np.int64)
+        seg_end = np.concatenate(seg_end) if seg_end else np.zeros(0, np.int64)
+        srt = np.argsort(seg_start)
+        seg_start = seg_start[srt]
+        seg_end = seg_end[srt]
+
+        nvert = seg_end - seg_start + 1
+        offsets = np.concatenate(([0], np.cumsum(nvert)))
+        seg = np.repeat(np.arange(seg_start.size), nvert)
+        vertices = cells[seg_start[seg] + np.arange(offsets[-1]) - offsets[seg]]
+        mid = cells[seg_start + nvert // 2]
+        if seg_start.size == 0:
+            empty = np.zeros(0)
+            names = ("profile", "L", "area", "z", "chi", "ksn", "rksn", "slope", "rslope")
+            return vertices, offsets, {name: empty for name in names}
+
+        # Segment regressions, with the values of each segment centred on its first cell
+        ref = offsets[:-1]
+        zv = self.zx[vertices]
+        yz = zv - zv[ref][seg]
+        xchi = chi[vertices] - chi[vertices][ref][seg]
+        xd = self.dx[vertices] - self.dx[vertices][ref][seg]
+
+        def sums(x, y):
+            return [np.add.reduceat(v, ref) for v in (x, y, x * x, y * y, x * y)]
+
+        cnt = nvert.astype(np.float64)
+        ksn, rksn = _regression(cnt, *sums(xchi, yz))
+        slope, rslope = _regression(cnt, *sums(xd, yz))
+        # As in landspy, gradients are never 0 and R2 is 1 for segments with constant elevation
+        flat = np.maximum.reduceat(zv, ref) == np.minimum.reduceat(zv, ref)
+        rksn[flat] = 1
+        rslope[flat] = 1
+        ksn[ksn == 0] = 0.000001
+        slope[slope == 0] = 0.000001
+        seg_prof = prof[seg_start]
+        fields = {"profile": seg_prof + 1,
+                  "L": self.dx[heads][seg_prof] - self.dx[mid],
+                  "area": self.ax[cells[seg_end]],
+                  "z": self.zx[mid],
+                  "chi": chi[mid],
+                  "ksn": ksn, "rksn": rksn, "slope": slope, "rslope": rslope}
+        return vertices, offsets, fields
+
+    def toArray(self, values, nodata=-9999.):
+        """
+        Places values of the channel cells into a grid-shaped array (nodata out of the network).
+        """
+        arr = np.full(self._dims[0] * self._dims[1], nodata, dtype=np.float32)
+        arr[self.ix] = values
+        return arr.reshape(self._dims)
+
+
+def chi_scores(chi, zx, basins):
+    """
+    Scores to evaluate the fit of a concavity (thetaref) value. Both scores are calculated for each
+    basin and averaged (weighted by the number of cells of each basin).
+
+    * Collinearity: R2 of the chi-elevation linear regression of the basin channel cells.
+    * Disorder: with the cells sorted by elevation, sum(|chi[i+1] - chi[i]|) / (chi_max - chi_min) - 1.
+      It's 0 when chi increases monotonically with elevation (Hergarten et al., 2016).
+
+    Parameters
+    ----------
+    chi : numpy.ndarray
+        Chi values of the channel cells
+    zx : numpy.ndarray
+        Elevation of the channel cells
+    basins : numpy.ndarray
+        Basin labels of the channel cells (0 to nbasins - 1)
+
+    Returns
+    -------
+    tuple
+        (r2, disorder)
+    """
+    if basins.size == 0:
+        return 0.0, 0.0
+    nb = int(basins.max()) + 1
+    n = np.bincount(basins, minlength=nb).astype(np.float64)
+    # R2 from the regression sums of each basin
+    sx = np.bincount(basins, chi, nb)
+    sy = np.bincount(basins, zx, nb)
+    sxx = np.bincount(basins, chi * chi, nb)
+    syy = np.bincount(basins, zx * zx, nb)
+    sxy = np.bincount(basins, chi * zx, nb)
+    varx = n * sxx - sx ** 2
+    vary = n * syy - sy ** 2
+    valid = (n >= 3) & (varx > 0) & (vary > 0)
+    r2 = np.zeros(nb)
+    r2[valid] = (n * sxy - sx * sy)[valid] ** 2 / (varx[valid] * vary[valid])
+
+    # Disorder: sort by basin and elevation, and sum the chi jumps inside each basin
+    order = np.lexsort((zx, basins))
+    sb = basins[order]
+    schi = chi[order]
+    same = sb[1:] == sb[:-1]
+    jumps = np.bincount(sb[1:][same], np.abs(np.diff(schi))[same], nb)
+    chi_max = np.full(nb, -np.inf)
+    chi_min = np.full(nb, np.inf)
+    np.maximum.at(chi_max, basins, chi)
+    np.minimum.at(chi_min, basins, chi)
+    rng = np.where(n > 0, chi_max - chi_min, 0)
+    valid &= rng > 0
+    disorder = np.zeros(nb)
+    disorder[valid] = jumps[valid] / rng[valid] - 1
+
+    weights = n[valid]
+    if weights.sum() == 0:
+        return 0.0, 0.0
+    return float(np.average(r2[valid], weights=weights)), float(np.average(disorder[valid], weights=weights))
+
+
+# Network arrays of the theta sweep (set once per worker process by _init_sweep)
+_SWEEP_DATA = {}
+
+
+def _init_sweep(dd, ax, rpos, zx, basins, a0):
+    _SWEEP_DATA.update(dd=dd, ax=ax, rpos=rpos, zx=zx, basins=basins, a0=a0)
+
+
+def _sweep_scores(thetaref):
+    data = _SWEEP_DATA
+    chi = accumulate_downstream(data["a0"] * data["dd"] / data["ax"] ** thetaref, data["rpos"])
+    return (thetaref,) + chi_scores(chi, data["zx"], data["basins"])
+
+
+def theta_sweep(net, thetas, a0=1.0, workers=1):
+    """
+    Calculates chi scores (see chi_scores) for several thetaref values. Only the chi integral is
+    recalculated for each thetaref, the network geometry (net) is reused. If workers > 1, thetaref
+    values are distributed in a pool of processes (network arrays are sent once to each process).
+
+    Parameters
+    ----------
+    net : NetworkGeometry
+        Channel network
+    thetas : iterable
+        Thetaref values
+    a0 : float
+        Reference area (see NetworkGeometry.calculateChi)
+    workers : int
+        Number of processes
+
+    Returns
+    -------
+    numpy.ndarray
+        Array with three columns [thetaref, r2, disorder]
+    """
+    args = (net.dd, net.ax, net.rpos, net.zx, net.getBasins(), a0)
+    thetas = [float(theta) for theta in thetas]
+    if workers > 1:
+        with ProcessPoolExecutor(workers, initializer=_init_sweep, initargs=args) as pool:
+            scores = list(pool.map(_sweep_scores, thetas))
+    else:
+        _init_sweep(*args)
+        scores = [_sweep_scores(theta) for theta in thetas]
+    return np.array(scores).reshape((-1, 3))
@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized helpers to work with label rasters (e.g. drainage basins) and the rasters that go with them.
+
+Zonal values are calculated for all the labels at once with numpy.bincount (sums and counts) and
+numpy.minimum.at / numpy.maximum.at (extremes) over the flattened label array, instead of masking the
+rasters once per label.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from osgeo import gdal, ogr
+
+
+def zonal_sums(labels, dem=None, cellsize=(1.0, -1.0), nodata=None):
+    """
+    Calculates the additive values of each label of a label array (counts, sums and extremes), so
+    the values of several labels can be merged (e.g. nested basins). Labels are compacted to
+    consecutive indexes first, so the size of the arrays does not depend on the label values.
+
+    Parameters
+    ----------
+    labels : numpy.ndarray
+        2-D array with non negative integer labels (0 = no label)
+    dem : numpy.ndarray, optional
+        2-D array with elevations (same shape as labels)
+    cellsize : tuple
+        Cell size (cx, cy) of the rasters
+    nodata : float, optional
+        NoData value of the dem
+
+    Returns
+    -------
+    dict
+        Dictionary with the labels (ids, sorted) and arrays with the values of each label (same
+        order as ids) with the keys: cells, zcells, zsum, zmin, zmax, scells, ssum (the last ones
+        only if dem is given)
+    """
+    cx, cy = abs(cellsize[0]), abs(cellsize[1])
+    ids, lab = np.unique(labels, return_inverse=True)
+    lab = lab.ravel()
+    nlab = ids.size
+    sums = {"ids": ids, "cells": np.bincount(lab, minlength=nlab).astype(np.float64)}
+
+    if dem is None:
+        return sums
+
+    labelled = labels.ravel() > 0
+    z = np.array(dem, dtype=np.float64)
+    if nodata is not None:
+        z[z == nodata] = np.nan
+    zx = z.ravel()
+    valid = labelled & np.isfinite(zx)
+    sums["zcells"] = np.bincount(lab[valid], minlength=nlab).astype(np.float64)
+    sums["zsum"] = np.bincount(lab[valid], zx[valid], nlab)
+    sums["zmin"] = np.full(nlab, np.inf)
+    sums["zmax"] = np.full(nlab, -np.inf)
+    np.minimum.at(sums["zmin"], lab[valid], zx[valid])
+    np.maximum.at(sums["zmax"], lab[valid], zx[valid])
+
+    # Slope (m/m) by central differences, cells next to NoData are excluded
+    gy, gx = np.gradient(z, cy, cx)
+    slope = np.hypot(gx, gy).ravel()
+    valid = labelled & np.isfinite(slope)
+    sums["scells"] = np.bincount(lab[valid], minlength=nlab).astype(np.float64)
+    sums["ssum"] = np.bincount(lab[valid], slope[valid], nlab)
+    return sums
+
+
+def zonal_statistics(sums, cellsize=(1.0, -1.0)):
+    """
+    Calculates the statistics of each label from its zonal sums (see zonal_sums)
+
+    Parameters
+    ----------
+    sums : dict
+        Zonal sums
+    cellsize : tuple
+        Cell size (cx, cy) of the rasters
+
+    Returns
+    -------
+    dict
+        Dictionary with the labels (ids) and arrays with the statistics of each label (same order as
+        ids) with the keys: area, z_mean, relief, slope (the last ones only if the sums have elevations)
+    """
+    stats = {"ids": sums["ids"], "area": sums["cells"] * abs(cellsize[0] * cellsize[1])}
+    if "zsum" not in sums:
+        return stats
+    with np.errstate(invalid="ignore", divide="ignore"):
+        stats["z_mean"] = np.where(sums["zcells"] > 0, sums["zsum"] / sums["zcells"], np.nan)
+        stats["relief"] = np.where(sums["zcells"] > 0, sums["zmax"] - sums["zmin"], np.nan)
+        stats["slope"] = np.where(sums["scells"] > 0, sums["ssum"] / sums["scells"], np.nan)
+    return stats
+
+
+def merge_sums(sums, target, source):
+    """
+    Adds the zonal sums of the label source to the label target (e.g. a nested basin into the basin
+    that contains it)
+    """
+    target, source = np.searchsorted(sums["ids"], [target, source])
+    for key, arr in sums.items():
+        if key == "ids":
+            continue
+        elif key == "zmin":
+            arr[target] = min(arr[target], arr[source])
+        elif key == "zmax":
+            arr[target] = max(arr[target], arr[source])
+        else:
+            arr[target] += arr[source]
+
+
+def rasterize_polygons(geometries, geot, dims, srs="", values=None):
+    """
+    Rasterizes a set of polygons into a label array in a single GDAL RasterizeLayer call. Polygons are
+    copied (as WKB) to an in-memory OGR layer and each one is burned with its value (or position + 1).
+    Overlapping polygons are burned in order, so the last polygon wins in the overlapping cells.
+
+    Parameters
+    ----------
+    geometries : list
+        List of polygon geometries as WKB (bytes)
+    geot : tuple
+        Geotransform of the output label array
+    dims : tuple
+        Dimensions (rows, cols) of the output label array
+    srs : str
+        Spatial reference (WKT) of the polygons and the label array
+    values : list, optional
+        Positive integer label of each polygon (by default, the polygon position in the list + 1)
+
+    Returns
+    -------
+    numpy.ndarray
+        Label array (Int32) with the polygon labels (0 = no polygon)
+    """
+    vector = ogr.GetDriverByName("Memory").CreateDataSource("")
+    layer = vector.CreateLayer("polygons", None, ogr.wkbUnknown)
+    layer.CreateField(ogr.FieldDefn("label", ogr.OFTInteger))
+    defn = layer.GetLayerDefn()
+    if values is None:
+        values = range(1, len(geometries) + 1)
+    for wkb, value in zip(geometries, values):
+        feat = ogr.Feature(defn)
+        feat.SetField(0, int(value))
+        feat.SetGeometry(ogr.CreateGeometryFromWkb(bytes(wkb)))
+        layer.CreateFeature(feat)
+
+    raster = gdal.GetDriverByName("MEM").Create("", dims[1], dims[0], 1, gdal.GDT_Int32)
+    raster.SetGeoTransform(geot)
+    if srs:
+        raster.SetProjection(srs)
+    band = raster.GetRasterBand(1)
+    band.Fill(0)
+    gdal.RasterizeLayer(raster, [1], layer, options=["ATTRIBUTE=label"])
+    return band.ReadAsArray()
+
+
+def label_window(path, labels=None, strip_rows=512):
+    """
+    Gets the window (bounding box in cells) of the labelled cells of a label raster. The raster is
+    scanned by strips of rows (GDAL windowed reads), so only one strip is in memory at a time.
+
+    Parameters
+    ----------
+    path : str
+        Path to the label raster
+    labels : list, optional
+        Labels to look for (by default, all the cells that are not NoData)
+    strip_rows : int
+        Number of rows of each strip
+
+    Returns
+    -------
+    tuple (r0, r1, c0, c1)
+        First and last (not included) row and column of the window, None if there are no labelled cells
+    """
+    dataset = gdal.Open(path)
+    band = dataset.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+    nrows, ncols = dataset.RasterYSize, dataset.RasterXSize
+    strip_rows = max(int(strip_rows), band.GetBlockSize()[1])
+    r0, r1, c0, c1 = nrows, -1, ncols, -1
+    for row in range(0, nrows, strip_rows):
+        arr = band.ReadAsArray(0, row, ncols, min(strip_rows, nrows - row))
+        if labels is not None:
+            mask = np.isin(arr, labels)
+        elif nodata is not None:
+            mask = arr != nodata
+        else:
+            mask = np.ones(arr.shape, bool)
+        rows = np.flatnonzero(mask.any(axis=1))
+        if rows.size == 0:
+            continue
+        cols = np.flatnonzero(mask.any(axis=0))
+        r0, r1 = min(r0, row + rows[0]), row + rows[-1]
+        c0, c1 = min(c0, cols[0]), max(c1, cols[-1])
+    if r1 < 0:
+        return None
+    return int(r0), int(r1) + 1, int(c0), int(c1) + 1
+
+
+def extent_window(path, extent):
+    """
+    Gets the window (in cells) of a raster that covers a map extent
+
+    Parameters
+    ----------
+    path : str
+        Path to the raster
+    extent : tuple
+        Map extent (xmin, ymin, xmax, ymax)
+
+    Returns
+    -------
+    tuple (r0, r1, c0, c1)
+        First and last (not included) row and column of the window (clipped to the raster), None if the
+        extent is outside the raster
+    """
+    dataset = gdal.Open(path)
+    geot = dataset.GetGeoTransform()
+    dims = (dataset.RasterYSize, dataset.RasterXSize)
+    xmin, ymin, xmax, ymax = extent
+    c0 = int(np.floor((xmin - geot[0]) / geot[1]))
+    c1 = int(np.ceil((xmax - geot[0]) / geot[1]))
+    r0 = int(np.floor((ymax - geot[3]) / geot[5]))
+    r1 = int(np.ceil((ymin - geot[3]) / geot[5]))
+    r0, r1 = max(r0, 0), min(max(r1, r0 + 1), dims[0])
+    c0, c1 = max(c0, 0), min(max(c1, c0 + 1), dims[1])
+    if r0 >= r1 or c0 >= c1:
+        return None
+    return r0, r1, c0, c1
+
+
+def read_window(path, window=None, margin=0):
+    """
+    Reads a window of a raster (GDAL windowed read)
+
+    Parameters
+    ----------
+    path : str
+        Path to the raster
+    window : tuple, optional
+        Window (r0, r1, c0, c1) to read, in cells (by default, the whole raster)
+    margin : int
+        Number of cells added around the window (clipped to the raster)
+
+    Returns
+    -------
+    tuple (array, geot, nodata, proj)
+        Array of the window, its geotransform, the NoData value and the projection (WKT) of the raster
+    """
+    dataset = gdal.Open(path)
+    band = dataset.GetRasterBand(1)
+    nrows, ncols = dataset.RasterYSize, dataset.RasterXSize
+    if window is None:
+        window = (0, nrows, 0, ncols)
+    r0, r1 = max(window[0] - margin, 0), min(window[1] + margin, nrows)
+    c0, c1 = max(window[2] - margin, 0), min(window[3] + margin, ncols)
+    geot = dataset.GetGeoTransform()
+    arr = band.ReadAsArray(c0, r0, c1 - c0, r1 - r0)
+    geot = (geot[0] + c0 * geot[1], geot[1], 0.0, geot[3] + r0 * geot[5], 0.0, geot[5])
+    return arr, geot, band.GetNoDataValue(), dataset.GetProjection()
+
+
+def label_bounds(labels):
+    """
+    Gets the bounding box (in cells) of each label of a label array
+
+    Parameters
+    ----------
+    labels : numpy.ndarray
+        2-D array with non negative integer labels (0 = no label)
+
+    Returns
+    -------
+    tuple (ids, rmin, rmax, cmin, cmax)
+        Labels of the array (sorted, without 0) and arrays (same order as ids) with the first and last
+        row and column of each label
+    """
+    row, col = np.nonzero(labels)
+    ids, lab = np.unique(labels[row, col], return_inverse=True)
+    lab = lab.ravel()
+    nlab = ids.size
+    rmin = np.full(nlab, labels.shape[0])
+    rmax = np.full(nlab, -1)
+    cmin = np.full(nlab, labels.shape[1])
+    cmax = np.full(nlab, -1)
+    np.minimum.at(rmin, lab, row)
+    np.maximum.at(rmax, lab, row)
+    np.minimum.at(cmin, lab, col)
+    np.maximum.at(cmax, lab, col)
+    return ids, rmin, rmax, cmin, cmax
+
+
+def default_nodata(dtype):
+    """
+    Returns a NoData value for rasters without one that fits in the data type: -9999 for float types
+    (and signed integers where it fits), the minimum value of smaller signed integers and the maximum
+    value of unsigned integers
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind == "f":
+        return -9999.0
+    info = np.iinfo(dtype)
+    if dtype.kind == "u":
+        return int(info.max)
+    return max(-9999, int(info.min))
+
+
+def clip_by_labels(src_path, labels, zones, max_threads=4):
+    """
+    Clips a raster by zones of a label array (same dimensions as the raster). Each zone is written as a
+    GeoTiff with a windowed read of the zone bounding box, and the cells outside the zone are set to
+    NoData (see default_nodata for rasters without NoData). Zones are written in parallel by a pool of threads, each thread with its own dataset.
+
+    Parameters
+    ----------
+    src_path : str
+        Path to the raster to clip
+    labels : numpy.ndarray
+        2-D array with non negative integer labels (0 = no label)
+    zones : list
+        List of tuples (output path, list of labels of the zone)
+    max_threads : int
+        Maximum number of threads
+
+    Returns
+    -------
+    list
+        Output paths of the written rasters (zones without cells are not written)
+    """
+    labels_ids, rmin, rmax, cmin, cmax = label_bounds(labels)
+    local = threading.local()
+
+    def clip(zone):
+        path, ids = zone
+        ids = np.intersect1d(np.asarray(ids, dtype=np.int64), labels_ids)
+        if ids.size == 0:
+            return None
+        rows = np.searchsorted(labels_ids, ids)
+        r0, r1 = int(rmin[rows].min()), int(rmax[rows].max()) + 1
+        c0, c1 = int(cmin[rows].min()), int(cmax[rows].max()) + 1
+
+        if not hasattr(local, "dataset"):
+            local.dataset = gdal.Open(src_path)
+        band = local.dataset.GetRasterBand(1)
+        nodata = band.GetNoDataValue()
+        arr = band.ReadAsArray(c0, r0, c1 - c0, r1 - r0)
+        if nodata is None:
+            nodata = default_nodata(arr.dtype)
+        arr[~np.isin(labels[r0:r1, c0:c1], ids)] = nodata
+
+        geot = local.dataset.GetGeoTransform()
+        out = gdal.GetDriverByName("GTiff").Create(path, c1 - c0, r1 - r0, 1, band.DataType)
+        out.SetGeoTransform((geot[0] + c0 * geot[1], geot[1], 0.0, geot[3] + r0 * geot[5], 0.0, geot[5]))
+        out.SetProjection(local.dataset.GetProjection())
+        out_band = out.GetRasterBand(1)
+        out_band.SetNoDataValue(nodata)
+        out_band.WriteArray(arr)
+        out_band.FlushCache()
+        out = None
+        return path
+
+    with ThreadPoolExecutor(max_workers=max(1, int(max_threads))) as pool:
+        written = list(pool.map(clip, zones))
+    return [path for path in written if path is not None]
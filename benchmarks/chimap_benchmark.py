@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the chi integration of the ChiMap algorithm, reported as a fraction of the flow
+accumulation time (the landspy.Flow.flowAccumulation() loop over the topologically sorted cells).
+
+Usage:
+    python benchmarks/chimap_benchmark.py [--size 1000] [--flow flow.tif] [--threshold 100]
+
+Without --flow, a synthetic D8 flow over a random surface of size x size cells is used (only NumPy
+is needed). With --flow, a Flow raster saved by landspy is loaded (landspy and GDAL are needed).
+"""
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "algs"))
+from network_tools import NetworkGeometry
+
+
+class SyntheticFlow:
+    """
+    Minimal stand-in for landspy.Flow: D8 steepest descent receivers on a tilted random surface
+    """
+    def __init__(self, size, cellsize=10.0, seed=0):
+        rng = np.random.default_rng(seed)
+        rows, cols = np.mgrid[0:size, 0:size]
+        z = rows * 1.0 + np.abs(cols - size / 2) * 0.3 + rng.random((size, size)) * 0.5
+        self._dims = (size, size)
+        self._cellsize = (cellsize, -cellsize)
+
+        # Steepest lower neighbour for each cell
+        zp = np.pad(z, 1, constant_values=np.inf)
+        best = np.zeros(z.shape)
+        rcv = np.arange(z.size).reshape(z.shape)
+        for dr in (-1, 0, 1):
+            for dc in (-1, 0, 1):
+                if dr == 0 and dc == 0:
+                    continue
+                zn = zp[1 + dr:1 + dr + size, 1 + dc:1 + dc + size]
+                grad = (z - zn) / np.hypot(dr, dc)
+                upd = grad > best
+                best[upd] = grad[upd]
+                rcv[upd] = ((rows + dr) * size + cols + dc)[upd]
+
+        # Topological order: sorting by decreasing elevation puts givers before receivers
+        order = np.argsort(-z.ravel(), kind="stable")
+        rcv = rcv.ravel()
+        order = order[rcv[order] != order]
+        self._ix = order
+        self._ixc = rcv[order]
+        self._zx = z.ravel()[order]
+
+    def getDims(self):
+        return self._dims
+
+    def getCellSize(self):
+        return self._cellsize
+
+    def getGeot(self):
+        return (0., self._cellsize[0], 0., self._dims[0] * -self._cellsize[1], 0., self._cellsize[1])
+
+    def flowAccumulation(self, nodata=False, asgrid=False):
+        # Same loop as landspy.Flow.flowAccumulation()
+        facc = np.ones(self._dims[0] * self._dims[1], np.uint32)
+        for n in range(len(self._ix)):
+            facc[self._ixc[n]] += facc[self._ix[n]]
+        return facc.reshape(self._dims)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1000, help="Size of the synthetic grid (cells per side)")
+    parser.add_argument("--flow", default="", help="Flow raster saved by landspy (optional)")
+    parser.add_argument("--threshold", type=int, default=100, help="Channel threshold (cells)")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions of the chi integration")
+    args = parser.parse_args()
+
+    if args.flow:
+        from landspy import Flow
+        fd = Flow(args.flow)
+        source = args.flow
+    else:
+        fd = SyntheticFlow(args.size)
+        source = "synthetic {0}x{0}".format(args.size)
+
+    t0 = time.perf_counter()
+    fac = fd.flowAccumulation(nodata=False, asgrid=False)
+    t_fac = time.perf_counter() - t0
+
+    net = NetworkGeometry(fd, args.threshold, fac)
+
+    t_chi = np.inf
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        net.calculateChi(0.45)
+        t_chi = min(t_chi, time.perf_counter() - t0)
+
+    print("Flow:              {} ({} sorted cells)".format(source, len(fd._ix)))
+    print("Channel cells:     {}".format(net.ix.size))
+    print("Flow accumulation: {:.4f} s".format(t_fac))
+    print("Chi integration:   {:.4f} s ({:.2%} of flow accumulation)".format(t_chi, t_chi / t_fac))
+
+
+if __name__ == "__main__":
+    main()
@@ -18,6 +18,7 @@ import matplotlib.ticker as ticker
 import numpy as np
 from landspy import HCurve
 from .dialogs import ColorRampDialog, FigureGridDialog
+from .algs.curve_store import CurveList, load_curves
 
 
 class HypsometricWindow(QMainWindow):
@@ -42,9 +43,11 @@ class HypsometricWindow(QMainWindow):
         self.show_moments = 0
 
         # Hypsometric curve variables
-        self.curves = np.array([])
+        self.curves = CurveList()
         self.n_curves = 0
         self.active_curve = None
+        # Moments of all the curves (N x 5 array, see _get_moments), None if the curves have changed
+        self._moments = None
 
         # Display setting
         self.cmap = "RdYlBu"
@@ -211,52 +214,47 @@ class HypsometricWindow(QMainWindow):
 
     def loadCurves(self):
         """
-        This function load hypsometric curves into the App. Curves are loaded as a numpy array of HCurve objects
+        This function load hypsometric curves into the App. Curves are loaded from a curve file (see
+        algs/curve_store.py) and converted to HCurve objects only when they are used. Old numpy array files
+        with HCurve objects (.npy) are also loaded.
         """
-        file_filter = "Numpy array file (*.npy);;"
+        file_filter = "Hypsometric curves (*.hcv);;"
+        file_filter += "Numpy array file (*.npy);;"
         file_filter += "All Files (*.*)"
 
         url = QFileDialog.getOpenFileName(self, "Load curves", "", file_filter)
         filename = url[0]
         if not filename:
             return
-        mess = ""
 
-        # try:
-        curves = np.load(filename, allow_pickle=True)
-        curve = curves[0]
-
-        # Check if array contains HCurve instances
-        if type(curve) is not HCurve:
-            mess = "Cannot load Hypsometric curve, check the input file!"
-            raise TypeError
+        try:
+            curves = load_curves(filename)
+        except (TypeError, ValueError, OSError):
+            msg = QMessageBox(parent=self)
+            msg.setIcon(QMessageBox.Critical)
+            msg.setText("Cannot load Hypsometric curves, check the input file!")
+            msg.setWindowTitle("Error")
+            msg.show()
+            return
 
         # Set curves, n_curves, and active_curve
         self.curves = curves
         self.n_curves = len(curves)
+        self._moments = None
         self.active_curve = 0
 
         self._draw()
 
-        # except:
-        #     if not mess:
-        #         mess = "Error loading hypsometric curves"
-        #     msg = QMessageBox(parent=self)
-        #     msg.setIcon(QMessageBox.Critical)
-        #     msg.setText(mess)
-        #     msg.setWindowTitle("Error")
-        #     msg.show()
-
     def saveCurves(self):
         """
-        Save channels as a numpy array
+        Save curves as a curve file (see algs/curve_store.py)
         """
         # Check if App has curves
         if self.n_curves == 0:
             return
 
         dlg = QFileDialog(self)
-        file_filter = "Numpy array file (*.npy);;"
+        file_filter = "Hypsometric curves (*.hcv);;"
         file_filter += "All Files (*.*)"
 
         url = QFileDialog.getSaveFileName(self, "Save curves", "", file_filter)
@@ -265,7 +263,7 @@ class HypsometricWindow(QMainWindow):
             return
 
         try:
-            np.save(filename, self.curves, allow_pickle=True)
+            self.curves.save(filename)
         except:
             msg = QMessageBox(parent=self)
             msg.setIcon(QMessageBox.Critical)
@@ -282,16 +280,18 @@ class HypsometricWindow(QMainWindow):
             return
 
         # Removes current channel (self.active_channel)
-        if self.curves.size == 1:
+        if len(self.curves) == 1:
             # If the last curve is removed, empty the application
-            self.curves = np.array([])
+            self.curves = CurveList()
             self.n_curves = 0
             self.active_curve = None
+            self._moments = None
             self.ax.clear()
             self._format_ax(grids=True)
             self.canvas.draw()
         else:
-            self.curves = np.delete(self.curves, self.active_curve)
+            del self.curves[self.active_curve]
+            self._moments = None
             self.n_curves -= 1
             self.active_curve += 1
             self.active_curve = self.active_curve % self.n_curves
@@ -363,13 +363,13 @@ class HypsometricWindow(QMainWindow):
         try:
             curve = HCurve(filename)
             # Add curve to curve list
-
-            if self.curves.size == 0:
-                self.curves = np.array([curve])
+            self._moments = None
+            if len(self.curves) == 0:
+                self.curves = CurveList(curves=[curve])
                 self.active_curve = 0
                 self.n_curves = 1
             else:
-                self.curves = np.insert(self.curves, self.active_curve + 1, curve)
+                self.curves.insert(self.active_curve + 1, curve)
                 self.n_curves = len(self.curves)
                 self.active_curve += 1
 
@@ -382,6 +382,16 @@ class HypsometricWindow(QMainWindow):
             msg.setWindowTitle("Error")
             msg.show()
 
+    def _get_moments(self):
+        """
+        Returns the moments of all the curves (N x 5 array, same order as HCurve.moments). Moments are
+        read from the curve file or taken from the HCurve objects (see CurveList.getMoments), and cached
+        until the curve list changes.
+        """
+        if self._moments is None:
+            self._moments = self.curves.getMoments()
+        return self._moments
+
     def _draw(self, all_curves=False, metrics=False, legend=False):
         # Function to draw the active channel in the current graphic mode (self.mode)
         # If there are no curves in the graph, exit function
@@ -399,18 +409,16 @@ class HypsometricWindow(QMainWindow):
             cmap = plt.get_cmap(self.cmap)
             props_id = ["HI", "Kurtosis", "Skewness", "Density Kurtosis", "Density Skewness"]
             # Get property values for the curves
-            values = []
             if self.prop == "Id":
-                values = list(range(self.n_curves))
+                values = np.arange(self.n_curves)
             else:
-                for curva in self.curves:
-                    values.append(curva.moments[props_id.index(self.prop)])
+                values = self._get_moments()[:, props_id.index(self.prop)]
 
             # Get maximum and minimum value (for the color ramp)
-            maxvalue = max(values)
-            minvalue = min(values)
+            maxvalue = values.max()
+            minvalue = values.min()
             # Sort values
-            positions = np.array(values).argsort()
+            positions = values.argsort()
             for n in positions:
                 # Select curve
                 curva = self.curves[n]
@@ -419,7 +427,7 @@ class HypsometricWindow(QMainWindow):
                     val = n
                     color = cmap(n / self.n_curves)
                 else:
-                    val = curva.moments[props_id.index(self.prop)]
+                    val = values[n]
                     color = cmap((val - minvalue) / (maxvalue - minvalue))
 
                 # Labels for the legend. HI and other properties will have only 2 decimals
@@ -442,11 +450,12 @@ class HypsometricWindow(QMainWindow):
 
         # Show metrics in upper right corner if qa_showMetrics is checked
         if self.qa_showMetrics.isChecked():
+            moments = self._get_moments()[self.active_curve]
             cadena = "HI: {0:.3f}\n".format(curva.getHI())
-            cadena += "KU: {0:.3f}\n".format(curva.getKurtosis())
-            cadena += "SW: {0:.3f}\n".format(curva.getSkewness())
-            cadena += "DK: {0:.3f}\n".format(curva.getDensityKurtosis())
-            cadena += "DS: {0:.3f}".format(curva.getDensitySkewness())
+            cadena += "KU: {0:.3f}\n".format(moments[1])
+            cadena += "SW: {0:.3f}\n".format(moments[2])
+            cadena += "DK: {0:.3f}\n".format(moments[3])
+            cadena += "DS: {0:.3f}".format(moments[4])
             self.ax.text(0.775, 0.97, cadena, size=11, verticalalignment="top")
         # Refresh canvas
         self.canvas.draw()
@@ -527,17 +536,14 @@ class HypsometricWindow(QMainWindow):
         if not filename:
             return
 
-        fw = open(filename, "w")
-        fw.write("Name;HI;KUR;SK;DKUR;DSK\n")
-        for curva in self.curves:
-            name = curva.getName()
-            hi = curva.getHI()
-            kur = curva.getKurtosis()
-            sk = curva.getSkewness()
-            dkur = curva.getDensityKurtosis()
-            dsk = curva.getDensitySkewness()
-            linea = "{};{:.3f};{:.3f};{:.3f};{:.3f};{:.3f}\n".format(name, hi, kur, sk, dkur, dsk)
+        # Metrics of all the curves at once (without converting the stored curves to HCurves)
+        metrics = np.column_stack((self.curves.getHI(), self._get_moments()[:, 1:])).tolist()
+        lineas = ["Name;HI;KUR;SK;DKUR;DSK\n"]
+        for name, values in zip(self.curves.getNames(), metrics):
+            lineas.append("{};{:.3f};{:.3f};{:.3f};{:.3f};{:.3f}\n".format(name, *values))
 
+        fw = open(filename, "w")
+        fw.write("".join(lineas))
         fw.close()
         QMessageBox.about(self, "Hypsometric Curve", "Data exported to\n{}".format(filename))
 
@@ -31,6 +31,8 @@ import matplotlib.pyplot as plt
 import numpy as np
 from landspy import Channel
 from .dialogs import FigureGridDialog2
+from .algs.network_tools import calculate_channel_gradients, polyline_wkb
+from .algs.channel_store import ChannelCollection, load_channels
 
 
 class ProfilerWindow(QMainWindow):
@@ -75,8 +77,12 @@ class ProfilerWindow(QMainWindow):
         self.kpVl = None
         self.regVl = None
         
+        # Feature ids of the knickpoints and regressions in the temporary layers ((chid, id) -> [fids])
+        self.kp_fids = {}
+        self.reg_fids = {}
+        
         # Channels variables
-        self.channels = np.array([])
+        self.channels = ChannelCollection()
         self.n_channels = 0
         self.active_channel = None
         self.saved = True
@@ -345,30 +351,28 @@ class ProfilerWindow(QMainWindow):
         Load a channels file into the App. 
         """
         dlg = QFileDialog(self)
-        name = dlg.getOpenFileName(self, "Load channels")[0]
+        name = dlg.getOpenFileName(self, "Load channels", "", "Channel files (*.chn *.npy)")[0]
         mess = "Error loading channels!"
         
         if not name:
             return
         #try:
-        channels = np.load(name, allow_pickle=True)
-        canal = channels[0]
+        # Only the header and index of channel files are read. Channels are created when they are shown.
+        channels = load_channels(name)
 
-        # Check if array contains Channels instances
-        if type(canal) is not Channel:
+        # Check if file contains channels
+        if len(channels) == 0:
             mess = "Empty channel file!"
             raise TypeError
 
         # Check if all channels have the same crs
-        proj = canal.getCRS()
-        for canal in channels:
-            if canal.getCRS() != proj:
-                mess = "Channels have different coordinate systems"
-                raise TypeError
+        if not channels.hasSingleCRS():
+            mess = "Channels have different coordinate systems"
+            raise TypeError
 
         # Set channels, n_channels and active channel
         self.channels = channels
-        self.n_channels = len(channels)
+        self.n_channels = len(self.channels)
         self.active_channel = 0
 
         # If running inside QGIS, update temporary layers, before to draw
@@ -398,18 +402,20 @@ class ProfilerWindow(QMainWindow):
     
     def saveChannels(self):
         """
-        Save channels as a numpy array
+        Save channels as a channel file (see algs/channel_store.py)
         """
         # Check if App has channels
         if self.n_channels == 0:
             return
         
         dlg = QFileDialog(self)
-        name = dlg.getSaveFileName(self, "Save channels")[0]
+        name = dlg.getSaveFileName(self, "Save channels", "", "Channel files (*.chn)")[0]
         if not name:
             return
+        if os.path.splitext(name)[1] != ".chn":
+            name = os.path.splitext(name)[0] + ".chn"
         try:
-            np.save(name, self.channels, allow_pickle=True)
+            self.channels.save(name)
             self.saved = True
         except:
             msg = QMessageBox(parent=self)
@@ -431,14 +437,8 @@ class ProfilerWindow(QMainWindow):
         try:
             canal = Channel(name)
 
-            # Check if id of the channel already exists
-            id_list = [canal.getOid() for canal in self.channels]
-            if canal.getOid() in id_list:
-                max_id = max(id_list)
-                canal._oid = max_id + 1
-
-            # Add channel to channel list
-            self.channels = np.insert(self.channels, self.active_channel + 1, canal)
+            # Add channel to channel list (the collection gives a new id if the id of the channel already exists)
+            self.channels.insert(self.active_channel + 1, canal)
             self.n_channels = len(self.channels)
             self.active_channel += 1
             self.maintain_scale = False
@@ -491,12 +491,11 @@ class ProfilerWindow(QMainWindow):
             return
 
         # Removes current channel (self.active_channel)
-        if self.channels.size == 1:
-            self.channels = np.array([])
+        self.channels.pop(self.active_channel)
+        if self.n_channels == 1:
             self.n_channels = 0
             self.active_channel = None
         else:
-            self.channels = np.delete(self.channels, self.active_channel)
             self.n_channels -= 1
             self.active_channel += 1
             self.active_channel = self.active_channel % self.n_channels
@@ -593,7 +592,7 @@ class ProfilerWindow(QMainWindow):
 
         """
         # Get crs
-        wkt = self.channels[0].getCRS()
+        wkt = self.channels.getCRS()
         uri = "point?crs=" + wkt
         
         # Create new Vector layer in "memory"
@@ -644,7 +643,7 @@ class ProfilerWindow(QMainWindow):
         """
         
         # Get crs
-        wkt = self.channels[0].getCRS()
+        wkt = self.channels.getCRS()
         uri = "linestring?crs=" + wkt
         
         # Create new Vector layer in "memory"
@@ -670,7 +669,7 @@ class ProfilerWindow(QMainWindow):
         """
         
         # Get crs
-        wkt = self.channels[0].getCRS()
+        wkt = self.channels.getCRS()
         uri = "linestring?crs=" + wkt
         
         # Create new Vector layer in "memory"
@@ -695,25 +694,27 @@ class ProfilerWindow(QMainWindow):
         """       
         # First delete all features
         pr = self.channelVl.dataProvider()
-        listOfIds = [feat.id() for feat in self.channelVl.getFeatures()]
-        pr.deleteFeatures(listOfIds)
+        pr.truncate()
         
         # Load all channels
-        for canal in self.channels:
-            # Attributes
-            name = str(canal.getName())
-            oid = int(canal.getOid())
-            flow = int(canal.getFlow())
+        features = []
+        for idx in range(self.n_channels):
+            # Attributes (read from the channel collection, without creating the channels)
+            name = str(self.channels.getName(idx))
+            oid = int(self.channels.getOid(idx))
+            flow = int(self.channels.getFlow(idx))
             
-            # Geometry
-            xy = canal.getXY()
+            # Geometry (WKB encoded from the coordinates array)
+            line = QgsGeometry()
+            line.fromWkb(polyline_wkb(self.channels.getXY(idx)))
             
             f = QgsFeature()
-            point_list = [QgsPoint(row[0], row[1]) for row in xy]
-            f.setGeometry(QgsGeometry.fromPolyline(point_list))
+            f.setGeometry(line)
             f.setAttributes([name, oid, flow])
-            pr.addFeature(f)
+            features.append(f)
         
+        # Add all the features at once, and refresh when they are added
+        pr.addFeatures(features)
         self.channelVl.updateExtents()
         
         # Refresh canvas
@@ -732,31 +733,39 @@ class ProfilerWindow(QMainWindow):
               
         # First delete all features
         pr = self.kpVl.dataProvider()
-        listOfIds = [feat.id() for feat in self.kpVl.getFeatures()]
-        pr.deleteFeatures(listOfIds)
-        
-        # Load all channels
-        for canal in self.channels:
-            for kp in canal._kp:
-                chid = int(canal.getOid())
-                tipo = int(kp[1])
-                pos = int(kp[0])
-                ksn = float(canal._ksn[pos])
-                
-                # Adds the feature to temporary layer
-                pr = self.kpVl.dataProvider()
-                xy = canal.getXY()[pos]
-                f = QgsFeature()
-                f.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(xy[0], xy[1])))
-                # chid = 0
-                # pos = 0
-                # ksn = 0.0
-                # tipo = 0
-                f.setAttributes([chid, pos, ksn, tipo])
-                pr.addFeature(f)
-        
-        self.kpVl.updateExtents()
-        self.kpVl.triggerRepaint()
+        pr.truncate()
+        self.kp_fids = {}
+        
+        # Gather the knickpoints of all channels (coordinates and ksn of each channel taken at once)
+        chids, kps, xys, ksns = [], [], [], []
+        for idx in range(self.n_channels):
+            kp = self.channels.getKP(idx)
+            if kp.size == 0:
+                continue
+            pos = kp[:, 0].astype(int)
+            chids.append(np.full(pos.size, int(self.channels.getOid(idx))))
+            kps.append(kp)
+            xys.append(self.channels.getXY(idx)[pos])
+            ksns.append(self.channels.getField(idx, "_ksn")[pos])
+        
+        if not kps:
+            # The layer is empty after the truncate, its extent must be updated too
+            self.kpVl.updateExtents()
+            self.kpVl.triggerRepaint()
+            return
+        chids = np.concatenate(chids).tolist()
+        kps = np.concatenate(kps).astype(int).tolist()
+        xys = np.concatenate(xys).tolist()
+        ksns = np.concatenate(ksns).astype(float).tolist()
+        
+        # Adds all the features to the temporary layer at once
+        features = []
+        for chid, kp, xy, ksn in zip(chids, kps, xys, ksns):
+            f = QgsFeature()
+            f.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(xy[0], xy[1])))
+            f.setAttributes([chid, kp[0], ksn, kp[1]])
+            features.append(f)
+        self._add_features(self.kpVl, features, [(chid, kp[0]) for chid, kp in zip(chids, kps)], self.kp_fids)
 
     def updateRegLayer(self):
         """
@@ -769,34 +778,60 @@ class ProfilerWindow(QMainWindow):
         
         # First delete all features
         pr = self.regVl.dataProvider()
-        listOfIds = [feat.id() for feat in self.regVl.getFeatures()]
-        pr.deleteFeatures(listOfIds)
-        
-        # Load all regressions
-        for canal in self.channels:
-            for reg in canal._regressions:
+        pr.truncate()
+        self.reg_fids = {}
+        
+        # Load all regressions (only channels with regressions get their coordinates)
+        features = []
+        keys = []
+        for n in range(self.n_channels):
+            regressions = self.channels.getRegressions(n)
+            if not regressions:
+                continue
+            chid = int(self.channels.getOid(n))
+            xy = self.channels.getXY(n)
+            for reg in regressions:
                 pos1 = reg[1]
                 pos2 = reg[2]
                 ksn = float(reg[3][0])
                 r2ksn = float(reg[4])
-                chid = int(canal.getOid())
                 idx = reg[0]
-                ind = canal._ix[pos1:pos2]
-                row, col = canal.indToCell(ind)
-                xi, yi = canal.cellToXY(row, col)
-                xy = np.array((xi, yi)).T
                 
+                line = QgsGeometry()
+                line.fromWkb(polyline_wkb(xy[pos1:pos2]))
                 f = QgsFeature()
-                point_list = [QgsPoint(row[0], row[1]) for row in xy]
-                f.setGeometry(QgsGeometry.fromPolyline(point_list))
+                f.setGeometry(line)
                 f.setAttributes([chid, idx, ksn, r2ksn])
-                pr.addFeature(f)
+                features.append(f)
+                keys.append((chid, idx))
         
-        # Refresh
+        # Add all the features at once and refresh
+        self._add_features(self.regVl, features, keys, self.reg_fids)
         self.iface.mapCanvas().refresh()
-        self.regVl.updateExtents()
-        self.regVl.triggerRepaint()
+    
+    def _add_features(self, vl, features, keys, fids):
+        """
+        Adds features to a temporary layer and saves their feature ids in a feature index, so they can
+        be deleted without searching the layer.
+
+        Parameters
+        ----------
+        vl : QgsVectorLayer
+            Temporary layer (memory provider, which sets the ids of the added features)
+        features : list
+            Features to add
+        keys : list
+            Key of each feature in the index (chid, id)
+        fids : dict
+            Feature index (key -> list of feature ids)
+        """
+        ok, added = vl.dataProvider().addFeatures(features)
+        for key, feat in zip(keys, added):
+            fids.setdefault(key, []).append(feat.id())
+        vl.updateExtents()
+        vl.triggerRepaint()
         
+
     def addKP(self, canal, pos, tipo):
         
         canal.addKP(pos, tipo)
@@ -808,24 +843,20 @@ class ProfilerWindow(QMainWindow):
             ksn = float(canal._ksn[pos])
             
             # Adds the feature to temporary layer
-            pr = self.kpVl.dataProvider()
             xy = canal.getXY()[pos]
             f = QgsFeature()
             f.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(xy[0], xy[1])))
             f.setAttributes([chid, pos, ksn, tipo])
-            pr.addFeature(f)
-            self.kpVl.updateExtents()
-            self.kpVl.triggerRepaint()
+            self._add_features(self.kpVl, [f], [(chid, pos)], self.kp_fids)
             self.saved = False
     
     def removeKP(self, canal, pos):
         canal.removeKP(pos)
         if self.iface:
-            self.kpVl.removeSelection()
-            self.kpVl.selectByExpression('"id" = {} and "chid" = {}'.format(pos, int(canal.getOid())))
-            idxs = self.kpVl.selectedFeatureIds()
-            pr = self.kpVl.dataProvider()
-            pr.deleteFeatures(idxs)
+            # Delete the features of the knickpoint (by feature id)
+            idxs = self.kp_fids.pop((int(canal.getOid()), int(pos)), [])
+            self.kpVl.dataProvider().deleteFeatures(idxs)
+            self.kpVl.triggerRepaint()
             self.saved = False
             
     def addReg(self, canal, pos1, pos2):
@@ -838,7 +869,6 @@ class ProfilerWindow(QMainWindow):
         if self.iface:
             try:
                 reg = canal.getRegression(idx)
-                pr = self.regVl.dataProvider()
                 
                 # Attributes
                 ksn = float(reg[3][0])
@@ -846,21 +876,16 @@ class ProfilerWindow(QMainWindow):
                 chid = int(canal.getOid())
                 
                 # Geometry
-                ind = canal._ix[pos1:pos2]
-                row, col = canal.indToCell(ind)
-                xi, yi = canal.cellToXY(row, col)
-                xy = np.array((xi, yi)).T
+                line = QgsGeometry()
+                line.fromWkb(polyline_wkb(canal.getXY()[pos1:pos2]))
                 
                 # Add Feature
                 f = QgsFeature()
-                point_list = [QgsPoint(row[0], row[1]) for row in xy]
-                f.setGeometry(QgsGeometry.fromPolyline(point_list))
+                f.setGeometry(line)
                 f.setAttributes([chid, idx, ksn, r2ksn])
-                pr.addFeature(f)
                 
-                # Update extents and repaint
-                self.regVl.updateExtents()
-                self.regVl.triggerRepaint()
+                # Add Feature (updates extents and repaints)
+                self._add_features(self.regVl, [f], [(chid, idx)], self.reg_fids)
                 self.saved = False
                 return True
             
@@ -874,13 +899,11 @@ class ProfilerWindow(QMainWindow):
             idx = reg[0]
             canal.removeRegression(idx)
             
-        if self.iface:
-
-            self.regVl.removeSelection()
-            self.regVl.selectByExpression('"id" = {} and "chid" = {}'.format(idx, int(canal.getOid())))
-            idxs = self.regVl.selectedFeatureIds()
-            pr = self.regVl.dataProvider()
-            pr.deleteFeatures(idxs)
+        if self.iface and reg:
+            # Delete the features of the regression (by feature id)
+            idxs = self.reg_fids.pop((int(canal.getOid()), int(idx)), [])
+            self.regVl.dataProvider().deleteFeatures(idxs)
+            self.regVl.triggerRepaint()
             self.saved = False
    
     def exportChannelData(self):
@@ -1259,8 +1282,8 @@ class ProfilerWindow(QMainWindow):
             canal._zx[ind1:ind2+1] = yi
             
         # Recalculate gradients
-        canal.calculateGradients(canal._slp_np, 'slp')
-        canal.calculateGradients(canal._ksn_np, 'ksn')
+        calculate_channel_gradients(canal, canal._slp_np, 'slp')
+        calculate_channel_gradients(canal, canal._ksn_np, 'ksn')
         
         # Clear current_regression list and draw
         self.current_regression = []
@@ -1279,17 +1302,18 @@ class ProfilerWindow(QMainWindow):
         n_points = self.qspin_nPoint.value()
         # If mode == 3, recalculate slope
         if self.mode == 3:
-            canal.calculateGradients(n_points, 'slp')
+            calculate_channel_gradients(canal, n_points, 'slp')
         # If mode == 4, recalculate ksn
         elif self.mode == 4:
-            canal.calculateGradients(n_points, 'ksn')
+            calculate_channel_gradients(canal, n_points, 'ksn')
 
         self.saved = False
         self._draw()
         
     def nextProfile(self, direction):
         # Handler to tb_button_prev and tb_button_next buttons 
-        # Select the next / previous channel of the channel list (self.channels)
+        # Select the next / previous channel of the channel list (self.channels). The channel is
+        # created when it is drawn (and kept in the cache of the channel collection)
         if self.n_channels == 0:
             return
         
@@ -1321,8 +1345,8 @@ class ProfilerWindow(QMainWindow):
         canal._zx = np.copy(canal._zx0)
         
         # Recalculate gradients
-        canal.calculateGradients(canal._slp_np, 'slp')
-        canal.calculateGradients(canal._ksn_np, 'ksn')
+        calculate_channel_gradients(canal, canal._slp_np, 'slp')
+        calculate_channel_gradients(canal, canal._ksn_np, 'ksn')
         self.maintain_scale = False
         self.saved = False
         self._draw()
@@ -1361,7 +1385,9 @@ class ProfilerWindow(QMainWindow):
                 qm = QMessageBox()
                 qm.critical(self, "Input error", "Wrong window size entered!")
                 return
-            canal.smoothChannel(winsize=winsize)
+            canal.smoothChannel(winsize=winsize, recalculate_gradients=False)
+            calculate_channel_gradients(canal, canal._ksn_np, 'ksn')
+            calculate_channel_gradients(canal, canal._slp_np, 'slp')
 
         self.maintain_scale = False
         self.saved = False